@@ -0,0 +1,65 @@
+"""
+Scaling benchmark of select_leaf_directories against the former pairwise
+comparison of all directories.
+
+Run as `python benchmarks/bench_leaf_directories.py`.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import argparse
+import time
+from pathlib import PurePosixPath
+
+from redep.util import select_leaf_directories
+
+
+def select_leaf_directories_pairwise(directories):
+    leaf_dirs = set(directories)
+    for dir1 in directories:
+        for dir2 in directories:
+            if dir1 != dir2 and dir2.is_relative_to(dir1):
+                leaf_dirs.discard(dir1)
+                break
+    return leaf_dirs
+
+
+def make_directories(count, fan_out=10):
+    """Create a balanced tree of `count` directories."""
+    root = PurePosixPath("/root")
+    directories = [root]
+    i = 0
+    while len(directories) < count:
+        directories.append(directories[i // fan_out] / f"d{i}")
+        i += 1
+    return set(directories)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument(
+        "--pairwise-limit",
+        type=int,
+        default=1_000,
+        help="largest size for which the quadratic implementation is run",
+    )
+    args = parser.parse_args()
+    for size in args.sizes:
+        directories = make_directories(size)
+        start = time.perf_counter()
+        leaf_dirs = select_leaf_directories(directories)
+        sorted_time = time.perf_counter() - start
+        line = f"{size:>9} directories: sorted {sorted_time:8.3f} s"
+        if size <= args.pairwise_limit:
+            start = time.perf_counter()
+            assert select_leaf_directories_pairwise(directories) == leaf_dirs
+            line += f", pairwise {time.perf_counter() - start:8.3f} s"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark of select_local_patterns against the former approach, which ran one
+recursive glob per pattern.
+
+The synthetic tree mimics a project with a large ignored dependency directory.
+Run as `python benchmarks/bench_select_local.py --entries 100000`.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import argparse
+import glob
+import tempfile
+import time
+from pathlib import Path
+
+from redep.util import select_local_patterns
+
+
+def select_local_patterns_with_glob(root_dir, match_patterns, ignore_patterns):
+    all_patterns = set()
+    for pattern in match_patterns:
+        all_patterns.update(
+            glob.glob(str(root_dir / pattern), recursive=True, include_hidden=True)
+        )
+    ignored_patterns = set()
+    for pattern in ignore_patterns:
+        ignored_patterns.update(
+            glob.glob(str(root_dir / pattern), recursive=True, include_hidden=True)
+        )
+    all_files = {Path(f) for f in all_patterns if Path(f).is_file()}
+    all_dirs = {Path(f) for f in all_patterns if Path(f).is_dir()}
+    ignored_files = {Path(f) for f in ignored_patterns if Path(f).is_file()}
+    ignored_dirs = {Path(f) for f in ignored_patterns if Path(f).is_dir()}
+    return all_files - ignored_files, all_dirs - ignored_dirs
+
+
+def make_tree(root_dir, entries, ignored_fraction=0.8, files_per_dir=20):
+    """Create about `entries` empty files, most of them in an ignored directory."""
+    ignored = int(entries * ignored_fraction)
+    for i in range(entries):
+        base = root_dir / "node_modules" if i < ignored else root_dir / "src"
+        directory = base / f"d{i // files_per_dir // 50}" / f"d{i // files_per_dir}"
+        if i % files_per_dir == 0:
+            directory.mkdir(parents=True, exist_ok=True)
+        (directory / f"f{i}.txt").touch()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--entries", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    matches = [Path("*"), Path("**/*")]
+    ignores = [Path("./redep.toml"), Path("./node_modules/**"), Path("**/*.log")]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root_dir = Path(temp_dir)
+        make_tree(root_dir, args.entries)
+        for name, function in [
+            ("glob per pattern", select_local_patterns_with_glob),
+            ("single scandir walk", select_local_patterns),
+        ]:
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                result = function(root_dir, matches, ignores)
+                best = min(best, time.perf_counter() - start)
+            print(
+                f"{name:>20}: {best:8.3f} s for {args.entries} entries "
+                f"({len(result[0])} files selected)"
+            )
+
+
+if __name__ == "__main__":
+    main()
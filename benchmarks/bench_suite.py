@@ -0,0 +1,286 @@
+"""
+Benchmark suite of local selection and transfer on synthetic trees.
+
+Each scenario generates a reproducible tree (many tiny files, few huge files,
+deep nesting, wide directories, heavy ignore patterns) at several scales, and
+times select_local_patterns, select_leaf_directories, push_local and
+pull_local on it. Every operation runs in a fresh process, so that its peak
+resident set size (RSS) is not inflated by the previous ones.
+
+Run as `python benchmarks/bench_suite.py --output results.json`, and compare
+two runs (for example of two versions) with
+`python benchmarks/bench_suite.py --compare old.json new.json`.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import redep
+from redep.manifest import MANIFEST_NAME
+from redep.pull import pull_local
+from redep.push import push_local
+from redep.util import select_leaf_directories, select_local_patterns
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+SEED = 1234
+MATCHES = [Path("*"), Path("**/*")]
+IGNORES = [Path("./redep.toml"), Path("**/*.log")]
+OPERATIONS = [
+    "select_local_patterns",
+    "select_leaf_directories",
+    "push_local",
+    "pull_local",
+]
+
+
+def write_file(path, size, rng):
+    with open(path, "wb") as f:
+        while size > 0:
+            block = min(size, 1024 * 1024)
+            f.write(rng.randbytes(block))
+            size -= block
+
+
+def make_tiny(root_dir, scale, rng):
+    """Many files of at most 1 KiB, 100 per directory."""
+    for i in range(round(20_000 * scale)):
+        directory = root_dir / f"d{i // 10_000}" / f"d{i // 100}"
+        if i % 100 == 0:
+            directory.mkdir(parents=True, exist_ok=True)
+        write_file(directory / f"f{i}.txt", rng.randint(0, 1024), rng)
+    return IGNORES
+
+
+def make_huge(root_dir, scale, rng):
+    """A few files of 64 MiB."""
+    for i in range(max(1, round(4 * scale))):
+        write_file(root_dir / f"huge{i}.bin", 64 * 1024 * 1024, rng)
+    return IGNORES
+
+
+def make_deep(root_dir, scale, rng):
+    """Chains of 64 nested directories, with one file at each level."""
+    for chain in range(max(1, round(160 * scale))):
+        directory = root_dir / f"chain{chain}"
+        for level in range(64):
+            directory = directory / f"level{level}"
+            directory.mkdir(parents=True)
+            write_file(directory / "file.txt", rng.randint(0, 1024), rng)
+    return IGNORES
+
+
+def make_wide(root_dir, scale, rng):
+    """A few directories holding thousands of files each."""
+    for i in range(round(20_000 * scale)):
+        directory = root_dir / f"wide{i % 2}"
+        if i < 2:
+            directory.mkdir()
+        write_file(directory / f"f{i}.txt", rng.randint(0, 1024), rng)
+    return IGNORES
+
+
+def make_ignored(root_dir, scale, rng):
+    """Mostly ignored files, matched by many ignore patterns."""
+    extensions = [f"tmp{i}" for i in range(50)]
+    ignores = IGNORES + [
+        Path("./node_modules/**"),
+        Path("./build/**"),
+        Path("**/__pycache__/**"),
+    ]
+    ignores += [Path(f"**/*.{extension}") for extension in extensions]
+    for i in range(round(20_000 * scale)):
+        kind = i % 5
+        if kind < 2:
+            directory = root_dir / "node_modules" / f"p{i // 500}"
+            name = f"f{i}.js"
+        elif kind == 2:
+            directory = root_dir / "src" / f"m{i // 500}" / "__pycache__"
+            name = f"f{i}.pyc"
+        elif kind == 3:
+            directory = root_dir / "src" / f"m{i // 500}"
+            name = f"f{i}.{rng.choice(extensions)}"
+        else:
+            directory = root_dir / "src" / f"m{i // 500}"
+            name = f"f{i}.py"
+        directory.mkdir(parents=True, exist_ok=True)
+        write_file(directory / name, rng.randint(0, 1024), rng)
+    return ignores
+
+
+SCENARIOS = {
+    "tiny": make_tiny,
+    "huge": make_huge,
+    "deep": make_deep,
+    "wide": make_wide,
+    "ignored": make_ignored,
+}
+
+
+def peak_rss():
+    """Return the peak RSS of this process in bytes, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kibibytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_operation(operation, source_dir, work_dir, ignores, repeat):
+    """
+    Run an operation repeat times on the tree in source_dir, and return the
+    best wall time, with the number of files and bytes it handled.
+    """
+    logging.disable(logging.CRITICAL)
+    files, dirs, _, _ = select_local_patterns(source_dir, MATCHES, ignores)
+    size = sum(f.stat().st_size for f in files)
+    if operation == "pull_local":
+        pulled_dir = work_dir / "pulled"
+        push_local(files, dirs, source_dir, pulled_dir, full=True)
+        # as in pull, leave out the manifest that push_local writes there
+        files, dirs, _, _ = select_local_patterns(
+            pulled_dir, MATCHES, ignores + [Path(MANIFEST_NAME)]
+        )
+    best = float("inf")
+    for i in range(repeat):
+        target_dir = work_dir / f"target{i}"
+        start = time.perf_counter()
+        if operation == "select_local_patterns":
+            select_local_patterns(source_dir, MATCHES, ignores)
+        elif operation == "select_leaf_directories":
+            select_leaf_directories(dirs)
+        elif operation == "push_local":
+            push_local(files, dirs, source_dir, target_dir, full=True)
+        elif operation == "pull_local":
+            pull_local(files, dirs, pulled_dir, target_dir)
+        best = min(best, time.perf_counter() - start)
+        shutil.rmtree(target_dir, ignore_errors=True)
+    count = len(dirs) if operation == "select_leaf_directories" else len(files)
+    handled = size if operation in ("push_local", "pull_local") else 0
+    return best, count, handled
+
+
+def run_in_child(queue, *args):
+    result = run_operation(*args)
+    queue.put((*result, peak_rss()))
+
+
+def measure(scenario, scale, operation, source_dir, ignores, repeat):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    with tempfile.TemporaryDirectory() as work_dir:
+        process = context.Process(
+            target=run_in_child,
+            args=(queue, operation, source_dir, Path(work_dir), ignores, repeat),
+        )
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError(f"{operation} failed on the {scenario} tree")
+        seconds, count, size, rss = queue.get()
+    seconds = max(seconds, 1e-9)
+    return {
+        "scenario": scenario,
+        "scale": scale,
+        "operation": operation,
+        "items": count,
+        "bytes": size,
+        "seconds": seconds,
+        "items_per_second": count / seconds,
+        "mb_per_second": size / seconds / 1e6 if size else None,
+        "peak_rss": rss,
+    }
+
+
+def format_result(result):
+    line = (
+        f"{result['scenario']:>8} x{result['scale']:<5g} {result['operation']:>24}: "
+        f"{result['seconds']:8.3f} s, {result['items_per_second']:>11.0f} items/s"
+    )
+    if result["mb_per_second"] is not None:
+        line += f", {result['mb_per_second']:8.1f} MB/s"
+    if result["peak_rss"] is not None:
+        line += f", peak RSS {result['peak_rss'] / 1e6:7.1f} MB"
+    return line
+
+
+def compare(old_path, new_path):
+    """Print the relative change of wall time and peak RSS between two runs."""
+    old = json.loads(Path(old_path).read_text())
+    new = json.loads(Path(new_path).read_text())
+    print(f"{old['version']} -> {new['version']}")
+    old_results = {
+        (r["scenario"], r["scale"], r["operation"]): r for r in old["results"]
+    }
+    for result in new["results"]:
+        key = (result["scenario"], result["scale"], result["operation"])
+        if key not in old_results:
+            continue
+        before = old_results[key]
+        change = result["seconds"] / before["seconds"] - 1
+        line = f"{key[0]:>8} x{key[1]:<5g} {key[2]:>24}: time {change:+7.1%}"
+        if result["peak_rss"] and before["peak_rss"]:
+            line += f", peak RSS {result['peak_rss'] / before['peak_rss'] - 1:+7.1%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS)
+    )
+    parser.add_argument(
+        "--operations", nargs="+", choices=OPERATIONS, default=OPERATIONS
+    )
+    parser.add_argument("--scales", type=float, nargs="+", default=[0.1, 1])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("OLD", "NEW"),
+        help="compare two JSON results instead of running",
+    )
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+    results = []
+    for scenario in args.scenarios:
+        for scale in args.scales:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                source_dir = Path(temp_dir)
+                ignores = SCENARIOS[scenario](source_dir, scale, random.Random(SEED))
+                for operation in args.operations:
+                    result = measure(
+                        scenario, scale, operation, source_dir, ignores, args.repeat
+                    )
+                    print(format_result(result), flush=True)
+                    results.append(result)
+    report = {
+        "version": redep.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,20 @@ Authors: Giulio Foletto.
 License: See project-level license file.
 """
 
-from redep.cli import cli
-from redep.util import configure_logging
+import sys
+
+from redep.daemon import run_in_daemon
 
 
 def main():
+    # hand the command to the daemon if it is running, before importing fabric
+    status = run_in_daemon(sys.argv[1:])
+    if status is not None:
+        sys.exit(status)
+
+    from redep.cli import cli
+    from redep.util import configure_logging
+
     configure_logging()
     cli(
         windows_expand_args=False
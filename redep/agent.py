@@ -0,0 +1,308 @@
+"""
+Client of the helper (see redep.helper) that runs on remote hosts using the
+"agent" transport.
+
+The helper is started once per host, with python3 on an exec channel of the
+connection, and stays up for the whole run. Listing, directory creation and
+hashing then take a single round trip each, and files are streamed to and
+from it back to back, without waiting for each one to be acknowledged.
+Hosts where it cannot start (e.g., without python3, or on Windows) fall back
+to shell commands and SFTP.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import json
+import logging
+import os
+from queue import Queue
+from threading import Lock, Thread
+
+from redep import metrics, progress
+from redep.bandwidth import throttle, throttled_writer
+from redep.helper import (
+    CHUNK_SIZE,
+    DATA,
+    END,
+    ERROR,
+    GET,
+    HASH,
+    HELLO,
+    LIST,
+    MKDIR,
+    PUT,
+    VERSION,
+    helper_command,
+    read_frame,
+    write_frame,
+)
+from redep.orchestrator import check_cancelled, is_cancelled
+from redep.resume import PARTIAL_SUFFIX
+from redep.util import close_exec_channel, identify_remote_os, open_exec_channel
+
+lock = Lock()
+agent_hosts = set()
+agents = {}
+host_locks = {}
+
+
+class AgentError(Exception):
+    """Raised when the helper reports an error, or stops answering."""
+
+
+class Agent:
+    """Connection to the helper running on a remote host, over one exec channel."""
+
+    def __init__(self, conn):
+        self.host = conn.original_host
+        self.channel = open_exec_channel(conn, helper_command("serve"))
+        self.input = self.channel.makefile("rb")
+        self.output = self.channel.makefile_stdin("wb")
+        self.lock = Lock()
+        self.closed = False
+        try:
+            version = self.request(HELLO)
+        except (AgentError, OSError, EOFError) as e:
+            _, stderr = close_exec_channel(self.channel)
+            self.closed = True
+            raise AgentError(stderr.strip() or str(e))
+        if version != VERSION:
+            self.close()
+            raise AgentError(f"Unexpected helper version {version!r}")
+
+    def receive(self):
+        op, payload = read_frame(self.input)
+        if op is None:
+            raise AgentError("The helper exited")
+        return op, payload
+
+    def request(self, op, payload=b""):
+        """Send a request, and return the payload of its response."""
+        with self.lock:
+            if self.closed:
+                raise AgentError("The helper was stopped")
+            try:
+                write_frame(self.output, op, payload)
+                self.output.flush()
+                metrics.count(self.host, "round_trips")
+                reply, payload = self.receive()
+            except (OSError, EOFError) as e:
+                self.close()
+                raise AgentError(str(e))
+        if reply == ERROR:
+            raise AgentError(payload.decode(errors="replace"))
+        return payload
+
+    def list_tree(self, root, prune_paths=(), prune_names=()):
+        """List everything below root, in the format of list_remote_tree's find command."""
+        request = {
+            "root": root,
+            "prune_paths": list(prune_paths),
+            "prune_names": list(prune_names),
+        }
+        return self.request(LIST, json.dumps(request).encode()).decode(errors="replace")
+
+    def make_directories(self, paths):
+        """Create directories and their parents, and return the errors."""
+        errors = self.request(MKDIR, b"".join(os.fsencode(p) + b"\0" for p in paths))
+        return errors.decode(errors="replace").splitlines()
+
+    def hash_files(self, paths):
+        """Return the SHA-256 of the files that could be read, keyed by path."""
+        payload = self.request(HASH, b"".join(os.fsencode(p) + b"\0" for p in paths))
+        digests = payload.decode().split("\0")
+        return {path: digest for path, digest in zip(paths, digests) if digest}
+
+    def put_files(self, items, progress_key=None):
+        """
+        Send (local path, remote path, hasher) items to the helper, without
+        waiting for each to be written, feeding each hasher (if not None) with
+        the data sent, and counting it in the progress of progress_key (if not
+        None) as it is sent.
+
+        Yield each item with None once it is written, or with the error that
+        prevented it.
+        """
+        sent = Queue()
+
+        def send_all():
+            output = throttled_writer(self.output, self.host)
+            try:
+                for item in items:
+                    if is_cancelled():
+                        break
+                    local_path, str_remote_path, hasher = item
+                    try:
+                        source = open(local_path, "rb")
+                    except OSError as e:
+                        sent.put((item, e))
+                        continue
+                    with source:
+                        mode = os.fstat(source.fileno()).st_mode & 0o7777
+                        header = {"path": str_remote_path, "mode": mode}
+                        write_frame(output, PUT, json.dumps(header).encode())
+                        while True:
+                            block = source.read(CHUNK_SIZE)
+                            if not block:
+                                break
+                            if hasher is not None:
+                                hasher.update(block)
+                            write_frame(output, DATA, block)
+                            if progress_key is not None:
+                                progress.advance(progress_key, len(block), files=0)
+                        write_frame(output, END)
+                    sent.put((item, None))
+                self.output.flush()
+                sent.put(None)
+            except Exception as e:
+                sent.put(e)
+
+        with self.lock:
+            if self.closed:
+                raise AgentError("The helper was stopped")
+            sender = Thread(target=send_all)
+            sender.start()
+            try:
+                while True:
+                    entry = sent.get()
+                    if entry is None:
+                        break
+                    if isinstance(entry, Exception):
+                        raise AgentError(str(entry))
+                    item, error = entry
+                    if error is None:
+                        reply, payload = self.receive()
+                        if reply == ERROR:
+                            error = AgentError(payload.decode(errors="replace"))
+                    yield item, error
+            except BaseException:
+                # the responses still in flight cannot be matched anymore
+                self.close()
+                raise
+            finally:
+                sender.join()
+        metrics.count(self.host, "round_trips")
+
+    def get_files(self, items, progress_key=None):
+        """
+        Receive (remote path, local path, hasher) items from the helper,
+        requesting them all at once, feeding each hasher (if not None) with
+        the data received, and counting it in the progress of progress_key
+        (if not None) as it is received. Files are written to a temporary
+        file, which is moved into place once complete.
+
+        Yield each item with None once it is written, or with the error that
+        prevented it.
+        """
+        items = list(items)
+
+        def send_all():
+            try:
+                for str_remote_path, _, _ in items:
+                    write_frame(self.output, GET, os.fsencode(str_remote_path))
+                self.output.flush()
+            except OSError as e:
+                logging.debug(f"Requests to the helper on {self.host} failed: {e}")
+
+        with self.lock:
+            if self.closed:
+                raise AgentError("The helper was stopped")
+            # send the requests while receiving the files, so that neither side blocks
+            sender = Thread(target=send_all)
+            sender.start()
+            try:
+                for item in items:
+                    yield item, self.receive_file(item, progress_key)
+                    check_cancelled()
+            except BaseException:
+                self.close()
+                raise
+            finally:
+                sender.join()
+        metrics.count(self.host, "round_trips")
+
+    def receive_file(self, item, progress_key=None):
+        _, local_path, hasher = item
+        temp_path = local_path.with_name(local_path.name + PARTIAL_SUFFIX)
+        with open(temp_path, "wb") as output:
+            while True:
+                reply, payload = self.receive()
+                if reply != DATA:
+                    break
+                throttle(self.host, len(payload))
+                if hasher is not None:
+                    hasher.update(payload)
+                output.write(payload)
+                if progress_key is not None:
+                    progress.advance(progress_key, len(payload), files=0)
+        if reply == END:
+            os.chmod(temp_path, json.loads(payload)["mode"])
+            os.replace(temp_path, local_path)
+            return None
+        temp_path.unlink(missing_ok=True)
+        return AgentError(payload.decode(errors="replace"))
+
+    def close(self):
+        """Stop the helper; its channel cannot be used anymore."""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.channel.close()
+        except Exception as e:
+            logging.debug(f"Could not close the helper channel to {self.host}: {e}")
+
+
+def configure_agents(remotes):
+    """Use the helper with the hosts of remotes whose transport is "agent"."""
+    with lock:
+        agent_hosts.clear()
+        for remote in remotes:
+            if remote.get("host", "") and remote.get("transport", None) == "agent":
+                agent_hosts.add(remote["host"])
+
+
+def get_agent(conn):
+    """
+    Return the agent of the host of conn, starting its helper if needed, or
+    None if the host does not use one or the helper cannot start there.
+    """
+    host = conn.original_host
+    if host not in agent_hosts:
+        return None
+    with lock:
+        host_lock = host_locks.setdefault(host, Lock())
+    # one lock per host, so that slow hosts do not delay the others
+    with host_lock:
+        agent = agents.get(host)
+        if agent is False:
+            return None
+        if agent is not None and not agent.closed:
+            return agent
+        if identify_remote_os(conn) == "windows":
+            logging.warning(
+                f"The helper is not supported on Windows hosts; using shell commands and SFTP with {host}."
+            )
+            agents[host] = False
+            return None
+        try:
+            with metrics.span("start_helper", destination=host):
+                agent = Agent(conn)
+        except Exception as e:
+            logging.warning(
+                f"Could not start the helper on {host} ({e}); using shell commands and SFTP."
+            )
+            agents[host] = False
+            return None
+        agents[host] = agent
+        return agent
+
+
+def close_agents():
+    """Stop the helpers started in this run."""
+    with lock:
+        started = [agent for agent in agents.values() if agent]
+        agents.clear()
+    for agent in started:
+        agent.close()
@@ -0,0 +1,169 @@
+"""
+Bandwidth limits, so that transfers leave room for other traffic on the
+same link.
+
+Limits are enforced with token buckets, one for all transfers together and
+one per remote host, which the transfer loops draw from for every chunk they
+send or receive. A limit is given in bytes per second (e.g., "10M"), or as a
+percentage of the bandwidth of the link (e.g., "30%"), which then must be set
+with the bandwidth option.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import logging
+import time
+from threading import Lock
+
+from redep.util import parse_size
+
+# largest burst allowed above the limit, in seconds of transfer
+BURST_SECONDS = 0.1
+
+lock = Lock()
+global_bucket = None
+host_buckets = {}
+
+
+class TokenBucket:
+    """Let through at most rate bytes per second, in bursts of at most capacity bytes."""
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.capacity = self.rate * BURST_SECONDS
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = Lock()
+
+    def consume(self, amount):
+        """Take amount bytes from the bucket, sleeping while it is in debt."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            # go into debt, so that large chunks and many threads share fairly
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+def parse_limit(value, bandwidth=None):
+    """
+    Parse a limit in bytes per second, given as a size or as a percentage of
+    bandwidth. Return None if there is no limit.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str) and value.strip().endswith("%"):
+        if bandwidth is None:
+            logging.warning(
+                f"Bandwidth limit {value} needs the bandwidth option; not limiting."
+            )
+            return None
+        limit = parse_size(bandwidth) * float(value.strip()[:-1]) / 100
+    else:
+        limit = parse_size(value)
+    if limit <= 0:
+        logging.warning(f"Invalid bandwidth limit {value!r}; not limiting.")
+        return None
+    return limit
+
+
+def configure_global_limit(value, bandwidth=None):
+    """Limit the total bandwidth of all transfers (no limit if value is None)."""
+    global global_bucket
+    limit = parse_limit(value, bandwidth)
+    with lock:
+        global_bucket = TokenBucket(limit) if limit is not None else None
+
+
+def configure_remote_limits(remotes):
+    """
+    Limit the bandwidth of transfers with each remote host according to the
+    bwlimit option of its entries (the lowest one, if there are several).
+    """
+    limits = {}
+    for remote in remotes:
+        host = remote.get("host", "")
+        if not host:
+            continue
+        limit = parse_limit(remote.get("bwlimit", None), remote.get("bandwidth", None))
+        if limit is not None:
+            limits[host] = min(limit, limits.get(host, limit))
+    with lock:
+        host_buckets.clear()
+        for host, limit in limits.items():
+            host_buckets[host] = TokenBucket(limit)
+
+
+def buckets(host):
+    bucket = host_buckets.get(host)
+    return [b for b in (bucket, global_bucket) if b is not None]
+
+
+def throttle(host, amount):
+    """Wait until amount bytes can be transferred with host within the limits."""
+    for bucket in buckets(host):
+        bucket.consume(amount)
+
+
+def transfer_callback(host):
+    """
+    Return a callback for the SFTP transfers of paramiko, which throttles
+    them, or None if transfers with host are not limited.
+    """
+    if not buckets(host):
+        return None
+    done = 0
+
+    def callback(transferred, total):
+        nonlocal done
+        throttle(host, transferred - done)
+        done = transferred
+
+    return callback
+
+
+class ThrottledWriter:
+    """Write to a stream within the bandwidth limits of a host."""
+
+    def __init__(self, stream, host):
+        self.stream = stream
+        self.host = host
+
+    def write(self, data):
+        throttle(self.host, len(data))
+        return self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.stream.close()
+
+
+class ThrottledReader:
+    """Read from a stream within the bandwidth limits of a host."""
+
+    def __init__(self, stream, host):
+        self.stream = stream
+        self.host = host
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        throttle(self.host, len(data))
+        return data
+
+
+def throttled_writer(stream, host):
+    """Wrap a stream in a ThrottledWriter, if transfers with host are limited."""
+    return ThrottledWriter(stream, host) if buckets(host) else stream
+
+
+def throttled_reader(stream, host):
+    """Wrap a stream in a ThrottledReader, if transfers with host are limited."""
+    return ThrottledReader(stream, host) if buckets(host) else stream
@@ -5,8 +5,13 @@ Authors: Giulio Foletto.
 License: See project-level license file.
 """
 
+import logging
+
 import click
 
+from redep import daemon
+from redep.agent import close_agents
+from redep.bandwidth import configure_global_limit
 from redep.config import (
     add_ignore_pattern,
     add_remote,
@@ -14,14 +19,43 @@ from redep.config import (
     remove_ignore_pattern,
     remove_remote,
 )
-from redep.pull import pull
+from redep.metrics import recording_to
+from redep.orchestrator import configure_limits, limits
+from redep.plan import plan_pull, plan_push
+from redep.pull import CONFLICT_POLICIES, pull
 from redep.push import push
+from redep.session import close_connections
 from redep.util import (
     configure_logging,
     find_existing_config,
     find_path_new_config,
+    load_config,
     read_config_file,
 )
+from redep.watch import watch as watch_push
+
+METRICS_FORMATS = ("summary", "trace")
+
+
+def apply_limits(options):
+    """Set the concurrency and bandwidth limits from the options of the configuration."""
+    configure_limits(**{name: options.get(name) for name in limits})
+    configure_global_limit(options.get("bwlimit"), options.get("bandwidth"))
+
+
+def close_sessions():
+    """Close connections and helpers, unless the daemon keeps them for the next commands."""
+    if not daemon.serving:
+        close_agents()
+        close_connections()
+
+
+def exit_on_failure(results):
+    """Exit with status 1 if a task of the orchestrator failed, or did not complete."""
+    if results and any(
+        result["error"] is not None or result["result"] is False for result in results
+    ):
+        click.get_current_context().exit(1)
 
 
 class UnexpandablePattern(click.ParamType):
@@ -39,20 +73,142 @@ def cli(ctx):
 
 @cli.command(name="push")
 @click.option("--config", "config", type=click.Path(), required=False)
-def push_command(config):
+@click.option(
+    "--full",
+    is_flag=True,
+    help="Resend all files, even those unchanged since the last push.",
+)
+@click.option(
+    "--watch",
+    is_flag=True,
+    help="Keep running, and push files as soon as they change.",
+)
+@click.option(
+    "--fanout",
+    type=int,
+    default=None,
+    help="Relay the push through remotes, each forwarding it to up to this many others.",
+)
+@click.option(
+    "--plan",
+    is_flag=True,
+    help="Show what would be transferred and how long it would take, without transferring anything.",
+)
+@click.option(
+    "--verify",
+    is_flag=True,
+    help="Check transferred files against hashes computed on the other side, and transfer again those that differ.",
+)
+@click.option(
+    "--metrics",
+    "metrics_path",
+    type=click.Path(dir_okay=False),
+    help="Write the duration of each phase and the counts of each remote to this JSON file.",
+)
+@click.option(
+    "--metrics-format",
+    type=click.Choice(METRICS_FORMATS),
+    default="summary",
+    help="Write metrics as a summary, or as a trace for chrome://tracing or Perfetto.",
+)
+def push_command(
+    config, full, watch, fanout, plan, verify, metrics_path, metrics_format
+):
     config_file = find_existing_config(config)
     if config_file:
-        root_dir, matches, ignores, remotes = read_config_file(config_file)
-        push(root_dir, matches, ignores, remotes)
+        options = load_config(config_file)
+        root_dir, matches, ignores, remotes = read_config_file(config_file, options)
+        apply_limits(options)
+        if fanout is None:
+            fanout = options.get("fanout", 0)
+        try:
+            if plan:
+                plan_push(root_dir, matches, ignores, remotes, full=full, fanout=fanout)
+                return
+            # the metrics are those of the first push, before watching
+            with recording_to(metrics_path, metrics_format == "trace"):
+                results = push(
+                    root_dir,
+                    matches,
+                    ignores,
+                    remotes,
+                    full=full,
+                    fanout=fanout,
+                    verify=verify,
+                )
+            if watch:
+                watch_push(root_dir, matches, ignores, remotes)
+        finally:
+            close_sessions()
+        exit_on_failure(results)
 
 
 @cli.command(name="pull")
 @click.option("--config", "config", type=click.Path(), required=False)
-def pull_command(config):
+@click.option(
+    "--conflict",
+    type=click.Choice(CONFLICT_POLICIES),
+    default="first",
+    help="Source of files that exist in several remotes: the first listed, the newest, or none (each remote is pulled to its own subdirectory).",
+)
+@click.option(
+    "--plan",
+    is_flag=True,
+    help="Show what would be transferred and how long it would take, without transferring anything.",
+)
+@click.option(
+    "--verify",
+    is_flag=True,
+    help="Check transferred files against hashes computed on the other side, and transfer again those that differ.",
+)
+@click.option(
+    "--metrics",
+    "metrics_path",
+    type=click.Path(dir_okay=False),
+    help="Write the duration of each phase and the counts of each remote to this JSON file.",
+)
+@click.option(
+    "--metrics-format",
+    type=click.Choice(METRICS_FORMATS),
+    default="summary",
+    help="Write metrics as a summary, or as a trace for chrome://tracing or Perfetto.",
+)
+def pull_command(config, conflict, plan, verify, metrics_path, metrics_format):
     config_file = find_existing_config(config)
     if config_file:
-        root_dir, matches, ignores, remotes = read_config_file(config_file)
-        pull(root_dir, matches, ignores, remotes)
+        options = load_config(config_file)
+        root_dir, matches, ignores, remotes = read_config_file(config_file, options)
+        apply_limits(options)
+        try:
+            if plan:
+                plan_pull(root_dir, matches, ignores, remotes, conflict=conflict)
+                return
+            with recording_to(metrics_path, metrics_format == "trace"):
+                results = pull(
+                    root_dir,
+                    matches,
+                    ignores,
+                    remotes,
+                    conflict=conflict,
+                    verify=verify,
+                )
+        finally:
+            close_sessions()
+        exit_on_failure(results)
+
+
+@cli.command(name="daemon")
+@click.option("--stop", is_flag=True, help="Stop the daemon running in the background.")
+def daemon_command(stop):
+    if stop:
+        if not daemon.stop_daemon():
+            logging.error("No redep daemon is running.")
+        return
+    try:
+        daemon.serve(cli)
+    finally:
+        close_agents()
+        close_connections()
 
 
 @cli.command(name="init")
@@ -0,0 +1,196 @@
+"""
+Compression of data in flight, with codecs that are also available as
+command line tools on remote hosts.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import logging
+import zlib
+
+try:
+    from compression import zstd  # Python 3.14 and later
+except ImportError:
+    zstd = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3}
+DECOMPRESSION_ERRORS = (zlib.error,)
+if zstd is not None:
+    DECOMPRESSION_ERRORS += (zstd.ZstdError,)
+if zstandard is not None:
+    DECOMPRESSION_ERRORS += (zstandard.ZstdError,)
+CHUNK_SIZE = 1024 * 1024
+# files are decompressed to a temporary file next to their target
+COMPRESSED_SUFFIX = ".redep-compressed"
+# files that are already compressed, and are sent as they are
+INCOMPRESSIBLE_SUFFIXES = {
+    # archives and compressed streams
+    ".7z",
+    ".br",
+    ".bz2",
+    ".gz",
+    ".lz4",
+    ".lzma",
+    ".rar",
+    ".tbz2",
+    ".tgz",
+    ".txz",
+    ".xz",
+    ".z",
+    ".zip",
+    ".zst",
+    # formats based on zip
+    ".apk",
+    ".docx",
+    ".jar",
+    ".odp",
+    ".ods",
+    ".odt",
+    ".pptx",
+    ".whl",
+    ".xlsx",
+    # images
+    ".avif",
+    ".gif",
+    ".heic",
+    ".jpeg",
+    ".jpg",
+    ".png",
+    ".webp",
+    # audio and video
+    ".aac",
+    ".avi",
+    ".flac",
+    ".m4a",
+    ".mkv",
+    ".mov",
+    ".mp3",
+    ".mp4",
+    ".ogg",
+    ".opus",
+    ".webm",
+}
+
+
+def normalize_codec(codec):
+    """
+    Validate a codec name from the configuration, returning None when no
+    compression should be used.
+    """
+    if codec is None or str(codec).lower() in ("", "none"):
+        return None
+    codec = str(codec).lower()
+    if codec not in DEFAULT_LEVELS:
+        logging.warning(f"Unknown compression '{codec}'; sending data uncompressed.")
+        return None
+    if codec == "zstd" and zstd is None and zstandard is None:
+        logging.warning(
+            "zstd compression requires Python 3.14 or the zstandard package; using gzip."
+        )
+        return "gzip"
+    return codec
+
+
+def resolve_level(codec, level):
+    """Return the compression level to use, defaulting to one suited to the codec."""
+    if level is None:
+        return DEFAULT_LEVELS[codec]
+    return int(level)
+
+
+def is_compressible(path):
+    """Tell whether a file is worth compressing, based on its name."""
+    return path.suffix.lower() not in INCOMPRESSIBLE_SUFFIXES
+
+
+def compressor(codec, level):
+    """Return an object with compress(data) and flush() methods."""
+    if codec == "gzip":
+        return zlib.compressobj(level, zlib.DEFLATED, 31)
+    if zstd is not None:
+        return zstd.ZstdCompressor(level)
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+
+def decompressor(codec):
+    """Return an object with a decompress(data) method."""
+    if codec == "gzip":
+        return zlib.decompressobj(31)
+    if zstd is not None:
+        return zstd.ZstdDecompressor()
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+class CompressedWriter:
+    """Binary file-like object compressing what is written to an underlying stream."""
+
+    def __init__(self, stream, codec, level):
+        self.stream = stream
+        self.compressor = compressor(codec, level)
+
+    def write(self, data):
+        compressed = self.compressor.compress(data)
+        if compressed:
+            self.stream.write(compressed)
+        return len(data)
+
+    def close(self):
+        self.stream.write(self.compressor.flush())
+        self.stream.flush()
+
+    def flush(self):
+        pass
+
+
+class DecompressedReader:
+    """Binary file-like object decompressing what is read from an underlying stream."""
+
+    def __init__(self, stream, codec):
+        self.stream = stream
+        self.decompressor = decompressor(codec)
+        self.buffer = bytearray()
+        self.position = 0
+        self.eof = False
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.buffer) - self.position < size):
+            data = self.stream.read(CHUNK_SIZE)
+            if not data:
+                self.eof = True
+                break
+            # drop what was already read only when refilling, to avoid copies
+            del self.buffer[: self.position]
+            self.position = 0
+            try:
+                self.buffer += self.decompressor.decompress(data)
+            except DECOMPRESSION_ERRORS as e:
+                raise OSError(f"Invalid compressed data: {e}") from e
+        end = (
+            len(self.buffer)
+            if size < 0
+            else min(len(self.buffer), self.position + size)
+        )
+        result = bytes(self.buffer[self.position : end])
+        self.position = end
+        return result
+
+
+def remote_decompress_command(codec):
+    """Shell command decompressing standard input to standard output on a POSIX host."""
+    return "gzip -dc" if codec == "gzip" else "zstd -dcq"
+
+
+def remote_compress_command(codec, level):
+    """Shell command compressing standard input to standard output on a POSIX host."""
+    return f"gzip -c -{level}" if codec == "gzip" else f"zstd -cq -{level}"
+
+
+def windows_tar_options(codec, level):
+    """Options of the tar of Windows (bsdtar) that compress the archive it creates."""
+    flag = "-z" if codec == "gzip" else "--zstd"
+    return f"{flag} --options {codec}:compression-level={level}"
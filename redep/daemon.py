@@ -0,0 +1,285 @@
+"""
+Optional daemon that runs commands on behalf of the command line interface,
+so that connections, helpers and facts about hosts are kept between commands.
+
+`redep daemon` listens on a Unix socket, only accessible to its user. When it
+is running, `redep push` and `redep pull` send their arguments, working
+directory and terminal details to it, instead of opening connections
+themselves, and print the output it sends back. Otherwise (or with
+REDEP_NO_DAEMON set), they run directly.
+
+The daemon runs one command at a time, with its own environment (e.g., for
+SSH agents and configuration). Commands whose client disconnects are
+cancelled like on Ctrl+C.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import json
+import logging
+import os
+import shutil
+import socket
+import sys
+from contextlib import redirect_stderr, redirect_stdout
+from pathlib import Path
+from threading import Event, Lock, Thread
+
+import click
+
+from redep.orchestrator import new_run
+from redep.session import cache_path
+
+SOCKET_NAME = "daemon.sock"
+# commands that are handed to the daemon, when it is running
+DELEGATED_COMMANDS = ("push", "pull")
+
+serving = False
+
+
+def socket_path():
+    """Return the path of the socket of the daemon."""
+    if "REDEP_DAEMON_SOCKET" in os.environ:
+        return Path(os.environ["REDEP_DAEMON_SOCKET"])
+    if "XDG_RUNTIME_DIR" in os.environ:
+        return Path(os.environ["XDG_RUNTIME_DIR"]) / "redep" / SOCKET_NAME
+    return cache_path().with_name(SOCKET_NAME)
+
+
+def supported():
+    return hasattr(socket, "AF_UNIX") and os.name != "nt"
+
+
+def connect(path):
+    """Return a socket connected to the daemon, or None if it is not running."""
+    if not supported() or not path.exists():
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(str(path))
+    except OSError:
+        client.close()
+        return None
+    return client
+
+
+def send_message(sock, message):
+    sock.sendall(json.dumps(message).encode() + b"\n")
+
+
+def should_delegate(argv):
+    """Tell whether a command line can be run by the daemon."""
+    if os.environ.get("REDEP_NO_DAEMON"):
+        return False
+    if len(argv) == 0 or argv[0] not in DELEGATED_COMMANDS:
+        return False
+    # watching runs until interrupted, and would hold the daemon meanwhile
+    return not any(a in ("--watch", "--help") for a in argv[1:])
+
+
+def run_in_daemon(argv):
+    """
+    Run a command line in the daemon, printing its output, and return its
+    exit status, or None if the daemon is not running.
+    """
+    if not should_delegate(argv):
+        return None
+    client = connect(socket_path())
+    if client is None:
+        return None
+    with client:
+        request = {
+            "argv": list(argv),
+            "cwd": os.getcwd(),
+            "isatty": sys.stderr.isatty(),
+            "columns": shutil.get_terminal_size().columns,
+        }
+        send_message(client, request)
+        # closing the socket, e.g., on Ctrl+C, cancels the command
+        with client.makefile("rb") as responses:
+            for line in responses:
+                message = json.loads(line)
+                if "exit" in message:
+                    return message["exit"]
+                stream = sys.stdout if message["fd"] == 1 else sys.stderr
+                stream.write(message["text"])
+                stream.flush()
+    sys.stderr.write("The redep daemon stopped before the command completed.\n")
+    return 1
+
+
+def stop_daemon():
+    """Ask the daemon to stop, and return whether it was running."""
+    client = connect(socket_path())
+    if client is None:
+        return False
+    with client:
+        send_message(client, {"stop": True})
+        with client.makefile("rb") as responses:
+            responses.readline()
+    return True
+
+
+class ClientStream:
+    """Text stream that forwards what is written to the client, as messages."""
+
+    def __init__(self, sock, fd, interactive, lock):
+        self.sock = sock
+        self.fd = fd
+        self.interactive = interactive
+        self.lock = lock
+        self.closed = False
+
+    def write(self, text):
+        if self.closed or text == "":
+            return len(text)
+        try:
+            with self.lock:
+                send_message(self.sock, {"fd": self.fd, "text": text})
+        except OSError:
+            # the client is gone; the command is cancelled by watch_client
+            self.closed = True
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return self.interactive
+
+
+def watch_client(sock, finished, cancelled):
+    """
+    Cancel the running command, by setting its cancellation event, if its
+    client disconnects before it finishes.
+    """
+    try:
+        while sock.recv(1024):
+            pass
+    except OSError:
+        pass
+    if not finished.is_set():
+        logging.warning("The client disconnected; cancelling its command.")
+        cancelled.set()
+
+
+def run_command(cli, request, sock):
+    """Run the command line of a request with cli, and return its exit status."""
+    output_lock = Lock()
+    stdout = ClientStream(sock, 1, request.get("isatty", False), output_lock)
+    stderr = ClientStream(sock, 2, request.get("isatty", False), output_lock)
+    root = logging.getLogger()
+    handler = logging.StreamHandler(stdout)
+    if root.handlers:
+        handler.setFormatter(root.handlers[0].formatter)
+    root.addHandler(handler)
+    previous_columns = os.environ.get("COLUMNS")
+    if request.get("isatty") and request.get("columns"):
+        # so that the status line fits the terminal of the client
+        os.environ["COLUMNS"] = str(request["columns"])
+    previous_dir = os.getcwd()
+    finished = Event()
+    # a fresh event, so that the commands cancelled before do not affect this one
+    cancelled = new_run()
+    watcher = Thread(target=watch_client, args=(sock, finished, cancelled), daemon=True)
+    watcher.start()
+    try:
+        os.chdir(request["cwd"])
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            status = cli.main(
+                args=request["argv"],
+                prog_name="redep",
+                standalone_mode=False,
+                windows_expand_args=False,
+            )
+        return status if isinstance(status, int) else 0
+    except click.ClickException as e:
+        e.show(file=stderr)
+        return e.exit_code
+    except click.Abort:
+        return 1
+    except Exception as e:
+        logging.exception(f"Command failed: {e}")
+        return 1
+    finally:
+        finished.set()
+        # wake the watcher up, without closing the socket for the exit status
+        try:
+            sock.shutdown(socket.SHUT_RD)
+        except OSError:
+            pass
+        watcher.join()
+        os.chdir(previous_dir)
+        if previous_columns is None:
+            os.environ.pop("COLUMNS", None)
+        else:
+            os.environ["COLUMNS"] = previous_columns
+        root.removeHandler(handler)
+
+
+def handle(cli, sock):
+    """Answer one client, and return False if it asked the daemon to stop."""
+    with sock.makefile("rb") as requests:
+        line = requests.readline()
+    if not line:
+        return True
+    try:
+        request = json.loads(line)
+    except ValueError:
+        logging.warning("Ignoring a malformed request.")
+        return True
+    if request.get("stop"):
+        send_message(sock, {"exit": 0})
+        return False
+    logging.info(f"Running `redep {' '.join(request['argv'])}` in {request['cwd']}")
+    status = run_command(cli, request, sock)
+    try:
+        send_message(sock, {"exit": status})
+    except OSError:
+        pass
+    return True
+
+
+def serve(cli, path=None):
+    """
+    Run the commands sent by clients with cli, one at a time, until asked to
+    stop or interrupted. Return False if the daemon could not start.
+    """
+    global serving
+    if not supported():
+        logging.error("The daemon requires Unix sockets, which are not available.")
+        return False
+    path = socket_path() if path is None else Path(path)
+    existing = connect(path)
+    if existing is not None:
+        existing.close()
+        logging.error(f"A redep daemon is already listening on {path}.")
+        return False
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    # a socket left by a daemon that did not stop cleanly
+    path.unlink(missing_ok=True)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # only the user running the daemon may connect
+    previous_umask = os.umask(0o177)
+    try:
+        server.bind(str(path))
+    finally:
+        os.umask(previous_umask)
+    server.listen()
+    logging.info(f"Listening on {path}; stop with Ctrl+C or `redep daemon --stop`.")
+    serving = True
+    try:
+        while True:
+            sock, _ = server.accept()
+            with sock:
+                if not handle(cli, sock):
+                    break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        serving = False
+        server.close()
+        path.unlink(missing_ok=True)
+    logging.info("Stopped.")
+    return True
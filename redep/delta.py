@@ -0,0 +1,319 @@
+"""
+Rsync-style delta encoding of files, based on rolling block checksums.
+
+The side holding the old copy of a file computes a signature (a weak rolling
+checksum and a strong hash for each block), the side holding the new copy
+computes a delta against it (references to known blocks, interleaved with
+literal data), and the old copy is then patched into the new one.
+
+This module only depends on the standard library, because it is also executed
+on remote hosts with `python3 -c`, see delta_command.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import base64
+import hashlib
+import os
+import shlex
+import struct
+import sys
+import zlib
+
+SIGNATURE_MAGIC = b"RDS1"
+DELTA_MAGIC = b"RDD1"
+STRONG_SIZE = 16
+MIN_BLOCK_SIZE = 4 * 1024
+MAX_BLOCK_SIZE = 128 * 1024
+CHUNK_SIZE = 1024 * 1024
+ADLER_MOD = 65521
+# exit codes of the command line interface
+EXIT_MISSING = 3
+EXIT_TOO_LARGE = 4
+EXIT_MISMATCH = 5
+
+
+class DeltaTooLarge(Exception):
+    """Raised when a delta would contain more literal data than allowed."""
+
+
+def block_size_for(size):
+    """Choose a block size that grows with the square root of the file size."""
+    block_size = int(size**0.5) // 1024 * 1024
+    return max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, block_size))
+
+
+def strong_hash(data):
+    return hashlib.blake2b(data, digest_size=STRONG_SIZE).digest()
+
+
+def compute_signature(stream, block_size):
+    """Compute the signature of a binary stream, as bytes."""
+    parts = []
+    size = 0
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        size += len(block)
+        parts.append(struct.pack(">I", zlib.adler32(block)) + strong_hash(block))
+    header = SIGNATURE_MAGIC + struct.pack(">IQ", block_size, size)
+    return header + b"".join(parts)
+
+
+def parse_signature(data):
+    """Return block size, basis size and list of (weak, strong) block checksums."""
+    if data[:4] != SIGNATURE_MAGIC:
+        raise ValueError("Invalid delta signature.")
+    block_size, size = struct.unpack(">IQ", data[4:16])
+    entry_size = 4 + STRONG_SIZE
+    blocks = []
+    for offset in range(16, len(data), entry_size):
+        (weak,) = struct.unpack(">I", data[offset : offset + 4])
+        blocks.append((weak, data[offset + 4 : offset + entry_size]))
+    return block_size, size, blocks
+
+
+class DeltaWriter:
+    """Serialize delta operations to a binary stream, merging adjacent copies."""
+
+    def __init__(self, stream, block_size):
+        self.stream = stream
+        self.copy_start = None
+        self.copy_count = 0
+        self.literal_size = 0
+        self.stream.write(DELTA_MAGIC + struct.pack(">I", block_size))
+
+    def copy(self, index):
+        if self.copy_start is not None and self.copy_start + self.copy_count == index:
+            self.copy_count += 1
+            return
+        self.flush_copy()
+        self.copy_start = index
+        self.copy_count = 1
+
+    def literal(self, data):
+        if not data:
+            return
+        self.flush_copy()
+        self.literal_size += len(data)
+        self.stream.write(b"D" + struct.pack(">I", len(data)))
+        self.stream.write(data)
+
+    def flush_copy(self):
+        if self.copy_start is not None:
+            self.stream.write(
+                b"C" + struct.pack(">QI", self.copy_start, self.copy_count)
+            )
+            self.copy_start = None
+            self.copy_count = 0
+
+    def close(self, digest):
+        self.flush_copy()
+        self.stream.write(b"E" + digest)
+
+
+def compute_delta(signature, source, output, max_literal=None):
+    """
+    Write to output the delta that turns the basis described by signature
+    into the content of the source stream.
+
+    The delta ends with the SHA-256 digest of the source, which is used to
+    verify the result when the delta is applied. Raise DeltaTooLarge if the
+    delta would contain more than max_literal bytes of literal data.
+    """
+    block_size, basis_size, blocks = parse_signature(signature)
+    table = {}
+    for index, (weak, strong) in enumerate(blocks):
+        table.setdefault(weak, []).append((index, strong))
+    last_index = len(blocks) - 1
+    last_size = basis_size - last_index * block_size if blocks else 0
+
+    writer = DeltaWriter(output, block_size)
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    eof = False
+    pos = 0  # start of the current window in buffer
+    literal_start = 0  # start of the literal data not yet written
+    weak = None
+    a = b = 0
+
+    def check_literal_size():
+        if max_literal is not None and writer.literal_size > max_literal:
+            raise DeltaTooLarge()
+
+    while True:
+        # make sure that the window and the next byte are in the buffer
+        while not eof and len(buffer) < pos + block_size + 1:
+            chunk = source.read(CHUNK_SIZE)
+            if not chunk:
+                eof = True
+                break
+            digest.update(chunk)
+            buffer += chunk
+        available = len(buffer) - pos
+        if available < block_size:
+            # only the last block of the basis can be shorter than block_size
+            if 0 < available == last_size:
+                tail = bytes(buffer[pos:])
+                for index, strong in table.get(zlib.adler32(tail), []):
+                    if index == last_index and strong == strong_hash(tail):
+                        writer.literal(bytes(buffer[literal_start:pos]))
+                        writer.copy(index)
+                        literal_start = pos = len(buffer)
+                        break
+            writer.literal(bytes(buffer[literal_start:]))
+            check_literal_size()
+            break
+        if weak is None:
+            weak = zlib.adler32(buffer[pos : pos + block_size])
+            a = weak & 0xFFFF
+            b = weak >> 16
+        candidates = table.get(weak)
+        if candidates is not None:
+            strong = strong_hash(buffer[pos : pos + block_size])
+            index = next((i for i, s in candidates if s == strong), None)
+            if index is not None:
+                writer.literal(bytes(buffer[literal_start:pos]))
+                writer.copy(index)
+                pos += block_size
+                literal_start = pos
+                weak = None
+                check_literal_size()
+                if literal_start > CHUNK_SIZE:
+                    del buffer[:literal_start]
+                    pos = literal_start = 0
+                continue
+        # roll the window one byte at a time until a candidate block is found
+        end = len(buffer) - block_size
+        start = pos
+        while pos < end:
+            out_byte = buffer[pos]
+            a = (a - out_byte + buffer[pos + block_size]) % ADLER_MOD
+            b = (b - block_size * out_byte + a - 1) % ADLER_MOD
+            weak = (b << 16) | a
+            pos += 1
+            if weak in table:
+                break
+        if eof and pos == end and (pos == start or weak not in table):
+            # the last full window does not match (even if only its strong
+            # hash differs), leave it for the tail
+            pos += 1
+            weak = None
+        if pos - literal_start > CHUNK_SIZE:
+            writer.literal(bytes(buffer[literal_start:pos]))
+            check_literal_size()
+            del buffer[:pos]
+            pos = literal_start = 0
+    writer.close(digest.digest())
+
+
+def apply_delta(basis, delta, output):
+    """
+    Write to output the result of applying a delta stream to a seekable basis.
+
+    Return True if the result matches the digest recorded in the delta.
+    """
+    if delta.read(4) != DELTA_MAGIC:
+        raise ValueError("Invalid delta.")
+    (block_size,) = struct.unpack(">I", delta.read(4))
+    digest = hashlib.sha256()
+    while True:
+        op = delta.read(1)
+        if op == b"E":
+            break
+        elif op == b"C":
+            start, count = struct.unpack(">QI", delta.read(12))
+            basis.seek(start * block_size)
+            remaining = count * block_size
+            while remaining > 0:
+                data = basis.read(min(remaining, CHUNK_SIZE))
+                if not data:
+                    break
+                digest.update(data)
+                output.write(data)
+                remaining -= len(data)
+        elif op == b"D":
+            (length,) = struct.unpack(">I", delta.read(4))
+            data = delta.read(length)
+            if len(data) != length:
+                raise ValueError("Truncated delta.")
+            digest.update(data)
+            output.write(data)
+        else:
+            raise ValueError("Invalid delta operation.")
+    return delta.read(hashlib.sha256().digest_size) == digest.digest()
+
+
+def patch_file(path, delta, mode=None):
+    """
+    Patch a file in place with a delta stream.
+
+    The result is written to a temporary file in the same directory, and only
+    replaces the original if it matches the digest recorded in the delta.
+    Return True on success.
+    """
+    temp_path = f"{path}.redep-delta"
+    try:
+        with open(path, "rb") as basis, open(temp_path, "wb") as output:
+            ok = apply_delta(basis, delta, output)
+        if not ok:
+            return False
+        if mode is None:
+            mode = os.stat(path).st_mode
+        os.chmod(temp_path, mode & 0o7777)
+        os.replace(temp_path, path)
+        return True
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def delta_command(*args):
+    """Build a shell command running this module with python3 and the given arguments."""
+    with open(__file__) as source_file:
+        source = source_file.read()
+    return " ".join(
+        ["python3", "-c", shlex.quote(source)] + [shlex.quote(str(a)) for a in args]
+    )
+
+
+def main(argv):
+    """
+    Command line interface used on remote hosts.
+
+    signature PATH BLOCK_SIZE
+        print the base64 signature of PATH
+    patch PATH MODE
+        patch PATH in place with the delta read from stdin, and set its mode
+    delta PATH MAX_LITERAL
+        write to stdout the delta of PATH against the signature read from stdin
+    """
+    command, path = argv[0], argv[1]
+    if command == "signature":
+        if not os.path.isfile(path):
+            return EXIT_MISSING
+        with open(path, "rb") as stream:
+            signature = compute_signature(stream, int(argv[2]))
+        sys.stdout.write(base64.b64encode(signature).decode())
+        return 0
+    elif command == "patch":
+        ok = patch_file(path, sys.stdin.buffer, int(argv[2], 8))
+        return 0 if ok else EXIT_MISMATCH
+    elif command == "delta":
+        if not os.path.isfile(path):
+            return EXIT_MISSING
+        signature = sys.stdin.buffer.read()
+        try:
+            with open(path, "rb") as stream:
+                compute_delta(signature, stream, sys.stdout.buffer, int(argv[2]))
+        except DeltaTooLarge:
+            return EXIT_TOO_LARGE
+        sys.stdout.buffer.flush()
+        return 0
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,253 @@
+"""
+Helper run on remote hosts, which lists, creates directories, hashes, and
+receives and sends files over its standard streams, so that one long-lived
+channel replaces a shell command (and its startup) per operation.
+
+Requests and responses are frames: an operation byte and the length of the
+payload, followed by the payload. Requests are handled in order, so the
+client can send many of them before reading the responses.
+
+This module only depends on the standard library, because it is executed on
+remote hosts with `python3 -c`, see helper_command.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import fnmatch
+import hashlib
+import json
+import os
+import shlex
+import stat
+import struct
+import sys
+
+HEADER = struct.Struct(">cI")
+VERSION = b"1"
+CHUNK_SIZE = 256 * 1024
+TEMP_SUFFIX = ".redep-helper"
+
+# requests
+HELLO = b"V"
+LIST = b"L"
+MKDIR = b"M"
+HASH = b"H"
+PUT = b"P"
+GET = b"G"
+# data of PUT requests and GET responses, closed by END
+DATA = b"D"
+END = b"Z"
+# responses
+OK = b"O"
+ERROR = b"E"
+
+
+def write_frame(stream, op, payload=b""):
+    stream.write(HEADER.pack(op, len(payload)) + payload)
+
+
+def read_frame(stream):
+    """Read a frame, and return its operation and payload, or (None, None) at the end."""
+    header = stream.read(HEADER.size)
+    if len(header) == 0:
+        return None, None
+    if len(header) < HEADER.size:
+        raise EOFError("Truncated frame")
+    op, length = HEADER.unpack(header)
+    payload = stream.read(length) if length > 0 else b""
+    if len(payload) < length:
+        raise EOFError("Truncated frame")
+    return op, payload
+
+
+def split_paths(payload):
+    return [os.fsdecode(path) for path in payload.split(b"\0") if path]
+
+
+def list_tree(root, prune_paths=(), prune_names=()):
+    """
+    List everything below root, like `find root -mindepth 1 -printf
+    '%Y\\t%s\\t%T@\\t%P\\0'`. Directories in prune_paths, or whose name
+    matches one of the patterns in prune_names (like find -name), are listed
+    but not walked.
+    """
+    prune_paths = set(prune_paths)
+    prune_names = set(prune_names)
+
+    def pruned(entry):
+        if entry.path in prune_paths:
+            return True
+        return any(fnmatch.fnmatchcase(entry.name, name) for name in prune_names)
+
+    records = []
+    pending = [(root, "")]
+    while pending:
+        directory, prefix = pending.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            if directory == root:
+                raise
+            continue
+        for entry in entries:
+            try:
+                info = entry.stat(follow_symlinks=False)
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            relative_path = prefix + entry.name
+            mtime = f"{info.st_mtime_ns // 10**9}.{info.st_mtime_ns % 10**9:09d}"
+            entry_type = "d" if is_dir else "f"
+            records.append(f"{entry_type}\t{info.st_size}\t{mtime}\t{relative_path}")
+            # like find, symbolic links to directories are not walked
+            if stat.S_ISDIR(info.st_mode):
+                if pruned(entry):
+                    continue
+                pending.append((entry.path, relative_path + "/"))
+    return "".join(record + "\0" for record in records)
+
+
+def make_directories(paths):
+    """Create directories and their parents, and return the errors."""
+    errors = []
+    for path in paths:
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError as e:
+            errors.append(f"{path}: {e.strerror}")
+    return errors
+
+
+def hash_files(paths):
+    """Return the SHA-256 of each file, or an empty string if it cannot be read."""
+    digests = []
+    for path in paths:
+        hasher = hashlib.sha256()
+        try:
+            with open(path, "rb") as stream:
+                while True:
+                    block = stream.read(CHUNK_SIZE)
+                    if not block:
+                        break
+                    hasher.update(block)
+            digests.append(hasher.hexdigest())
+        except OSError:
+            digests.append("")
+    return digests
+
+
+def receive_file(input, header):
+    """
+    Write the DATA frames that follow a PUT request to a temporary file, and
+    move it into place at END. Return an error message, or None.
+    """
+    request = json.loads(header)
+    path = request["path"]
+    temp_path = path + TEMP_SUFFIX
+    error = None
+    output = None
+    try:
+        output = open(temp_path, "wb")
+    except OSError as e:
+        error = f"{path}: {e.strerror}"
+    while True:
+        op, payload = read_frame(input)
+        if op is None:
+            raise EOFError("Missing end of file")
+        if op == END:
+            break
+        if output is not None:
+            try:
+                output.write(payload)
+            except OSError as e:
+                error = f"{path}: {e.strerror}"
+                output.close()
+                output = None
+    if output is not None:
+        try:
+            output.close()
+            os.chmod(temp_path, request["mode"])
+            os.replace(temp_path, path)
+        except OSError as e:
+            error = f"{path}: {e.strerror}"
+    if error is not None and os.path.exists(temp_path):
+        os.remove(temp_path)
+    return error
+
+
+def send_file(output, path):
+    """Answer a GET request with DATA frames, and END with the mode of the file."""
+    try:
+        with open(path, "rb") as stream:
+            mode = os.fstat(stream.fileno()).st_mode & 0o7777
+            while True:
+                block = stream.read(CHUNK_SIZE)
+                if not block:
+                    break
+                write_frame(output, DATA, block)
+    except OSError as e:
+        write_frame(output, ERROR, f"{path}: {e.strerror}".encode())
+        return
+    write_frame(output, END, json.dumps({"mode": mode}).encode())
+
+
+def serve(input, output):
+    """Answer the requests read from input until it ends."""
+    while True:
+        op, payload = read_frame(input)
+        if op is None:
+            return 0
+        try:
+            if op == HELLO:
+                write_frame(output, OK, VERSION)
+            elif op == LIST:
+                request = json.loads(payload)
+                records = list_tree(
+                    request["root"], request["prune_paths"], request["prune_names"]
+                )
+                write_frame(output, OK, os.fsencode(records))
+            elif op == MKDIR:
+                errors = make_directories(split_paths(payload))
+                write_frame(output, OK, "\n".join(errors).encode())
+            elif op == HASH:
+                digests = hash_files(split_paths(payload))
+                write_frame(output, OK, "\0".join(digests).encode())
+            elif op == PUT:
+                error = receive_file(input, payload)
+                if error is None:
+                    write_frame(output, OK)
+                else:
+                    write_frame(output, ERROR, error.encode())
+            elif op == GET:
+                send_file(output, os.fsdecode(payload))
+            else:
+                write_frame(output, ERROR, f"Unknown operation {op!r}".encode())
+        except (OSError, ValueError, KeyError) as e:
+            write_frame(output, ERROR, str(e).encode())
+        output.flush()
+
+
+def helper_command(*args):
+    """Build a shell command running this module with python3 and the given arguments."""
+    with open(__file__) as source_file:
+        source = source_file.read()
+    return " ".join(
+        ["python3", "-c", shlex.quote(source)] + [shlex.quote(str(a)) for a in args]
+    )
+
+
+def main(argv):
+    """
+    Command line interface used on remote hosts.
+
+    serve
+        answer the requests read from stdin, writing responses to stdout
+    """
+    if len(argv) > 0 and argv[0] == "serve":
+        return serve(sys.stdin.buffer, sys.stdout.buffer)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,129 @@
+"""
+Copy of local files with the fastest method supported by the filesystems:
+reflink clones, then os.copy_file_range, then os.sendfile, then ordinary
+reads and writes.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import errno
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request that clones a file on Linux (_IOW(0x94, 9, int))
+FICLONE = 0x40049409
+DEFAULT_WORKERS = 8
+CHUNK_SIZE = 8 * 1024 * 1024
+# errors meaning that a method is not supported by the filesystems involved
+UNSUPPORTED_ERRORS = {
+    errno.EBADF,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTSUP,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.EPERM,
+    errno.EXDEV,
+}
+
+# methods that failed for a pair of devices, which are not tried again
+unsupported = set()
+unsupported_lock = Lock()
+
+
+def copy_file(source, destination):
+    """Copy the content of a file, like shutil.copyfile."""
+    with open(source, "rb") as source_file, open(destination, "wb") as dest_file:
+        source_fd = source_file.fileno()
+        dest_fd = dest_file.fileno()
+        size = os.fstat(source_fd).st_size
+        devices = (os.fstat(source_fd).st_dev, os.fstat(dest_fd).st_dev)
+        for name, method in METHODS:
+            if (name, devices) in unsupported:
+                continue
+            try:
+                if method(source_fd, dest_fd, size):
+                    return
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRORS:
+                    raise
+                with unsupported_lock:
+                    unsupported.add((name, devices))
+                logging.debug(f"Local copy with {name} not supported: {e}")
+            # start again from the beginning with the next method
+            os.lseek(source_fd, 0, os.SEEK_SET)
+            os.lseek(dest_fd, 0, os.SEEK_SET)
+            os.ftruncate(dest_fd, 0)
+        shutil.copyfileobj(source_file, dest_file, CHUNK_SIZE)
+
+
+def copy_reflink(source_fd, dest_fd, size):
+    if fcntl is None or not hasattr(os, "copy_file_range"):
+        # not Linux
+        return False
+    fcntl.ioctl(dest_fd, FICLONE, source_fd)
+    return True
+
+
+def copy_range(source_fd, dest_fd, size):
+    if not hasattr(os, "copy_file_range"):
+        return False
+    copied = 0
+    while copied < size:
+        sent = os.copy_file_range(source_fd, dest_fd, min(size - copied, CHUNK_SIZE))
+        if sent == 0:
+            break
+        copied += sent
+    # the file may have grown while copying
+    return copied >= size and os.fstat(source_fd).st_size == copied
+
+
+def copy_sendfile(source_fd, dest_fd, size):
+    if not hasattr(os, "sendfile") or os.name == "nt":
+        return False
+    copied = 0
+    while copied < size:
+        sent = os.sendfile(dest_fd, source_fd, copied, min(size - copied, CHUNK_SIZE))
+        if sent == 0:
+            break
+        copied += sent
+    return copied >= size and os.fstat(source_fd).st_size == copied
+
+
+METHODS = [
+    ("reflink", copy_reflink),
+    ("copy_file_range", copy_range),
+    ("sendfile", copy_sendfile),
+]
+
+
+def copy_files(pairs, workers=DEFAULT_WORKERS):
+    """
+    Copy (source, destination) pairs with a pool of threads, hiding the
+    latency of each file on network filesystems.
+
+    Yield each pair once it is copied, in order; errors are raised.
+    """
+    if workers <= 1:
+        for source, destination in pairs:
+            copy_file(source, destination)
+            yield source, destination
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [(pair, executor.submit(copy_file, *pair)) for pair in pairs]
+        try:
+            for pair, future in futures:
+                future.result()
+                yield pair
+        finally:
+            for _, future in futures:
+                future.cancel()
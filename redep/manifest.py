@@ -0,0 +1,113 @@
+"""
+Manifests of what was pushed to a destination, used to skip unchanged files.
+
+The manifest is stored at the root of each destination, so that it is lost
+together with the data it describes if the destination is wiped.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import gzip
+import json
+import logging
+import os
+
+MANIFEST_NAME = ".redep-manifest.json.gz"
+MANIFEST_VERSION = 1
+
+
+def empty_manifest():
+    return {"version": MANIFEST_VERSION, "files": {}, "dirs": []}
+
+
+def file_signature(file_path):
+    """Return the properties of a local file that are compared to detect changes."""
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns, stat.st_mode]
+
+
+def encode_manifest(manifest):
+    return gzip.compress(json.dumps(manifest, separators=(",", ":")).encode())
+
+
+def decode_manifest(data):
+    try:
+        manifest = json.loads(gzip.decompress(data).decode())
+    except (OSError, EOFError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable push manifest: {e}")
+        return empty_manifest()
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        logging.warning("Ignoring push manifest with unsupported format.")
+        return empty_manifest()
+    return manifest
+
+
+def read_local_manifest(path):
+    """Read the manifest stored in a local destination directory."""
+    manifest_path = path / MANIFEST_NAME
+    if not manifest_path.is_file():
+        return empty_manifest()
+    return decode_manifest(manifest_path.read_bytes())
+
+
+def write_local_manifest(path, manifest):
+    manifest_path = path / MANIFEST_NAME
+    temp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+    temp_path.write_bytes(encode_manifest(manifest))
+    os.replace(temp_path, manifest_path)
+
+
+def read_remote_manifest(conn, str_remote_path):
+    """Read the manifest stored on a remote destination, given its SFTP path."""
+    try:
+        with conn.sftp().open(str_remote_path, "rb") as remote_file:
+            data = remote_file.read()
+    except OSError:
+        return empty_manifest()
+    return decode_manifest(data)
+
+
+def write_remote_manifest(conn, str_remote_path, manifest):
+    with conn.sftp().open(str_remote_path, "wb") as remote_file:
+        remote_file.write(encode_manifest(manifest))
+
+
+def select_changes(files, dirs, root_dir, manifest, partial=False):
+    """
+    Compare the selected files and directories with a manifest.
+
+    Return the files that are new or changed, the directories that are new,
+    and the manifest describing the destination after they are transferred,
+    which initially holds only the unchanged files (and, if partial is True,
+    also the files of the old manifest that are not selected).
+    Changed files and new directories must be recorded in the new manifest
+    with record_file and record_dirs once they are transferred.
+    """
+    old_files = manifest.get("files", {})
+    old_dirs = set(manifest.get("dirs", []))
+    changed_files = {}
+    new_manifest = empty_manifest()
+    new_manifest["dirs"] = sorted(old_dirs)
+    if partial:
+        new_manifest["files"].update(old_files)
+    for file_path in files:
+        key = file_path.relative_to(root_dir).as_posix()
+        signature = file_signature(file_path)
+        if old_files.get(key) == signature:
+            new_manifest["files"][key] = signature
+        else:
+            changed_files[file_path] = signature
+            new_manifest["files"].pop(key, None)
+    new_dirs = {d for d in dirs if d.relative_to(root_dir).as_posix() not in old_dirs}
+    return changed_files, new_dirs, new_manifest
+
+
+def record_file(manifest, root_dir, file_path, signature):
+    manifest["files"][file_path.relative_to(root_dir).as_posix()] = signature
+
+
+def record_dirs(manifest, root_dir, dirs):
+    keys = set(manifest["dirs"])
+    keys.update(d.relative_to(root_dir).as_posix() for d in dirs)
+    manifest["dirs"] = sorted(keys)
@@ -0,0 +1,184 @@
+"""
+Metrics of push and pull runs: how long each phase took, and how many files,
+bytes and round trips each destination or source took.
+
+Phases are recorded as spans, which are cheap no-ops unless recording was
+started. The report is a JSON summary, or a trace in the Trace Event Format,
+which can be opened with chrome://tracing or https://ui.perfetto.dev.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+lock = threading.Lock()
+recording = False
+origin = 0.0
+started = None
+spans = []
+counters = {}
+
+
+def start_recording():
+    """Forget previous metrics, and record those of the phases that follow."""
+    global recording, origin, started
+    with lock:
+        recording = True
+        origin = time.perf_counter()
+        started = datetime.now(timezone.utc)
+        spans.clear()
+        counters.clear()
+
+
+def stop_recording():
+    """Stop recording, and forget the metrics recorded so far."""
+    global recording
+    with lock:
+        recording = False
+        spans.clear()
+        counters.clear()
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Record the duration of the enclosed phase, with some attributes (for
+    example the destination it concerns); more can be added to the dictionary
+    that is returned.
+    """
+    if not recording:
+        yield attributes
+        return
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        end = time.perf_counter()
+        record = {
+            "name": name,
+            "start": start - origin,
+            "seconds": end - start,
+            "thread": threading.get_ident(),
+            "thread_name": threading.current_thread().name,
+            "attributes": attributes,
+        }
+        with lock:
+            spans.append(record)
+
+
+def count(key, name, value=1):
+    """
+    Add value to a counter (files, bytes or round_trips) of a destination or
+    source, identified by its host, or by its path if it is local.
+    """
+    if not recording:
+        return
+    with lock:
+        counts = counters.setdefault(key, {})
+        counts[name] = counts.get(name, 0) + value
+
+
+def summary():
+    """Aggregate the recorded spans by phase and the counters by destination."""
+    with lock:
+        recorded = list(spans)
+        counted = {key: dict(counts) for key, counts in counters.items()}
+    phases = {}
+    for record in recorded:
+        phase = phases.setdefault(
+            record["name"], {"count": 0, "seconds": 0.0, "max_seconds": 0.0}
+        )
+        phase["count"] += 1
+        phase["seconds"] += record["seconds"]
+        phase["max_seconds"] = max(phase["max_seconds"], record["seconds"])
+    destinations = {}
+    for key, counts in counted.items():
+        destination = {"files": 0, "bytes": 0, "round_trips": 0, **counts}
+        seconds = sum(
+            record["seconds"]
+            for record in recorded
+            if record["name"] == "transfer"
+            and record["attributes"].get("destination") == key
+        )
+        destination["seconds"] = seconds
+        destination["bytes_per_second"] = (
+            destination["bytes"] / seconds if seconds > 0 else None
+        )
+        destinations[key] = destination
+    return {
+        "started": started.isoformat() if started is not None else None,
+        "seconds": time.perf_counter() - origin,
+        "phases": phases,
+        "destinations": destinations,
+        "spans": recorded,
+    }
+
+
+def trace():
+    """Convert the recorded metrics into the Trace Event Format."""
+    report = summary()
+    pid = os.getpid()
+    events = []
+    threads = {}
+    for record in report.pop("spans"):
+        threads[record["thread"]] = record["thread_name"]
+        events.append(
+            {
+                "name": record["name"],
+                "ph": "X",
+                "ts": record["start"] * 1e6,
+                "dur": record["seconds"] * 1e6,
+                "pid": pid,
+                "tid": record["thread"],
+                "args": record["attributes"],
+            }
+        )
+    for tid, name in threads.items():
+        events.append(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": name},
+            }
+        )
+    return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": report}
+
+
+def write_metrics(path, trace_format=False):
+    """Write the recorded metrics to a JSON file, as a summary or as a trace."""
+    report = trace() if trace_format else summary()
+    try:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+    except OSError as e:
+        logging.error(f"Could not write metrics to {path}: {e}")
+        return
+    logging.info(f"Metrics written to {path}.")
+
+
+@contextmanager
+def recording_to(path, trace_format=False):
+    """
+    Record the metrics of the enclosed block if path is not None, and write
+    them to path when it ends, even if it fails.
+    """
+    if path is None:
+        yield
+        return
+    start_recording()
+    try:
+        yield
+    finally:
+        try:
+            write_metrics(path, trace_format)
+        finally:
+            stop_recording()
@@ -0,0 +1,159 @@
+"""
+Orchestration of transfers to or from many destinations, with bounded
+concurrency.
+
+An asyncio event loop schedules one task per destination, and runs at most
+max_destinations of them at once (and at most max_destinations_per_host on
+the same host) on a pool of threads, since SSH operations are blocking.
+Within the destinations, transfer slots bound the files transferred at once,
+globally (max_transfers) and per host (max_transfers_per_host).
+
+On Ctrl+C, destinations that did not start are cancelled, and those running
+stop before their next file. Each run (e.g., a command of the daemon) has its
+own cancellation event, so that an interrupted run does not affect the next,
+and a run interrupted between its batches of tasks does not start the rest.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+MAX_DESTINATIONS = 16
+MAX_TRANSFERS = 64
+
+DEFAULT_LIMITS = {
+    "max_destinations": MAX_DESTINATIONS,
+    "max_destinations_per_host": None,
+    "max_transfers": MAX_TRANSFERS,
+    "max_transfers_per_host": None,
+}
+
+limits = dict(DEFAULT_LIMITS)
+lock = threading.Lock()
+transfer_slots = threading.BoundedSemaphore(MAX_TRANSFERS)
+host_transfer_slots = {}
+# the cancellation event of the current run, replaced by new_run
+cancelled = threading.Event()
+
+
+class Cancelled(Exception):
+    """Raised in transfers that stop because the run was interrupted."""
+
+
+def configure_limits(**new_limits):
+    """Set the limits of concurrency; those not given (or None) take their default."""
+    global transfer_slots
+    with lock:
+        limits.update(DEFAULT_LIMITS)
+        for name, value in new_limits.items():
+            if name not in limits:
+                raise ValueError(f"Unknown limit '{name}'")
+            if value is None:
+                continue
+            if not isinstance(value, int) or value < 1:
+                logging.warning(f"Invalid {name} {value!r}; using the default.")
+                continue
+            limits[name] = value
+        transfer_slots = threading.BoundedSemaphore(limits["max_transfers"])
+        host_transfer_slots.clear()
+
+
+def new_run():
+    """Start a run with its own cancellation event, and return the event."""
+    global cancelled
+    cancelled = threading.Event()
+    return cancelled
+
+
+def is_cancelled():
+    """Tell whether the current run was interrupted."""
+    return cancelled.is_set()
+
+
+def check_cancelled():
+    """Raise Cancelled if the current run was interrupted."""
+    if cancelled.is_set():
+        raise Cancelled("interrupted")
+
+
+@contextmanager
+def transfer_slot(host):
+    """Wait for a free transfer slot, globally and for the host, and hold it."""
+    per_host = limits["max_transfers_per_host"]
+    host_slots = None
+    if per_host is not None:
+        with lock:
+            host_slots = host_transfer_slots.setdefault(
+                host, threading.BoundedSemaphore(per_host)
+            )
+    with transfer_slots:
+        if host_slots is None:
+            yield
+        else:
+            with host_slots:
+                yield
+
+
+async def run_task(executor, semaphore, host_semaphores, task, results, index):
+    host, label, function = task
+    async with semaphore:
+        async with host_semaphores[host]:
+            loop = asyncio.get_running_loop()
+            try:
+                result = await loop.run_in_executor(executor, function)
+                results[index] = {"destination": label, "result": result, "error": None}
+            except Exception as e:
+                logging.error(f"Transfer with {label} failed: {e}")
+                results[index] = {"destination": label, "result": None, "error": e}
+
+
+async def orchestrate(tasks, results, run_cancelled):
+    executor = ThreadPoolExecutor(max_workers=limits["max_destinations"])
+    semaphore = asyncio.Semaphore(limits["max_destinations"])
+    per_host = limits["max_destinations_per_host"] or len(tasks) or 1
+    host_semaphores = {host: asyncio.Semaphore(per_host) for host, _, _ in tasks}
+    try:
+        await asyncio.gather(
+            *(
+                run_task(executor, semaphore, host_semaphores, task, results, i)
+                for i, task in enumerate(tasks)
+            )
+        )
+    except asyncio.CancelledError:
+        # tell the running transfers to stop, as threads cannot be cancelled
+        run_cancelled.set()
+        raise
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def run_all(tasks):
+    """
+    Run tasks, each a (host, label, function) tuple, with bounded concurrency.
+
+    Return a list with, for each task, a dictionary holding its label, the
+    result of its function and the exception it raised (or None). Tasks that
+    were cancelled have a Cancelled error; none start if the current run was
+    already interrupted.
+    """
+    run_cancelled = cancelled
+    results = [
+        {"destination": label, "result": None, "error": Cancelled("not started")}
+        for _, label, _ in tasks
+    ]
+    if len(tasks) == 0 or run_cancelled.is_set():
+        return results
+    try:
+        asyncio.run(orchestrate(tasks, results, run_cancelled))
+    except KeyboardInterrupt:
+        logging.warning("Interrupted; transfers that did not complete were stopped.")
+        raise
+    failed = sum(1 for result in results if result["error"] is not None)
+    if failed > 0:
+        logging.warning(f"{failed} of {len(tasks)} destinations failed.")
+    return results
@@ -0,0 +1,316 @@
+"""
+Transfer plans, which show what a push or a pull would transfer and how long
+it would take, without transferring anything.
+
+Times are estimated from the bandwidth and round-trip time (RTT) of each
+remote, which are measured unless they are set in its configuration, within
+the bandwidth limits (bwlimit) and following the relay tree of fanout.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import logging
+import time
+from functools import partial
+from pathlib import Path
+
+from redep import bandwidth as bandwidth_limits
+from redep.bandwidth import parse_limit
+from redep.manifest import (
+    MANIFEST_NAME,
+    empty_manifest,
+    read_local_manifest,
+    read_remote_manifest,
+    select_changes,
+)
+from redep.orchestrator import run_all
+from redep.pull import list_sources
+from redep.push import remote_path_strings
+from redep.relay import is_relayable, relay_children
+from redep.snapshot import current_release_local, current_release_remote
+from redep.util import (
+    SFTP_ROUND_TRIPS,
+    close_exec_channel,
+    expand_home_path_local,
+    expand_home_path_remote,
+    format_duration,
+    format_size,
+    identify_remote_os,
+    open_connection,
+    open_exec_channel,
+    parse_size,
+    select_local_patterns,
+)
+
+LARGEST_COUNT = 5
+PROBE_SIZE = 4 * 1024 * 1024
+
+
+def plan_push(root_dir, matches, ignores, destinations, full=False, fanout=0):
+    """
+    Report what a push would transfer to each destination, and how long it
+    would take, relaying through remotes if fanout is positive.
+    """
+    # never push a manifest that may exist in the source directory
+    ignores = ignores + [Path(MANIFEST_NAME)]
+    selected_files, selected_dirs, ignored_files, ignored_dirs = select_local_patterns(
+        root_dir, matches, ignores
+    )
+    logging.info(
+        f"Selected {len(selected_files)} files and {len(selected_dirs)} directories; ignored {len(ignored_files)} files and {len(ignored_dirs)} directories."
+    )
+    tasks = [
+        (
+            destination.get("host", None),
+            f"{destination.get('host', None)}:{destination.get('path', None)}",
+            partial(
+                plan_push_destination,
+                selected_files,
+                selected_dirs,
+                root_dir,
+                destination,
+                full,
+            ),
+        )
+        for destination in destinations
+    ]
+    plans = [result["result"] for result in run_all(tasks)]
+    report_plans(plans, push_stages(destinations, fanout))
+
+
+def push_stages(destinations, fanout=0):
+    """
+    Group the indices of destinations by the stage of the push in which they
+    are transferred: direct destinations and relay seeds first, and then each
+    level of the relay tree, one after the other.
+    """
+    relayed = []
+    if fanout > 0:
+        relayed = [i for i, d in enumerate(destinations) if is_relayable(d)]
+    direct = [i for i in range(len(destinations)) if i not in relayed]
+    if len(relayed) == 0:
+        return [direct]
+    seeds, children = relay_children(len(relayed), fanout)
+    stages = []
+    level = seeds
+    while len(level) > 0:
+        stages.append([relayed[i] for i in level])
+        level = [child for i in level for child in children[i]]
+    stages[0] = direct + stages[0]
+    return stages
+
+
+def plan_push_destination(files, dirs, root_dir, destination, full):
+    """Compute the plan of a push to one destination (None if it fails)."""
+    host = destination.get("host", None)
+    path = destination.get("path", None)
+    if host is None or path is None:
+        return
+    try:
+        if host == "":
+            path = expand_home_path_local(Path(path) if path != "" else Path("."))
+            if not path.is_absolute():
+                path = root_dir / path
+            reference = path
+            if destination.get("snapshots", False):
+                reference = current_release_local(path)
+            if full or reference is None:
+                manifest = empty_manifest()
+            else:
+                manifest = read_local_manifest(reference)
+            conn = None
+            remote_os = None
+            label = str(path)
+        else:
+            conn = open_connection(host)
+            remote_os = identify_remote_os(conn)
+            path = expand_home_path_remote(conn, Path(path), remote_os)
+            reference = path
+            if destination.get("snapshots", False) and remote_os != "windows":
+                reference = current_release_remote(conn, path)
+            if full or reference is None:
+                manifest = empty_manifest()
+            else:
+                _, str_manifest_path = remote_path_strings(
+                    reference, Path(MANIFEST_NAME), remote_os
+                )
+                manifest = read_remote_manifest(conn, str_manifest_path)
+            label = f"{conn.original_host}:{path}"
+        changed, new_dirs, _ = select_changes(files, dirs, root_dir, manifest)
+        sizes = {f: signature[0] for f, signature in changed.items()}
+        return make_plan(
+            f"Push to {label}", sizes, len(new_dirs), conn, remote_os, destination, True
+        )
+    except Exception as e:
+        logging.error(f"Could not plan push to {host}:{path}: {e}")
+
+
+def plan_pull(root_dir, matches, ignores, sources, conflict="first"):
+    """Report what a pull would transfer from each source."""
+    if isinstance(sources, dict):
+        sources = [sources]
+    # never pull the manifest left by a push to the source
+    ignores = ignores + [Path(MANIFEST_NAME)]
+    listings, _ = list_sources(root_dir, matches, ignores, sources, conflict, True)
+    plans = []
+    for listing in listings:
+        source = listing["source"]
+        conn = listing["conn"]
+        if conn is None:
+            label = str(listing["path"])
+            remote_os = None
+        else:
+            label = f"{conn.original_host}:{listing['path']}"
+            remote_os = identify_remote_os(conn)
+        sizes = {f: listing["stats"][f][0] for f in listing["files"]}
+        plans.append(
+            make_plan(
+                f"Pull from {label} to {listing['pull_to']}",
+                sizes,
+                len(listing["dirs"]),
+                conn,
+                remote_os,
+                source,
+                False,
+            )
+        )
+    report_plans(plans)
+
+
+def make_plan(label, sizes, dir_count, conn, remote_os, options, upload):
+    """Summarize the files to transfer, and estimate how long it takes."""
+    plan = {
+        "label": label,
+        "files": len(sizes),
+        "dirs": dir_count,
+        "bytes": sum(sizes.values()),
+        "largest": sorted(sizes.items(), key=lambda item: item[1], reverse=True)[
+            :LARGEST_COUNT
+        ],
+        "seconds": None,
+        "remote": conn is not None,
+    }
+    bandwidth = parse_size(options.get("bandwidth", None))
+    rtt = options.get("rtt", None)
+    if conn is not None and len(sizes) > 0:
+        if rtt is None:
+            rtt = measure_rtt(conn)
+        if bandwidth is None and remote_os != "windows":
+            bandwidth = measure_bandwidth(conn, upload, rtt)
+        # transfers with remotes do not go faster than the bandwidth limits
+        limits = [
+            parse_limit(options.get("bwlimit", None), options.get("bandwidth", None)),
+            global_limit(),
+        ]
+        bandwidth = min(
+            (b for b in [bandwidth] + limits if b is not None and b > 0), default=None
+        )
+    if bandwidth is None or bandwidth <= 0:
+        return plan
+    rtt = float(rtt or 0)
+    plan["bandwidth"] = bandwidth
+    plan["rtt"] = rtt
+    if options.get("transport", "sftp") in ("tar", "agent"):
+        round_trips = 2
+    else:
+        channels = max(1, int(options.get("parallel_channels", 1)))
+        round_trips = 2 + SFTP_ROUND_TRIPS * len(sizes) / channels
+    plan["seconds"] = plan["bytes"] / bandwidth + round_trips * rtt
+    return plan
+
+
+def measure_rtt(conn, count=3):
+    """Measure the round-trip time of a remote command, in seconds."""
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        conn.run("exit 0", hide=True, warn=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def measure_bandwidth(conn, upload, rtt=0):
+    """
+    Measure the bandwidth to (if upload is True) or from a POSIX host, in bytes
+    per second, by sending or receiving PROBE_SIZE bytes.
+    """
+    try:
+        start = time.perf_counter()
+        if upload:
+            channel = open_exec_channel(conn, "cat > /dev/null")
+            block = bytes(1024 * 1024)
+            for _ in range(PROBE_SIZE // len(block)):
+                channel.sendall(block)
+        else:
+            channel = open_exec_channel(conn, f"head -c {PROBE_SIZE} /dev/zero")
+            channel.makefile("rb").read()
+        status, _ = close_exec_channel(channel)
+        elapsed = time.perf_counter() - start - rtt
+    except Exception as e:
+        logging.debug(f"Could not measure bandwidth of {conn.original_host}: {e}")
+        return None
+    if status != 0:
+        return None
+    return PROBE_SIZE / max(elapsed, 1e-3)
+
+
+def global_limit():
+    """Return the limit of the total bandwidth of all transfers, or None."""
+    bucket = bandwidth_limits.global_bucket
+    return bucket.rate if bucket is not None else None
+
+
+def estimate_total(plans, stages):
+    """
+    Estimate the time of all transfers: the stages of plans (as indices) run
+    one after the other, and the plans of a stage at once. In the first
+    stage, transfers with remotes share the global bandwidth limit; later
+    stages are relayed between remotes.
+    """
+    total_seconds = 0
+    for index, stage in enumerate(stages):
+        stage_plans = [plans[i] for i in stage if plans[i] is not None]
+        seconds = max(
+            (p["seconds"] for p in stage_plans if p["seconds"] is not None),
+            default=0,
+        )
+        limit = global_limit()
+        if index == 0 and limit is not None:
+            remote_bytes = sum(p["bytes"] for p in stage_plans if p["remote"])
+            seconds = max(seconds, remote_bytes / limit)
+        total_seconds += seconds
+    return total_seconds
+
+
+def report_plans(plans, stages=None):
+    """
+    Log the plans, and the estimated total time, with the plans grouped in
+    stages as in estimate_total (by default, all at once).
+    """
+    if stages is None:
+        stages = [list(range(len(plans)))]
+    for plan in plans:
+        if plan is None:
+            continue
+        logging.info(
+            f"{plan['label']}: {plan['files']} files ({format_size(plan['bytes'])}), {plan['dirs']} directories."
+        )
+        for file_path, size in plan["largest"]:
+            logging.info(f"    {format_size(size):>10}  {file_path}")
+        if plan["seconds"] is None:
+            if plan["files"] > 0:
+                logging.info(
+                    "    Estimated time: unknown (set bandwidth to estimate it)."
+                )
+            continue
+        logging.info(
+            f"    Estimated time: {format_duration(plan['seconds'])} at {format_size(plan['bandwidth'])}/s with RTT {plan['rtt'] * 1000:.0f} ms."
+        )
+    if len(stages) > 1:
+        logging.info(
+            f"Destinations are reached in {len(stages)} stages through the relay tree."
+        )
+    logging.info(
+        f"Estimated total time: {format_duration(estimate_total(plans, stages))}. Nothing was transferred."
+    )
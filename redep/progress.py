@@ -0,0 +1,233 @@
+"""
+Live progress of transfers, with the bytes done, throughput and estimated
+time left for each destination (or source).
+
+Transfer loops only add to counters; a separate thread reads them at a fixed
+rate, and redraws a status line if the output is a terminal, or logs a
+summary line every SUMMARY_INTERVAL seconds otherwise.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import logging
+import shutil
+import sys
+import time
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+
+from redep.util import format_duration, format_size
+
+REFRESH_INTERVAL = 0.2
+SUMMARY_INTERVAL = 10.0
+# weight of the latest sample in the smoothed throughput
+SMOOTHING = 0.3
+
+lock = Lock()
+active = False
+transfers = {}
+
+
+def begin(key, files, size=None):
+    """
+    Announce a transfer of files (and size bytes, if known) to or from a
+    destination, identified by its host, or by its path if it is local.
+    """
+    if not active:
+        return
+    with lock:
+        transfer = transfers.setdefault(
+            key,
+            {"files": 0, "bytes": 0, "total_files": 0, "total_bytes": 0, "rate": None},
+        )
+        transfer["total_files"] += files
+        if size is None or transfer["total_bytes"] is None:
+            transfer["total_bytes"] = None
+        else:
+            transfer["total_bytes"] += size
+
+
+def advance(key, size, files=1):
+    """Count files and bytes transferred to or from a destination."""
+    if not active:
+        return
+    with lock:
+        transfer = transfers.get(key)
+        if transfer is not None:
+            transfer["files"] += files
+            transfer["bytes"] += size
+
+
+class FileProgress:
+    """
+    Count the bytes of a file as they are transferred, so that large files
+    show progress, and the file itself once it is complete.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.done = 0
+
+    def add(self, size):
+        if size != 0:
+            self.done += size
+            advance(self.key, size, files=0)
+
+    def restart(self):
+        """Forget the bytes counted by an attempt that did not complete."""
+        self.add(-self.done)
+
+    def complete(self, size):
+        """Count the file, and the bytes of its size that were not counted yet."""
+        advance(self.key, size - self.done)
+        self.done = size
+
+    def reader(self, stream):
+        """Wrap a stream, so that the bytes read from it are counted."""
+        return ProgressReader(stream, self) if active else stream
+
+    def callback(self, chained=None):
+        """
+        Return a callback(bytes transferred, total bytes) for SFTP transfers,
+        which counts the bytes and then calls chained, if given.
+        """
+        if not active:
+            return chained
+        start = self.done
+
+        def callback(transferred, total):
+            self.add(start + transferred - self.done)
+            if chained is not None:
+                chained(transferred, total)
+
+        return callback
+
+
+class ProgressReader:
+    """Count the bytes read from a stream as transferred."""
+
+    def __init__(self, stream, file_progress):
+        self.stream = stream
+        self.file_progress = file_progress
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.file_progress.add(len(data))
+        return data
+
+
+def describe(key, transfer):
+    """Describe the progress of a transfer in a few words."""
+    if transfer["total_bytes"] is not None:
+        text = f"{key} {format_size(transfer['bytes'])} of {format_size(transfer['total_bytes'])}"
+        remaining = transfer["total_bytes"] - transfer["bytes"]
+    else:
+        text = f"{key} {transfer['files']} of {transfer['total_files']} files"
+        remaining = None
+    rate = transfer["rate"]
+    if rate is not None:
+        text += f", {format_size(rate)}/s"
+        if remaining is None and transfer["files"] > 0:
+            # estimate the remaining bytes from the average file size
+            average = transfer["bytes"] / transfer["files"]
+            remaining = (transfer["total_files"] - transfer["files"]) * average
+        if remaining is not None and rate > 0:
+            text += f", {format_duration(remaining / rate)} left"
+    return text
+
+
+class ProgressDisplay:
+    """Show the progress of all transfers, until stopped."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.interactive = stream.isatty()
+        self.stop_event = Event()
+        self.output_lock = Lock()
+        self.shown = False
+        self.thread = Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.clear()
+
+    def run(self):
+        samples = {}
+        last_summary = time.monotonic()
+        while not self.stop_event.wait(REFRESH_INTERVAL):
+            now = time.monotonic()
+            with lock:
+                for key, transfer in transfers.items():
+                    previous = samples.get(key)
+                    samples[key] = (now, transfer["bytes"])
+                    if previous is None:
+                        continue
+                    rate = (transfer["bytes"] - previous[1]) / (now - previous[0])
+                    if transfer["rate"] is None:
+                        transfer["rate"] = rate
+                    else:
+                        transfer["rate"] += SMOOTHING * (rate - transfer["rate"])
+                descriptions = [
+                    describe(key, transfer)
+                    for key, transfer in transfers.items()
+                    if transfer["files"] < transfer["total_files"]
+                ]
+            if self.interactive:
+                self.draw(" | ".join(descriptions))
+            elif descriptions and now - last_summary >= SUMMARY_INTERVAL:
+                last_summary = now
+                logging.info(f"Progress: {'; '.join(descriptions)}.")
+
+    def draw(self, line):
+        width = shutil.get_terminal_size().columns - 1
+        with self.output_lock:
+            self.stream.write("\r\033[K" + line[:width])
+            self.stream.flush()
+            self.shown = line != ""
+
+    def clear(self):
+        """Erase the status line, so that other output can take its place."""
+        with self.output_lock:
+            if self.shown:
+                self.stream.write("\r\033[K")
+                self.stream.flush()
+                self.shown = False
+
+
+class ClearStatusLine(logging.Filter):
+    """Erase the status line before a log record is written over it."""
+
+    def __init__(self, display):
+        super().__init__()
+        self.display = display
+
+    def filter(self, record):
+        self.display.clear()
+        return True
+
+
+@contextmanager
+def show_progress(stream=None):
+    """Track and show the progress of the transfers started in the enclosed block."""
+    global active
+    display = ProgressDisplay(stream if stream is not None else sys.stderr)
+    handlers = list(logging.getLogger().handlers)
+    log_filter = ClearStatusLine(display)
+    for handler in handlers:
+        handler.addFilter(log_filter)
+    with lock:
+        transfers.clear()
+        active = True
+    display.start()
+    try:
+        yield
+    finally:
+        active = False
+        display.stop()
+        for handler in handlers:
+            handler.removeFilter(log_filter)
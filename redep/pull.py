@@ -1,31 +1,168 @@
 import logging
+import os
+import re
+import shlex
 import shutil
+import struct
+import tarfile
+from functools import partial
 from pathlib import Path, PurePosixPath
+from threading import Lock, Thread
 
+from redep import metrics, progress
+from redep.agent import AgentError, configure_agents, get_agent
+from redep.bandwidth import (
+    configure_remote_limits,
+    throttled_reader,
+    throttled_writer,
+    transfer_callback,
+)
+from redep.compression import (
+    CHUNK_SIZE,
+    DecompressedReader,
+    is_compressible,
+    normalize_codec,
+    remote_compress_command,
+    resolve_level,
+    windows_tar_options,
+)
+from redep.delta import apply_delta, block_size_for, compute_signature, delta_command
+from redep.localcopy import copy_files
+from redep.manifest import MANIFEST_NAME
+from redep.orchestrator import Cancelled, check_cancelled, run_all, transfer_slot
+from redep.resume import (
+    RESUME_ROUND_TRIPS,
+    RESUME_THRESHOLD,
+    download_resumable,
+    remote_resume_threshold,
+)
 from redep.util import (
+    SFTP_ROUND_TRIPS,
+    THROTTLED_PREFETCH_REQUESTS,
+    HashingReader,
+    HashingWriter,
+    close_exec_channel,
+    download_file,
     expand_home_path_local,
     expand_home_path_remote,
     identify_remote_os,
     open_connection,
+    open_exec_channel,
+    parse_size,
+    run_with_channels,
     select_leaf_directories,
     select_local_patterns,
     select_remote_patterns,
 )
+from redep.verify import new_hasher, verify_copies, verify_remote
 
+CONFLICT_POLICIES = ("first", "newest", "subdir")
 
-def pull(root_dir, matches, ignores, source):
-    if isinstance(source, list):
-        if len(source) > 1:
-            logging.warning(
-                "Multiple sources specified for pull; only the first will be used."
-            )
-        source = source[0]
-    logging.debug(f"Root directory determined as: {root_dir}")
-    host = source.get("host", None)
-    path = source.get("path", None)
-    if host is None or path is None:
-        logging.error(f"Cannot pull from improperly specified host or path: {source}")
+
+def pull(root_dir, matches, ignores, sources, conflict="first", verify=False):
+    """
+    Pull from every source concurrently into root_dir.
+
+    Files that exist in several sources are taken from the first source that
+    lists them if conflict is "first", or from the one where they were
+    modified last if it is "newest". If conflict is "subdir", each source is
+    pulled into its own subdirectory of root_dir, named after its host.
+    If verify is True, pulled files are checked against hashes computed on the
+    sources, and transferred again if they differ.
+    Return the results of the sources that could not be listed, and of those
+    pulled from, as given by run_all.
+    """
+    if isinstance(sources, dict):
+        sources = [sources]
+    if conflict not in CONFLICT_POLICIES:
+        logging.error(f"Unknown conflict policy '{conflict}'; aborting.")
         return
+    logging.debug(f"Root directory determined as: {root_dir}")
+    # never pull the manifest left by a push to the source
+    ignores = ignores + [Path(MANIFEST_NAME)]
+    configure_remote_limits(sources)
+    configure_agents(sources)
+    with metrics.span("pull", sources=len(sources)):
+        listings, failures = list_sources(
+            root_dir, matches, ignores, sources, conflict, conflict == "newest"
+        )
+        if len(listings) == 0:
+            logging.warning("No files or directories selected for pull; aborting.")
+            return failures
+        total = sum(len(listing["files"]) for listing in listings)
+        logging.info(f"Pulling {total} files from {len(listings)} sources.")
+
+        # pull from all sources at once
+        completed = []
+        lock = Lock()
+        tasks = [
+            (
+                listing["source"]["host"],
+                f"{listing['source']['host']}:{listing['path']}",
+                partial(
+                    pull_source,
+                    listing,
+                    len(listings),
+                    total,
+                    completed,
+                    lock,
+                    verify,
+                ),
+            )
+            for listing in listings
+        ]
+        with progress.show_progress():
+            results = run_all(tasks)
+    logging.info("All pull operations completed.")
+    return failures + results
+
+
+def list_sources(root_dir, matches, ignores, sources, conflict, with_stats=False):
+    """
+    List all sources at once, and resolve conflicts between them.
+
+    Return a listing for each source with something to pull, holding the
+    files to pull from it and where to pull them, and the results (as given
+    by run_all) of the sources that could not be listed.
+    """
+    valid_sources = []
+    for source in sources:
+        if source.get("host", None) is None or source.get("path", None) is None:
+            logging.error(
+                f"Cannot pull from improperly specified host or path: {source}"
+            )
+            continue
+        valid_sources.append(source)
+    sources = valid_sources
+    tasks = [
+        (
+            source["host"],
+            f"{source['host']}:{source['path']}",
+            partial(list_source, root_dir, matches, ignores, source, with_stats),
+        )
+        for source in sources
+    ]
+    results = run_all(tasks)
+    listings = [result["result"] for result in results if result["result"] is not None]
+    failures = [result for result in results if result["error"] is not None]
+    if conflict == "subdir":
+        names = source_subdirectories(listing["source"] for listing in listings)
+        for listing, name in zip(listings, names):
+            listing["pull_to"] = root_dir / name
+    else:
+        assign_files(listings, conflict)
+    return listings, failures
+
+
+def list_source(root_dir, matches, ignores, source, with_stats):
+    """
+    Select the files and directories to pull from a source, and return them
+    in a listing (or None if nothing is selected).
+    """
+    host = source["host"]
+    path = source["path"]
+    # remote listings hold the stats anyway, and resumable downloads need them
+    stats = {} if with_stats or host != "" else None
     if host == "":
         # interpret as local pull (which is not the same as connection to localhost)
         if path == "":
@@ -35,26 +172,167 @@ def pull(root_dir, matches, ignores, source):
             path = (root_dir / Path(path)).resolve()
         # expand ~ if needed
         path = expand_home_path_local(path)
+        conn = None
         selected_files, selected_dirs, ignored_files, ignored_dirs = (
             select_local_patterns(path, matches, ignores)
         )
-        if len(selected_files) == 0 and len(selected_dirs) == 0:
-            logging.warning("No files or directories selected for pull; aborting.")
-            return
-        pull_local(selected_files, selected_dirs, path, root_dir)
+        if with_stats:
+            for file_path in selected_files:
+                stat = file_path.stat()
+                stats[file_path] = (stat.st_size, stat.st_mtime)
     else:
         conn = open_connection(host)
+        remote_os = identify_remote_os(conn)
+        path = expand_home_path_remote(conn, path, remote_os)
         selected_files, selected_dirs, ignored_files, ignored_dirs = (
-            select_remote_patterns(conn, path, matches, ignores)
+            select_remote_patterns(conn, path, matches, ignores, stats, get_agent(conn))
         )
-        if len(selected_files) == 0 and len(selected_dirs) == 0:
-            logging.warning("No files or directories selected for pull; aborting.")
-            return
-        pull_remote(conn, selected_files, selected_dirs, path, root_dir)
-    logging.info("All pull operations completed.")
+    if len(selected_files) == 0 and len(selected_dirs) == 0:
+        logging.warning(
+            f"No files or directories selected for pull from {host}:{path}."
+        )
+        return
+    return {
+        "source": source,
+        "conn": conn,
+        "path": path,
+        "pull_to": root_dir,
+        "files": selected_files,
+        "dirs": selected_dirs,
+        "stats": stats,
+    }
+
+
+def source_subdirectories(sources):
+    """Name a subdirectory for each source after its host, numbering repeated hosts."""
+    names = []
+    for source in sources:
+        base = re.sub(r"[^A-Za-z0-9._-]", "_", source["host"]) or "local"
+        name = base
+        count = 1
+        while name in names:
+            count += 1
+            name = f"{base}_{count}"
+        names.append(name)
+    return names
+
+
+def assign_files(listings, conflict):
+    """
+    Keep in each listing only the files it wins according to the conflict
+    policy, so that each file is pulled from one source only.
+    """
+    winners = {}
+    for i, listing in enumerate(listings):
+        for file_path in listing["files"]:
+            key = file_path.relative_to(listing["path"]).as_posix()
+            mtime = listing["stats"][file_path][1] if conflict == "newest" else 0
+            # ties go to the first source
+            if key not in winners or mtime > winners[key][1]:
+                winners[key] = (i, mtime)
+    for i, listing in enumerate(listings):
+        kept = {
+            file_path
+            for file_path in listing["files"]
+            if winners[file_path.relative_to(listing["path"]).as_posix()][0] == i
+        }
+        skipped = len(listing["files"]) - len(kept)
+        if skipped > 0:
+            logging.info(
+                f"Skipping {skipped} files of {listing['source']['host']}:{listing['path']} that are pulled from other sources."
+            )
+        listing["files"] = kept
+
+
+def pull_source(listing, sources, total, completed, lock, verify=False):
+    """
+    Pull the files of a listing, and report the combined progress.
+    Return True if all files were pulled; errors are raised to the
+    orchestrator, so that the source is reported as failed.
+    """
+    source = listing["source"]
+    stats = listing["stats"]
+    if listing["conn"] is None:
+        key = str(listing["path"])
+    else:
+        # sources on the same host have their own progress
+        key = f"{listing['conn'].original_host}:{listing['path']}"
+    progress.begin(
+        key,
+        len(listing["files"]),
+        sum(stats[f][0] for f in listing["files"]) if stats is not None else None,
+    )
+    if listing["conn"] is None:
+        pull_local(
+            listing["files"],
+            listing["dirs"],
+            listing["path"],
+            listing["pull_to"],
+            verify,
+        )
+        pulled = True
+    else:
+        pulled = pull_remote(
+            listing["conn"],
+            listing["files"],
+            listing["dirs"],
+            listing["path"],
+            listing["pull_to"],
+            delta_threshold=parse_size(source.get("delta_threshold", None)),
+            transport=source.get("transport", "sftp"),
+            compression=source.get("compression", None),
+            compression_level=source.get("compression_level", None),
+            parallel_channels=source.get("parallel_channels", 1),
+            resume_threshold=remote_resume_threshold(source),
+            stats=stats,
+            verify=verify,
+            progress_key=key,
+        )
+    with lock:
+        completed.append(listing)
+        files = sum(len(done["files"]) for done in completed)
+        logging.info(
+            f"Pull progress: {len(completed)} of {sources} sources, {files} of {total} files."
+        )
+    return pulled
+
 
+def pull_remote(
+    conn,
+    files,
+    dirs,
+    pull_from,
+    pull_to,
+    delta_threshold=None,
+    transport="sftp",
+    compression=None,
+    compression_level=None,
+    parallel_channels=1,
+    resume_threshold=RESUME_THRESHOLD,
+    stats=None,
+    verify=False,
+    progress_key=None,
+):
+    """
+    Pull files and directories from a remote source.
 
-def pull_remote(conn, files, dirs, pull_from, pull_to):
+    With the "sftp" transport, files are downloaded one by one, and those whose
+    local copy has at least delta_threshold bytes are updated with a delta
+    transfer, if possible; downloads are spread across parallel_channels SFTP
+    sessions. If stats holds the size and modification time of the files, as
+    filled by select_remote_patterns, other files of at least resume_threshold
+    bytes are downloaded through partial files, resuming interrupted
+    downloads.
+    With the "tar" transport, all files are streamed as a single tar archive.
+    With the "agent" transport, files are streamed back to back from a helper
+    running on the remote host (see redep.agent).
+    If compression is "gzip" or "zstd", data is compressed in flight, except
+    for files that are already compressed.
+    If verify is True, files are hashed while they are received, and those
+    whose hash on the remote host differs are downloaded again.
+    Progress is reported under progress_key (by default, the host).
+    Return True if all files were pulled.
+    """
     if type(conn) is str:
         # allow passing host instead of connection object
         host = conn
@@ -73,22 +351,542 @@ def pull_remote(conn, files, dirs, pull_from, pull_to):
         destination_dir = pull_to / relative_path
         logging.debug(f"Creating local directory: {destination_dir}")
         destination_dir.mkdir(parents=True, exist_ok=True)
-    # pull files
-    for file_path in files:
+    if transport not in ("sftp", "tar", "agent"):
+        logging.warning(f"Unknown transport '{transport}'; using sftp.")
+        transport = "sftp"
+    agent = get_agent(conn)
+    if transport == "agent" and agent is None:
+        transport = "sftp"
+    compression = normalize_codec(compression)
+    if compression is not None:
+        compression_level = resolve_level(compression, compression_level)
+    hashes = {} if verify else None
+    with metrics.span("transfer", destination=conn.original_host, transport=transport):
+        if transport == "tar":
+            completed = pull_tar(
+                conn,
+                files,
+                pull_from,
+                pull_to,
+                remote_os,
+                compression,
+                compression_level,
+                hashes,
+                progress_key,
+            )
+        elif transport == "agent":
+            completed = pull_agent(
+                conn,
+                agent,
+                files,
+                pull_from,
+                pull_to,
+                remote_os,
+                hashes,
+                progress_key,
+            )
+        else:
+            completed = pull_sftp(
+                conn,
+                files,
+                pull_from,
+                pull_to,
+                remote_os,
+                delta_threshold,
+                compression,
+                compression_level,
+                parallel_channels,
+                resume_threshold if stats is not None else None,
+                stats,
+                hashes,
+                progress_key,
+            )
+    if verify and not verify_pull(conn, hashes, pull_from, pull_to, remote_os):
+        completed = False
+    logging.info(f"Completed pull from remote host: {conn.original_host}:{pull_from}")
+    return completed
+
+
+def pull_sftp(
+    conn,
+    files,
+    pull_from,
+    pull_to,
+    remote_os,
+    delta_threshold=None,
+    compression=None,
+    compression_level=None,
+    parallel_channels=1,
+    resume_threshold=None,
+    stats=None,
+    hashes=None,
+    progress_key=None,
+):
+    """
+    Download files with SFTP, one by one or spread across parallel_channels
+    SFTP sessions. Files of at least resume_threshold bytes, according to
+    stats, are downloaded through partial files.
+    If hashes is a dictionary, the SHA-256 of each file downloaded is added
+    to it, computed while writing the file.
+    Return True if all files were downloaded.
+    """
+    progress_key = progress_key or conn.original_host
+    # delta transfers need python3 on the remote host
+    delta_available = False
+    if delta_threshold is not None and remote_os != "windows":
+        delta_available = None
+    # compressed downloads need a compressor on the remote host
+    if compression is not None and remote_os == "windows":
+        logging.warning(
+            f"Compression with the sftp transport is not supported on Windows hosts; receiving data uncompressed from {conn.original_host}."
+        )
+        compression = None
+    lock = Lock()
+    # formatting a message per file is costly, even if it is not logged
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+
+    def start_hash():
+        # each attempt hashes the file from the start
+        return new_hasher() if hashes is not None else None
+
+    def pull_file(sftp, file_path):
+        nonlocal delta_available, compression
         relative_path = file_path.relative_to(pull_from)
         destination_path = pull_to / relative_path
-        logging.debug(
-            f"Downloading {conn.original_host}:{str(file_path)} to {destination_path}"
+        str_file_path = remote_file_string(file_path, remote_os)
+        pulled = False
+        file_progress = progress.FileProgress(progress_key)
+        if (
+            delta_available is not False
+            and destination_path.is_file()
+            and destination_path.stat().st_size >= delta_threshold
+        ):
+            with lock:
+                if delta_available is None:
+                    delta_available = conn.run(
+                        "python3 -c pass", hide=True, warn=True
+                    ).ok
+                    if not delta_available:
+                        logging.warning(
+                            f"python3 not found on {conn.original_host}; delta transfers disabled."
+                        )
+            if delta_available:
+                if debug:
+                    logging.debug(
+                        f"Downloading delta of {conn.original_host}:{str(file_path)} to {destination_path}"
+                    )
+                hasher = start_hash()
+                pulled = pull_file_delta(
+                    conn, str_file_path, destination_path, hasher, file_progress
+                )
+        if (
+            not pulled
+            and resume_threshold is not None
+            and stats[file_path][0] >= resume_threshold
+        ):
+            if debug:
+                logging.debug(
+                    f"Downloading {conn.original_host}:{str(file_path)} to {destination_path} through a partial file"
+                )
+            throttle = transfer_callback(conn.original_host)
+            hasher = start_hash()
+            file_progress.restart()
+            chunks = download_resumable(
+                sftp,
+                str_file_path,
+                destination_path,
+                stats[file_path],
+                file_progress.callback(throttle),
+                THROTTLED_PREFETCH_REQUESTS if throttle is not None else None,
+                hasher,
+            )
+            metrics.count(
+                conn.original_host,
+                "round_trips",
+                SFTP_ROUND_TRIPS + RESUME_ROUND_TRIPS + chunks,
+            )
+            pulled = True
+        if not pulled and compression is not None and is_compressible(file_path):
+            if debug:
+                logging.debug(
+                    f"Downloading compressed {conn.original_host}:{str(file_path)} to {destination_path}"
+                )
+            hasher = start_hash()
+            file_progress.restart()
+            pulled = pull_file_compressed(
+                conn,
+                str_file_path,
+                destination_path,
+                compression,
+                compression_level,
+                hasher,
+                file_progress,
+            )
+            if not pulled:
+                logging.warning(
+                    f"Compressed download from {conn.original_host} failed; receiving data uncompressed."
+                )
+                compression = None
+        if not pulled:
+            if debug:
+                logging.debug(
+                    f"Downloading {conn.original_host}:{str(file_path)} to {destination_path}"
+                )
+            throttle = transfer_callback(conn.original_host)
+            hasher = start_hash()
+            file_progress.restart()
+            download_file(
+                sftp,
+                str_file_path,
+                destination_path,
+                file_progress.callback(throttle),
+                hasher,
+                THROTTLED_PREFETCH_REQUESTS if throttle is not None else None,
+            )
+            metrics.count(conn.original_host, "round_trips", SFTP_ROUND_TRIPS)
+        if hashes is not None:
+            hashes[file_path] = hasher.hexdigest()
+        if metrics.recording or progress.active:
+            size = destination_path.stat().st_size
+            metrics.count(conn.original_host, "files")
+            metrics.count(conn.original_host, "bytes", size)
+            file_progress.complete(size)
+
+    failed = run_with_channels(conn, files, pull_file, parallel_channels)
+    if len(failed) > 0:
+        logging.error(
+            f"{len(failed)} files could not be pulled from {conn.original_host}:{pull_from}."
         )
-        if remote_os == "windows":
-            str_file_path = "/" + str(file_path).replace("/", "\\")
-        else:
-            str_file_path = str(file_path)
-        conn.get(str_file_path, str(destination_path))
-    logging.info(f"Completed pull from remote host: {conn.original_host}:{pull_from}")
+    return len(failed) == 0
+
+
+def pull_agent(
+    conn, agent, files, pull_from, pull_to, remote_os, hashes=None, progress_key=None
+):
+    """
+    Receive files from the helper of the agent transport, requesting them all
+    at once. If hashes is a dictionary, the SHA-256 of each file received is
+    added to it. Return True if all files were received.
+    """
+    progress_key = progress_key or conn.original_host
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    remote_files = {remote_file_string(f, remote_os): f for f in files}
+    items = [
+        (
+            str_file_path,
+            pull_to / file_path.relative_to(pull_from),
+            new_hasher() if hashes is not None else None,
+        )
+        for str_file_path, file_path in remote_files.items()
+    ]
+    failed = 0
+    with transfer_slot(conn.original_host):
+        try:
+            for (str_file_path, destination_path, hasher), error in agent.get_files(
+                items, progress_key
+            ):
+                if error is not None:
+                    logging.error(
+                        f"Transfer of {conn.original_host}:{str_file_path} failed: {error}"
+                    )
+                    failed += 1
+                    continue
+                if debug:
+                    logging.debug(
+                        f"Received {conn.original_host}:{str_file_path} to {destination_path}"
+                    )
+                if hashes is not None:
+                    hashes[remote_files[str_file_path]] = hasher.hexdigest()
+                # the bytes were counted as they were received
+                progress.advance(progress_key, 0)
+                if metrics.recording:
+                    size = destination_path.stat().st_size
+                    metrics.count(conn.original_host, "files")
+                    metrics.count(conn.original_host, "bytes", size)
+        except AgentError as e:
+            logging.error(f"Transfer from {conn.original_host}:{pull_from} failed: {e}")
+            return False
+    if failed > 0:
+        logging.error(
+            f"{failed} files could not be pulled from {conn.original_host}:{pull_from}."
+        )
+    return failed == 0
+
+
+def pull_tar(
+    conn,
+    files,
+    pull_from,
+    pull_to,
+    remote_os,
+    compression=None,
+    compression_level=None,
+    hashes=None,
+    progress_key=None,
+):
+    """
+    Download files as tar archives, streamed from tar processes on the remote
+    host that read the list of files from their standard input.
+    With compression, files that are already compressed are received in a
+    separate, uncompressed archive.
+    If hashes is a dictionary, the SHA-256 of each file is added to it.
+    Return True if all archives were received.
+    """
+    if compression is None:
+        groups = [(files, None)]
+    else:
+        compressible = {f for f in files if is_compressible(f)}
+        groups = [(compressible, compression), (set(files) - compressible, None)]
+    completed = True
+    for group_files, codec in groups:
+        if len(group_files) > 0:
+            with transfer_slot(conn.original_host):
+                if not pull_tar_stream(
+                    conn,
+                    group_files,
+                    pull_from,
+                    pull_to,
+                    remote_os,
+                    codec,
+                    compression_level,
+                    hashes,
+                    progress_key,
+                ):
+                    completed = False
+    return completed
+
+
+def pull_tar_stream(
+    conn,
+    files,
+    pull_from,
+    pull_to,
+    remote_os,
+    compression,
+    compression_level,
+    hashes=None,
+    progress_key=None,
+):
+    """
+    Download files as a single tar archive.
+    If hashes is a dictionary, the SHA-256 of each file is added to it.
+    Return True if the archive was received and extracted.
+    """
+    progress_key = progress_key or conn.original_host
+    if remote_os == "windows":
+        command = f'tar -c -f - -C "{pull_from}" --null --no-recursion -T -'
+        if compression is not None:
+            options = windows_tar_options(compression, compression_level)
+            command = (
+                f'tar -c {options} -f - -C "{pull_from}" --null --no-recursion -T -'
+            )
+    else:
+        command = (
+            f"tar -c -f - -C {shlex.quote(str(pull_from))} --null --no-recursion -T -"
+        )
+        if compression is not None:
+            command += f" | {remote_compress_command(compression, compression_level)}"
+    names = b"".join(
+        file_path.relative_to(pull_from).as_posix().encode() + b"\0"
+        for file_path in files
+    )
+    channel = open_exec_channel(conn, command)
+
+    def send_names():
+        try:
+            channel.sendall(names)
+        finally:
+            channel.shutdown_write()
+
+    # send the list while receiving the archive, so that neither side blocks
+    sender = Thread(target=send_names)
+    sender.start()
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    try:
+        archive = throttled_reader(channel.makefile("rb"), conn.original_host)
+        if compression is not None:
+            archive = DecompressedReader(archive, compression)
+        with tarfile.open(fileobj=archive, mode="r|") as tar:
+            for member in tar:
+                check_cancelled()
+                if debug:
+                    logging.debug(
+                        f"Extracting {conn.original_host}:{member.name} to {pull_to}"
+                    )
+                if member.isfile() and (hashes is not None or progress.active):
+                    file_progress = progress.FileProgress(progress_key)
+                    hasher = new_hasher() if hashes is not None else None
+                    extract_file(tar, member, pull_to, hasher, file_progress)
+                    if hasher is not None:
+                        hashes[pull_from / member.name] = hasher.hexdigest()
+                    file_progress.complete(member.size)
+                else:
+                    tar.extract(member, pull_to, filter="data")
+                if member.isfile():
+                    metrics.count(conn.original_host, "files")
+                    metrics.count(conn.original_host, "bytes", member.size)
+        completed = True
+    except (OSError, EOFError, tarfile.TarError) as e:
+        logging.error(f"Tar stream from {conn.original_host} interrupted: {e}")
+        completed = False
+    except Cancelled:
+        channel.close()
+        sender.join()
+        raise
+    sender.join()
+    status, stderr = close_exec_channel(channel)
+    if status != 0:
+        logging.error(
+            f"Tar archiving on {conn.original_host}:{pull_from} failed: {stderr.strip()}"
+        )
+    return completed and status == 0
+
+
+def extract_file(tar, member, pull_to, hasher=None, file_progress=None):
+    """
+    Extract a regular file from a tar archive like tar.extract with the data
+    filter, feeding hasher, if given, with its content, and counting its
+    bytes with file_progress, if given.
+    """
+    member = tarfile.data_filter(member, str(pull_to))
+    target = pull_to / member.name
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with tar.extractfile(member) as source, open(target, "wb") as output:
+        reader = source
+        if file_progress is not None:
+            reader = file_progress.reader(reader)
+        if hasher is not None:
+            reader = HashingReader(reader, hasher)
+        shutil.copyfileobj(reader, output, CHUNK_SIZE)
+    tar.chmod(member, str(target))
+    tar.utime(member, str(target))
+
+
+def pull_file_compressed(
+    conn,
+    str_remote_path,
+    destination_path,
+    compression,
+    level,
+    hasher=None,
+    file_progress=None,
+):
+    """
+    Download a file through a compressor running on a POSIX remote host,
+    feeding hasher, if given, with the file, and counting its bytes with
+    file_progress, if given.
+    Return False if the download could not be completed, in which case the
+    local file is left unchanged.
+    """
+    channel = open_exec_channel(
+        conn,
+        f"{remote_compress_command(compression, level)} < {shlex.quote(str_remote_path)}",
+    )
+    channel.shutdown_write()
+    temp_path = destination_path.with_name(destination_path.name + ".redep-partial")
+    try:
+        reader = DecompressedReader(
+            throttled_reader(channel.makefile("rb"), conn.original_host), compression
+        )
+        with open(temp_path, "wb") as output:
+            if file_progress is not None:
+                reader = file_progress.reader(reader)
+            if hasher is not None:
+                reader = HashingReader(reader, hasher)
+            shutil.copyfileobj(reader, output, CHUNK_SIZE)
+        ok = True
+    except OSError as e:
+        logging.debug(f"Compressed download of {str_remote_path} interrupted: {e}")
+        ok = False
+    status, stderr = close_exec_channel(channel)
+    if ok and status == 0:
+        if destination_path.exists():
+            shutil.copymode(destination_path, temp_path)
+        os.replace(temp_path, destination_path)
+        return True
+    logging.debug(f"Compressed download of {str_remote_path} failed: {stderr.strip()}")
+    temp_path.unlink(missing_ok=True)
+    return False
 
 
-def pull_local(files, dirs, pull_from, pull_to):
+def pull_file_delta(
+    conn, str_remote_path, destination_path, hasher=None, file_progress=None
+):
+    """
+    Update an existing local file by receiving only the blocks that differ from
+    the remote file, feeding hasher, if given, with the result, and counting
+    the bytes received with file_progress, if given. Both the signature and
+    the delta are transferred within the bandwidth limits. Return False if the
+    delta transfer could not be completed, in which case the local file is
+    left unchanged.
+    """
+    size = destination_path.stat().st_size
+    with open(destination_path, "rb") as basis:
+        signature = compute_signature(basis, block_size_for(size))
+    # above this size, receiving the whole file is not worth the effort
+    channel = open_exec_channel(
+        conn, delta_command("delta", str_remote_path, size // 2)
+    )
+    stdin = channel.makefile_stdin("wb")
+    writer = throttled_writer(stdin, conn.original_host)
+    # in chunks, so that the limits pace the upload
+    for start in range(0, len(signature), CHUNK_SIZE):
+        writer.write(signature[start : start + CHUNK_SIZE])
+    stdin.close()
+    channel.shutdown_write()
+    temp_path = destination_path.with_name(destination_path.name + ".redep-delta")
+    try:
+        with open(destination_path, "rb") as basis, open(temp_path, "wb") as output:
+            if hasher is not None:
+                output = HashingWriter(output, hasher)
+            delta = throttled_reader(channel.makefile("rb"), conn.original_host)
+            if file_progress is not None:
+                delta = file_progress.reader(delta)
+            ok = apply_delta(basis, delta, output)
+    except (ValueError, struct.error):
+        ok = False
+    status, stderr = close_exec_channel(channel)
+    if ok and status == 0:
+        shutil.copymode(destination_path, temp_path)
+        os.replace(temp_path, destination_path)
+        return True
+    logging.debug(f"Delta transfer of {str_remote_path} failed: {stderr.strip()}")
+    temp_path.unlink(missing_ok=True)
+    return False
+
+
+def verify_pull(conn, hashes, pull_from, pull_to, remote_os):
+    """
+    Compare the hashes of the files pulled from a remote source with those
+    computed on the remote host, and download the files that differ again.
+    Return True if all files match.
+    """
+    str_paths = {
+        file_path: remote_file_string(file_path, remote_os) for file_path in hashes
+    }
+    differing = verify_remote(conn, hashes, str_paths, remote_os)
+    if len(differing) > 0:
+        logging.warning(
+            f"{len(differing)} files from {conn.original_host}:{pull_from} differ after transfer; pulling them again."
+        )
+        hashes = {}
+        pull_sftp(conn, differing, pull_from, pull_to, remote_os, hashes=hashes)
+        differing = verify_remote(conn, hashes, str_paths, remote_os)
+        for file_path in differing:
+            logging.error(
+                f"{pull_to / file_path.relative_to(pull_from)} still differs from {conn.original_host}:{str(file_path)}."
+            )
+    return len(differing) == 0
+
+
+def remote_file_string(file_path, remote_os):
+    """Return the string form of a remote file path, as accepted by SFTP."""
+    if remote_os == "windows":
+        return "/" + str(file_path).replace("/", "\\")
+    return str(file_path)
+
+
+def pull_local(files, dirs, pull_from, pull_to, verify=False):
     # expand ~ if needed
     pull_from = expand_home_path_local(pull_from)
     # if pull_from is relative, make it absolute with respect to pull_to (plays the role of root_dir here)
@@ -108,10 +906,21 @@ def pull_local(files, dirs, pull_from, pull_to):
         destination_dir = pull_to / relative_path
         logging.debug(f"Creating local directory: {destination_dir}")
         destination_dir.mkdir(parents=True, exist_ok=True)
-    # push files
-    for file_path in files:
-        relative_path = file_path.relative_to(pull_from)
-        destination_path = pull_to / relative_path
-        logging.debug(f"Copying {str(file_path)} to {destination_path}")
-        shutil.copyfile(file_path, destination_path)
+    # pull files
+    pairs = [
+        (file_path, pull_to / file_path.relative_to(pull_from)) for file_path in files
+    ]
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    with metrics.span("transfer", destination=str(pull_from), transport="copy"):
+        for file_path, destination_path in copy_files(pairs):
+            if debug:
+                logging.debug(f"Copied {str(file_path)} to {destination_path}")
+            if metrics.recording or progress.active:
+                size = destination_path.stat().st_size
+                metrics.count(str(pull_from), "files")
+                metrics.count(str(pull_from), "bytes", size)
+                progress.advance(str(pull_from), size)
+            check_cancelled()
+        if verify:
+            verify_copies(pairs, str(pull_from))
     logging.info(f"Completed push to local system from: {pull_from}")
@@ -1,28 +1,137 @@
+import base64
 import logging
+import shlex
 import shutil
+import tarfile
+from functools import partial as partial_function
 from pathlib import Path, PurePosixPath, PureWindowsPath
-from threading import Thread
 
+from redep import metrics, progress
+from redep.agent import AgentError, configure_agents, get_agent
+from redep.bandwidth import (
+    configure_remote_limits,
+    throttled_reader,
+    throttled_writer,
+    transfer_callback,
+)
+from redep.compression import (
+    CHUNK_SIZE,
+    COMPRESSED_SUFFIX,
+    CompressedWriter,
+    is_compressible,
+    normalize_codec,
+    remote_decompress_command,
+    resolve_level,
+)
+from redep.delta import DeltaTooLarge, block_size_for, compute_delta, delta_command
+from redep.localcopy import copy_files
+from redep.manifest import (
+    MANIFEST_NAME,
+    empty_manifest,
+    read_local_manifest,
+    read_remote_manifest,
+    record_dirs,
+    record_file,
+    select_changes,
+    write_local_manifest,
+    write_remote_manifest,
+)
+from redep.orchestrator import Cancelled, check_cancelled, run_all, transfer_slot
+from redep.relay import is_relayable, push_relay
+from redep.resume import (
+    RESUME_ROUND_TRIPS,
+    RESUME_THRESHOLD,
+    remote_partial_sums,
+    remote_resume_threshold,
+    upload_resumable,
+)
+from redep.snapshot import (
+    CURRENT_LINK,
+    current_release_local,
+    current_release_remote,
+    link_files_local,
+    link_files_remote,
+    new_release_local,
+    new_release_remote,
+    switch_current_local,
+    switch_current_remote,
+)
 from redep.util import (
+    SFTP_ROUND_TRIPS,
+    HashingReader,
+    close_exec_channel,
     expand_home_path_local,
     expand_home_path_remote,
     identify_remote_os,
     open_connection,
+    open_exec_channel,
+    parse_size,
+    run_with_channels,
     select_leaf_directories,
     select_local_patterns,
+    upload_file,
 )
+from redep.verify import new_hasher, verify_copies, verify_remote
 
 
-def push(root_dir, matches, ignores, destinations):
+def push(root_dir, matches, ignores, destinations, full=False, fanout=0, verify=False):
+    """
+    Push the selected files and directories of root_dir to every destination.
+    Return the result of each destination, as given by run_all.
+    """
     logging.debug(f"Root directory determined as: {root_dir}")
-    selected_files, selected_dirs, ignored_files, ignored_dirs = select_local_patterns(
-        root_dir, matches, ignores
-    )
-    if len(selected_files) == 0 and len(selected_dirs) == 0:
-        logging.warning("No files or directories selected for push; aborting.")
-        return
+    # never push a manifest that may exist in the source directory
+    ignores = ignores + [Path(MANIFEST_NAME)]
+    with metrics.span("push", destinations=len(destinations)):
+        selected_files, selected_dirs, ignored_files, ignored_dirs = (
+            select_local_patterns(root_dir, matches, ignores)
+        )
+        if len(selected_files) == 0 and len(selected_dirs) == 0:
+            logging.warning("No files or directories selected for push; aborting.")
+            return []
+        with progress.show_progress():
+            results = push_selection(
+                selected_files,
+                selected_dirs,
+                root_dir,
+                destinations,
+                full,
+                fanout=fanout,
+                verify=verify,
+            )
+    logging.info("All push operations completed.")
+    return results
+
+
+def push_selection(
+    files,
+    dirs,
+    root_dir,
+    destinations,
+    full=False,
+    partial=False,
+    fanout=0,
+    verify=False,
+):
+    """
+    Push selected files and directories to all destinations at once, within
+    the concurrency limits of the orchestrator.
 
-    threads = []
+    If partial is True, the selection is only a part of what the destinations
+    hold, and their manifests keep the files that are not selected.
+    If fanout is positive, remote destinations are reached through a relay
+    tree where each of them forwards the files to up to fanout others.
+    If verify is True, transferred files are checked against hashes computed
+    on the destinations, and transferred again if they differ.
+    Return the result of each destination, as given by run_all.
+    """
+    configure_remote_limits(destinations)
+    configure_agents(destinations)
+    tasks = []
+    relayed = []
+    if fanout > 0 and not partial:
+        relayed = [d for d in destinations if is_relayable(d)]
+        destinations = [d for d in destinations if not is_relayable(d)]
     for destination in destinations:
         host = destination.get("host", None)
         path = destination.get("path", None)
@@ -36,25 +145,107 @@ def push(root_dir, matches, ignores, destinations):
             if path == "":
                 # interpret as . (which will be treated as relative path with respect to root_dir)
                 path = "."
-            new_thread = Thread(
-                target=push_local,
-                args=(selected_files, selected_dirs, root_dir, Path(path)),
+            function = partial_function(
+                push_local,
+                files,
+                dirs,
+                root_dir,
+                Path(path),
+                full,
+                snapshots=destination.get("snapshots", False),
+                partial=partial,
+                verify=verify,
             )
-            new_thread.start()
-            threads.append(new_thread)
         else:
-            new_thread = Thread(
-                target=push_remote,
-                args=(selected_files, selected_dirs, root_dir, host, Path(path)),
-            )
-            new_thread.start()
-            threads.append(new_thread)
-    for t in threads:
-        t.join()
-    logging.info("All push operations completed.")
+            function = partial_function(
+                push_remote,
+                files,
+                dirs,
+                root_dir,
+                host,
+                Path(path),
+                **remote_options(destination, full, partial, verify),
+            )
+        tasks.append((host, f"{host}:{path}" if host else str(path), function))
+    if len(relayed) > 0:
+
+        def options(destination):
+            return remote_options(destination, full, verify=verify)
+
+        def push_direct(destination):
+            return push_remote(
+                files,
+                dirs,
+                root_dir,
+                destination["host"],
+                Path(destination["path"]),
+                **options(destination),
+            )
+
+        return push_relay(
+            files, dirs, root_dir, relayed, fanout, push_direct, options, tasks
+        )
+    return run_all(tasks)
+
+
+def remote_options(destination, full=False, partial=False, verify=False):
+    """Return the keyword arguments of push_remote for a remote destination."""
+    return {
+        "full": full,
+        "delta_threshold": parse_size(destination.get("delta_threshold", None)),
+        "transport": destination.get("transport", "sftp"),
+        "compression": destination.get("compression", None),
+        "compression_level": destination.get("compression_level", None),
+        "parallel_channels": destination.get("parallel_channels", 1),
+        "resume_threshold": remote_resume_threshold(destination),
+        "snapshots": destination.get("snapshots", False),
+        "partial": partial,
+        "verify": verify,
+    }
 
 
-def push_remote(files, dirs, root_dir, conn, path):
+def push_remote(
+    files,
+    dirs,
+    root_dir,
+    conn,
+    path,
+    full=False,
+    delta_threshold=None,
+    transport="sftp",
+    compression=None,
+    compression_level=None,
+    parallel_channels=1,
+    resume_threshold=RESUME_THRESHOLD,
+    snapshots=False,
+    partial=False,
+    verify=False,
+):
+    """
+    Push files and directories to a remote destination.
+
+    Unless full is True, only files that changed since the last push to the
+    same destination (according to its manifest) are transferred.
+    With the "sftp" transport, files are uploaded one by one, and those of at
+    least delta_threshold bytes that already exist on the destination are
+    updated with a delta transfer, if possible; other files of at least
+    resume_threshold bytes are uploaded through partial files, resuming
+    interrupted uploads; uploads are spread across parallel_channels SFTP
+    sessions.
+    With the "tar" transport, all files are streamed as a single tar archive.
+    With the "agent" transport, files are streamed back to back to a helper
+    running on the remote host (see redep.agent), which also creates the
+    directories.
+    If compression is "gzip" or "zstd", data is compressed in flight, except
+    for files that are already compressed.
+    If snapshots is True, files are pushed to a new release directory, where
+    unchanged files are hard-linked from the current release, and current is
+    then switched to it (POSIX hosts only).
+    If partial is True, the manifest keeps the files that are not selected.
+    If verify is True, files are hashed while they are sent, and those whose
+    hash on the remote host differs are uploaded again.
+    Return True if all files were transferred.
+    """
     if type(conn) is str:
         # allow passing host instead of connection object
         host = conn
@@ -64,41 +255,573 @@ def push_remote(files, dirs, root_dir, conn, path):
     path = expand_home_path_remote(conn, path, remote_os)
     logging.info(f"Pushing to remote destination: {conn.original_host}:{path}")
 
-    # reduce the directories to include only leaves
-    dirs = select_leaf_directories(dirs)
-    # create dirs
-    for dir_path in dirs:
-        relative_path = dir_path.relative_to(root_dir)
-        if remote_os == "windows":
-            remote_dir = PureWindowsPath(path / str(relative_path).replace("/", "\\"))
-        else:
-            remote_dir = PurePosixPath(path / str(relative_path).replace("\\", "/"))
-        logging.debug(f"Creating remote directory: {remote_dir}")
-        if remote_os == "windows":
-            conn.run(
-                f"PowerShell -Command mkdir -p '{remote_dir}' -Force",
-                hide=True,
-                warn=True,
+    if snapshots and remote_os == "windows":
+        logging.warning(
+            f"Snapshots are not supported on Windows hosts; pushing to {conn.original_host}:{path} in place."
+        )
+        snapshots = False
+    target = path
+    reference = path
+    if snapshots:
+        reference = current_release_remote(conn, path)
+        target = new_release_remote(conn, path)
+    if full or reference is None:
+        manifest = empty_manifest()
+    else:
+        _, str_reference_manifest = remote_path_strings(
+            reference, Path(MANIFEST_NAME), remote_os
+        )
+        with metrics.span("read_manifest", destination=conn.original_host):
+            manifest = read_remote_manifest(conn, str_reference_manifest)
+    _, str_manifest_path = remote_path_strings(target, Path(MANIFEST_NAME), remote_os)
+    all_dirs = dirs
+    files, dirs, manifest = select_changes(files, dirs, root_dir, manifest, partial)
+    if len(files) == 0 and len(dirs) == 0:
+        logging.info(
+            f"Remote destination {conn.original_host}:{path} is up to date; nothing pushed."
+        )
+        return True
+    logging.info(f"Pushing {len(files)} new or changed files.")
+
+    if transport not in ("sftp", "tar", "agent"):
+        logging.warning(f"Unknown transport '{transport}'; using sftp.")
+        transport = "sftp"
+    agent = get_agent(conn)
+    if transport == "agent" and agent is None:
+        transport = "sftp"
+    compression = normalize_codec(compression)
+    if compression is not None:
+        compression_level = resolve_level(compression, compression_level)
+    completed = False
+    hashes = {} if verify else None
+    try:
+        if snapshots:
+            # the new release starts empty
+            dirs = release_directories(all_dirs, manifest, root_dir, partial)
+            manifest["dirs"] = []
+            make_remote_directories(
+                conn,
+                [
+                    remote_path_strings(target, d.relative_to(root_dir), remote_os)[0]
+                    for d in sorted(select_leaf_directories(dirs))
+                ],
+                remote_os,
+            )
+            if reference is not None:
+                unchanged = list(manifest["files"])
+                logging.info(
+                    f"Linking {len(unchanged)} unchanged files from {conn.original_host}:{reference}."
+                )
+                failed = link_files_remote(conn, reference, target, unchanged)
+                files.update(unlinked_files(manifest, root_dir, failed))
+        progress.begin(
+            conn.original_host,
+            len(files),
+            sum(signature[0] for signature in files.values()),
+        )
+        with metrics.span(
+            "transfer", destination=conn.original_host, transport=transport
+        ):
+            if transport == "tar":
+                completed = push_tar(
+                    conn,
+                    files,
+                    dirs,
+                    root_dir,
+                    target,
+                    remote_os,
+                    manifest,
+                    compression,
+                    compression_level,
+                    hashes,
+                )
+            elif transport == "agent":
+                completed = push_agent(
+                    conn,
+                    agent,
+                    files,
+                    dirs,
+                    root_dir,
+                    target,
+                    remote_os,
+                    manifest,
+                    hashes,
+                    dirs_created=snapshots,
+                )
+            else:
+                completed = push_sftp(
+                    conn,
+                    files,
+                    dirs,
+                    root_dir,
+                    target,
+                    remote_os,
+                    manifest,
+                    delta_threshold,
+                    compression,
+                    compression_level,
+                    parallel_channels,
+                    resume_threshold,
+                    hashes,
+                    dirs_created=snapshots,
+                )
+        if verify:
+            verified = verify_push(
+                conn, files, hashes, root_dir, target, remote_os, manifest
             )
+            completed = completed and verified
+    finally:
+        # record what was transferred, even if the push was interrupted
+        try:
+            with metrics.span("write_manifest", destination=conn.original_host):
+                write_remote_manifest(conn, str_manifest_path, manifest)
+        except OSError as e:
+            logging.warning(
+                f"Could not write push manifest to {conn.original_host}:{target}: {e}"
+            )
+    if snapshots:
+        if completed:
+            switch_current_remote(conn, path, target)
         else:
-            conn.run(f"mkdir -p '{remote_dir}'", hide=True, warn=True)
-    # push files
-    for file_path in files:
+            logging.error(
+                f"Release {conn.original_host}:{target} is incomplete; {CURRENT_LINK} was not switched."
+            )
+    logging.info(f"Completed push to remote destination: {conn.original_host}:{target}")
+    return completed
+
+
+def push_sftp(
+    conn,
+    files,
+    dirs,
+    root_dir,
+    path,
+    remote_os,
+    manifest,
+    delta_threshold=None,
+    compression=None,
+    compression_level=None,
+    parallel_channels=1,
+    resume_threshold=RESUME_THRESHOLD,
+    hashes=None,
+    dirs_created=False,
+):
+    """
+    Create directories with remote commands (unless dirs_created is True, as
+    they already exist) and upload files with SFTP, recording them in the
+    manifest as they are transferred.
+    Files are uploaded one by one, or spread across parallel_channels SFTP
+    sessions; those that fail are not recorded, so they are pushed again, and
+    those of at least resume_threshold bytes continue from where they stopped.
+    If hashes is a dictionary, the SHA-256 of each file uploaded is added to
+    it, computed while reading the file.
+    Return True if all files were uploaded.
+    """
+    if not dirs_created:
+        # reduce the directories to include only leaves
+        leaf_dirs = select_leaf_directories(dirs)
+        # create dirs
+        remote_dirs = [
+            remote_path_strings(path, dir_path.relative_to(root_dir), remote_os)[0]
+            for dir_path in sorted(leaf_dirs)
+        ]
+        make_remote_directories(conn, remote_dirs, remote_os)
+    record_dirs(manifest, root_dir, dirs)
+    # delta transfers need python3 on the remote host
+    delta_available = False
+    if delta_threshold is not None and remote_os != "windows":
+        if any(signature[0] >= delta_threshold for signature in files.values()):
+            delta_available = conn.run("python3 -c pass", hide=True, warn=True).ok
+            if not delta_available:
+                logging.warning(
+                    f"python3 not found on {conn.original_host}; delta transfers disabled."
+                )
+    # compressed uploads need a decompressor on the remote host
+    if compression is not None and remote_os == "windows":
+        logging.warning(
+            f"Compression with the sftp transport is not supported on Windows hosts; sending data uncompressed to {conn.original_host}."
+        )
+        compression = None
+    # the partial files of resumed uploads are hashed on the remote host
+    partial_sums = None
+    if remote_os != "windows":
+        partial_sums = partial_function(remote_partial_sums, conn)
+    # formatting a message per file is costly, even if it is not logged
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+
+    def start_hash():
+        # each attempt hashes the file from the start
+        return new_hasher() if hashes is not None else None
+
+    def push_file(sftp, file_path):
+        nonlocal compression
+        signature = files[file_path]
         relative_path = file_path.relative_to(root_dir)
-        if remote_os == "windows":
-            remote_path = PureWindowsPath(path / str(relative_path).replace("/", "\\"))
-            str_remote_path = "/" + str(remote_path)
+        remote_path, str_remote_path = remote_path_strings(
+            path, relative_path, remote_os
+        )
+        pushed = False
+        file_progress = progress.FileProgress(conn.original_host)
+        if delta_available and signature[0] >= delta_threshold:
+            if debug:
+                logging.debug(
+                    f"Uploading delta of {str(file_path)} to {conn.original_host}:{remote_path}"
+                )
+            hasher = start_hash()
+            pushed = push_file_delta(
+                conn, file_path, str_remote_path, hasher, file_progress
+            )
+        if (
+            not pushed
+            and resume_threshold is not None
+            and signature[0] >= resume_threshold
+        ):
+            if debug:
+                logging.debug(
+                    f"Uploading {str(file_path)} to {conn.original_host}:{remote_path} through a partial file"
+                )
+            hasher = start_hash()
+            file_progress.restart()
+            chunks = upload_resumable(
+                sftp,
+                file_path,
+                str_remote_path,
+                signature,
+                file_progress.callback(transfer_callback(conn.original_host)),
+                hasher,
+                partial_sums,
+            )
+            metrics.count(
+                conn.original_host,
+                "round_trips",
+                SFTP_ROUND_TRIPS + RESUME_ROUND_TRIPS + chunks,
+            )
+            pushed = True
+        if not pushed and compression is not None and is_compressible(file_path):
+            if debug:
+                logging.debug(
+                    f"Uploading compressed {str(file_path)} to {conn.original_host}:{remote_path}"
+                )
+            hasher = start_hash()
+            file_progress.restart()
+            pushed = push_file_compressed(
+                conn,
+                file_path,
+                str_remote_path,
+                compression,
+                compression_level,
+                hasher,
+                file_progress,
+            )
+            if not pushed:
+                logging.warning(
+                    f"Compressed upload to {conn.original_host} failed; sending data uncompressed."
+                )
+                compression = None
+        if not pushed:
+            if debug:
+                logging.debug(
+                    f"Uploading {str(file_path)} to {conn.original_host}:{remote_path}"
+                )
+            hasher = start_hash()
+            file_progress.restart()
+            upload_file(
+                sftp,
+                file_path,
+                str_remote_path,
+                file_progress.callback(transfer_callback(conn.original_host)),
+                hasher,
+            )
+            metrics.count(conn.original_host, "round_trips", SFTP_ROUND_TRIPS)
+        if hashes is not None:
+            hashes[file_path] = hasher.hexdigest()
+        record_file(manifest, root_dir, file_path, signature)
+        metrics.count(conn.original_host, "files")
+        metrics.count(conn.original_host, "bytes", signature[0])
+        file_progress.complete(signature[0])
+
+    # push files
+    failed = run_with_channels(conn, files, push_file, parallel_channels)
+    if len(failed) > 0:
+        logging.error(
+            f"{len(failed)} files could not be pushed to {conn.original_host}:{path}."
+        )
+    return len(failed) == 0
+
+
+def push_agent(
+    conn,
+    agent,
+    files,
+    dirs,
+    root_dir,
+    path,
+    remote_os,
+    manifest,
+    hashes=None,
+    dirs_created=False,
+):
+    """
+    Create directories (unless dirs_created is True, as they already exist)
+    and send files through the helper of the agent transport, recording
+    files in the manifest as the helper writes them.
+    If hashes is a dictionary, the SHA-256 of each file sent is added to it.
+    Return True if all files were written.
+    """
+    if not dirs_created:
+        leaf_dirs = select_leaf_directories(dirs)
+        make_remote_directories(
+            conn,
+            [
+                remote_path_strings(path, dir_path.relative_to(root_dir), remote_os)[0]
+                for dir_path in sorted(leaf_dirs)
+            ],
+            remote_os,
+        )
+    record_dirs(manifest, root_dir, dirs)
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    items = (
+        (
+            file_path,
+            remote_path_strings(path, file_path.relative_to(root_dir), remote_os)[1],
+            new_hasher() if hashes is not None else None,
+        )
+        for file_path in files
+    )
+    failed = 0
+    with transfer_slot(conn.original_host):
+        try:
+            for (file_path, str_remote_path, hasher), error in agent.put_files(
+                items, conn.original_host
+            ):
+                if error is not None:
+                    logging.error(
+                        f"Transfer of {str(file_path)} to {conn.original_host} failed: {error}"
+                    )
+                    failed += 1
+                    continue
+                if debug:
+                    logging.debug(
+                        f"Sent {str(file_path)} to {conn.original_host}:{str_remote_path}"
+                    )
+                if hashes is not None:
+                    hashes[file_path] = hasher.hexdigest()
+                signature = files[file_path]
+                record_file(manifest, root_dir, file_path, signature)
+                metrics.count(conn.original_host, "files")
+                metrics.count(conn.original_host, "bytes", signature[0])
+                # the bytes were counted as they were sent
+                progress.advance(conn.original_host, 0)
+        except AgentError as e:
+            logging.error(f"Transfer to {conn.original_host}:{path} failed: {e}")
+            return False
+    check_cancelled()
+    if failed > 0:
+        logging.error(
+            f"{failed} files could not be pushed to {conn.original_host}:{path}."
+        )
+    return failed == 0
+
+
+def push_tar(
+    conn,
+    files,
+    dirs,
+    root_dir,
+    path,
+    remote_os,
+    manifest,
+    compression=None,
+    compression_level=None,
+    hashes=None,
+):
+    """
+    Stream files and directories as tar archives into tar processes on the
+    remote host, which create directories as needed.
+    With compression, files that are already compressed are sent in a
+    separate, uncompressed archive.
+    Files are recorded in the manifest if the remote process reports success.
+    If hashes is a dictionary, the SHA-256 of each file is added to it.
+    Return True if all archives were extracted.
+    """
+    if compression is None:
+        groups = [(files, dirs, None)]
+    else:
+        compressible = {f: s for f, s in files.items() if is_compressible(f)}
+        incompressible = {f: s for f, s in files.items() if f not in compressible}
+        groups = [(compressible, dirs, compression), (incompressible, set(), None)]
+    completed = True
+    for group_files, group_dirs, codec in groups:
+        if len(group_files) == 0 and len(group_dirs) == 0:
+            continue
+        with transfer_slot(conn.original_host):
+            extracted = push_tar_stream(
+                conn,
+                group_files,
+                group_dirs,
+                root_dir,
+                path,
+                remote_os,
+                codec,
+                compression_level,
+                hashes,
+            )
+        if extracted:
+            record_dirs(manifest, root_dir, group_dirs)
+            for file_path, signature in group_files.items():
+                record_file(manifest, root_dir, file_path, signature)
+            metrics.count(conn.original_host, "files", len(group_files))
+            metrics.count(
+                conn.original_host,
+                "bytes",
+                sum(signature[0] for signature in group_files.values()),
+            )
         else:
-            remote_path = PurePosixPath(path / str(relative_path).replace("\\", "/"))
-            str_remote_path = str(remote_path)
-        logging.debug(
-            f"Uploading {str(file_path)} to {conn.original_host}:{remote_path}"
+            completed = False
+    return completed
+
+
+def push_tar_stream(
+    conn,
+    files,
+    dirs,
+    root_dir,
+    path,
+    remote_os,
+    compression,
+    compression_level,
+    hashes=None,
+):
+    """
+    Stream files and directories as a single tar archive into a tar process
+    on the remote host. Return True if the remote process reports success.
+    If hashes is a dictionary, the SHA-256 of each file is added to it.
+    """
+    if remote_os == "windows":
+        # the tar of Windows detects compressed archives by itself
+        command = f'(if not exist "{path}" mkdir "{path}") && tar -x -f - -C "{path}"'
+    else:
+        quoted_path = shlex.quote(str(path))
+        command = f"tar -x -f - --no-same-owner -C {quoted_path}"
+        if compression is not None:
+            command = f"{remote_decompress_command(compression)} | {command}"
+        command = f"mkdir -p {quoted_path} && {command}"
+    channel = open_exec_channel(conn, command)
+    stdin = channel.makefile_stdin("wb")
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    try:
+        output = throttled_writer(stdin, conn.original_host)
+        if compression is not None:
+            output = CompressedWriter(output, compression, compression_level)
+        with tarfile.open(fileobj=output, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+            for dir_path in sorted(dirs):
+                if dir_path != root_dir:
+                    arcname = dir_path.relative_to(root_dir).as_posix()
+                    tar.add(dir_path, arcname=arcname, recursive=False)
+            for file_path, signature in files.items():
+                check_cancelled()
+                arcname = file_path.relative_to(root_dir).as_posix()
+                if debug:
+                    logging.debug(
+                        f"Streaming {str(file_path)} to {conn.original_host}:{path}"
+                    )
+                file_progress = progress.FileProgress(conn.original_host)
+                if hashes is None and not progress.active:
+                    tar.add(file_path, arcname=arcname, recursive=False)
+                else:
+                    hasher = new_hasher() if hashes is not None else None
+                    with open(file_path, "rb") as source:
+                        reader = file_progress.reader(source)
+                        if hasher is not None:
+                            reader = HashingReader(reader, hasher)
+                        tar.addfile(tar.gettarinfo(file_path, arcname), reader)
+                    if hasher is not None:
+                        hashes[file_path] = hasher.hexdigest()
+                file_progress.complete(signature[0])
+        if compression is not None:
+            output.close()
+        stdin.flush()
+    except OSError as e:
+        # the remote process may have exited early, its error is reported below
+        logging.debug(f"Tar stream to {conn.original_host} interrupted: {e}")
+    except Cancelled:
+        channel.close()
+        raise
+    status, stderr = close_exec_channel(channel)
+    if status != 0:
+        logging.error(
+            f"Tar extraction on {conn.original_host}:{path} failed: {stderr.strip()}"
+        )
+    return status == 0
+
+
+def verify_push(conn, files, hashes, root_dir, path, remote_os, manifest):
+    """
+    Compare the hashes of the files pushed to a remote destination with those
+    computed on the remote host, and upload the files that differ again.
+    Files that still differ are removed from the manifest.
+    Return True if all files match.
+    """
+    # files that failed are not in the manifest, and are pushed again anyway
+    hashes = {
+        file_path: digest
+        for file_path, digest in hashes.items()
+        if file_path.relative_to(root_dir).as_posix() in manifest["files"]
+    }
+    str_paths = {
+        file_path: remote_path_strings(
+            path, file_path.relative_to(root_dir), remote_os
+        )[1]
+        for file_path in hashes
+    }
+    differing = verify_remote(conn, hashes, str_paths, remote_os)
+    if len(differing) > 0:
+        logging.warning(
+            f"{len(differing)} files differ on {conn.original_host}:{path} after transfer; pushing them again."
         )
-        conn.put(file_path, str_remote_path)
-    logging.info(f"Completed push to remote destination: {conn.original_host}:{path}")
+        hashes = {}
+        push_sftp(
+            conn,
+            {file_path: files[file_path] for file_path in differing},
+            set(),
+            root_dir,
+            path,
+            remote_os,
+            manifest,
+            resume_threshold=None,
+            hashes=hashes,
+        )
+        differing = verify_remote(conn, hashes, str_paths, remote_os)
+        for file_path in differing:
+            logging.error(
+                f"{conn.original_host}:{str_paths[file_path]} still differs from {str(file_path)}."
+            )
+            manifest["files"].pop(file_path.relative_to(root_dir).as_posix(), None)
+    return len(differing) == 0
+
 
+def push_local(
+    files,
+    dirs,
+    root_dir,
+    path,
+    full=False,
+    snapshots=False,
+    partial=False,
+    verify=False,
+):
+    """
+    Push files and directories to a local destination.
 
-def push_local(files, dirs, root_dir, path):
+    Unless full is True, only files that changed since the last push to the
+    same destination (according to its manifest) are copied.
+    If snapshots is True, files are pushed to a new release directory, where
+    unchanged files are hard-linked from the current release, and current is
+    then switched to it.
+    If partial is True, the manifest keeps the files that are not selected.
+    If verify is True, copies are checked against the files, and made again
+    if they differ.
+    """
     # expand ~ if needed
     path = expand_home_path_local(path)
     # if path is relative, make it absolute with respect to root_dir
@@ -112,18 +835,263 @@ def push_local(files, dirs, root_dir, path):
         return
     logging.info(f"Pushing to local system at: {path}")
 
-    # reduce the directories to include only leaves
-    dirs = select_leaf_directories(dirs)
-    # create dirs
-    for dir_path in dirs:
-        relative_path = dir_path.relative_to(root_dir)
-        destination_dir = path / relative_path
-        logging.debug(f"Creating local directory: {destination_dir}")
-        destination_dir.mkdir(parents=True, exist_ok=True)
-    # push files
-    for file_path in files:
-        relative_path = file_path.relative_to(root_dir)
-        destination_path = path / relative_path
-        logging.debug(f"Copying {str(file_path)} to {destination_path}")
-        shutil.copyfile(file_path, destination_path)
-    logging.info(f"Completed push to local system at: {path}")
+    target = path
+    reference = path
+    if snapshots:
+        reference = current_release_local(path)
+        target = new_release_local(path)
+    if full or reference is None:
+        manifest = empty_manifest()
+    else:
+        with metrics.span("read_manifest", destination=str(path)):
+            manifest = read_local_manifest(reference)
+    all_dirs = dirs
+    files, dirs, manifest = select_changes(files, dirs, root_dir, manifest, partial)
+    if len(files) == 0 and len(dirs) == 0:
+        logging.info(f"Local destination {path} is up to date; nothing pushed.")
+        return
+    logging.info(f"Pushing {len(files)} new or changed files.")
+
+    try:
+        if snapshots:
+            # the new release starts empty
+            dirs = release_directories(all_dirs, manifest, root_dir, partial)
+            manifest["dirs"] = []
+        # reduce the directories to include only leaves
+        leaf_dirs = select_leaf_directories(dirs)
+        # create dirs
+        with metrics.span("mkdir", destination=str(path), dirs=len(leaf_dirs)):
+            for dir_path in leaf_dirs:
+                relative_path = dir_path.relative_to(root_dir)
+                destination_dir = target / relative_path
+                logging.debug(f"Creating local directory: {destination_dir}")
+                destination_dir.mkdir(parents=True, exist_ok=True)
+        record_dirs(manifest, root_dir, dirs)
+        if snapshots and reference is not None:
+            unchanged = list(manifest["files"])
+            logging.info(f"Linking {len(unchanged)} unchanged files from {reference}.")
+            failed = link_files_local(reference, target, unchanged)
+            files.update(unlinked_files(manifest, root_dir, failed))
+        # push files
+        pairs = [
+            (file_path, target / file_path.relative_to(root_dir)) for file_path in files
+        ]
+        progress.begin(
+            str(path), len(files), sum(signature[0] for signature in files.values())
+        )
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        with metrics.span("transfer", destination=str(path), transport="copy"):
+            for file_path, destination_path in copy_files(pairs):
+                if debug:
+                    logging.debug(f"Copied {str(file_path)} to {destination_path}")
+                size = files[file_path][0]
+                record_file(manifest, root_dir, file_path, files[file_path])
+                metrics.count(str(path), "files")
+                metrics.count(str(path), "bytes", size)
+                progress.advance(str(path), size)
+                check_cancelled()
+        if verify:
+            for file_path in verify_copies(pairs, str(path)):
+                del manifest["files"][file_path.relative_to(root_dir).as_posix()]
+    finally:
+        # record what was transferred, even if the push was interrupted
+        if target.is_dir():
+            with metrics.span("write_manifest", destination=str(path)):
+                write_local_manifest(target, manifest)
+    if snapshots:
+        switch_current_local(path, target)
+    logging.info(f"Completed push to local system at: {target}")
+
+
+def release_directories(dirs, manifest, root_dir, partial=False):
+    """
+    Return the directories to create in a new release: the selected ones, and
+    those holding the files of the manifest, which are linked from the
+    current release. If partial is True, the selection only holds what
+    changed, and all the directories of the manifest are kept as well.
+    """
+    release_dirs = set(dirs)
+    if partial:
+        release_dirs.update(root_dir / key for key in manifest["dirs"])
+    for key in manifest["files"]:
+        for parent in PurePosixPath(key).parents:
+            release_dirs.add(root_dir / parent)
+    return release_dirs
+
+
+def unlinked_files(manifest, root_dir, keys):
+    """
+    Remove from the manifest the files that could not be hard-linked into a
+    new release, and return them with their signature, to be transferred.
+    """
+    if len(keys) > 0:
+        logging.warning(f"Could not link {len(keys)} files; transferring them.")
+    return {root_dir / key: manifest["files"].pop(key) for key in keys}
+
+
+def push_file_compressed(
+    conn,
+    file_path,
+    str_remote_path,
+    compression,
+    level,
+    hasher=None,
+    file_progress=None,
+):
+    """
+    Upload a file through a decompressor running on a POSIX remote host,
+    feeding hasher, if given, with the file, and counting its bytes with
+    file_progress, if given.
+    Return False if the upload could not be completed.
+    """
+    mode = file_path.stat().st_mode & 0o7777
+    quoted_path = shlex.quote(str_remote_path)
+    # decompress next to the target, so that a failed upload leaves it untouched
+    quoted_temp = shlex.quote(str_remote_path + COMPRESSED_SUFFIX)
+    channel = open_exec_channel(
+        conn,
+        f"{{ {remote_decompress_command(compression)} > {quoted_temp} && "
+        f"chmod {mode:o} {quoted_temp} && mv -f {quoted_temp} {quoted_path}; }} || "
+        f"{{ rm -f {quoted_temp}; exit 1; }}",
+    )
+    stdin = channel.makefile_stdin("wb")
+    try:
+        writer = CompressedWriter(
+            throttled_writer(stdin, conn.original_host), compression, level
+        )
+        with open(file_path, "rb") as source:
+            if file_progress is not None:
+                source = file_progress.reader(source)
+            if hasher is not None:
+                source = HashingReader(source, hasher)
+            shutil.copyfileobj(source, writer, CHUNK_SIZE)
+        writer.close()
+    except OSError as e:
+        logging.debug(f"Compressed upload of {str(file_path)} interrupted: {e}")
+    status, stderr = close_exec_channel(channel)
+    if status != 0:
+        logging.debug(f"Compressed upload of {str(file_path)} failed: {stderr.strip()}")
+    return status == 0
+
+
+def push_file_delta(conn, file_path, str_remote_path, hasher=None, file_progress=None):
+    """
+    Update an existing remote file by sending only the blocks that differ from
+    the local file, feeding hasher, if given, with the file, and counting its
+    bytes with file_progress, if given, as they are compared. Both the
+    signature and the delta are transferred within the bandwidth limits.
+    Return False if the delta transfer could not be completed, in which case
+    the remote file is left unchanged.
+    """
+    size = file_path.stat().st_size
+    channel = open_exec_channel(
+        conn, delta_command("signature", str_remote_path, block_size_for(size))
+    )
+    channel.shutdown_write()
+    reader = throttled_reader(channel.makefile("rb"), conn.original_host)
+    # in chunks, so that the limits pace the download
+    encoded = b"".join(iter(partial_function(reader.read, CHUNK_SIZE), b""))
+    status, _ = close_exec_channel(channel)
+    if status != 0:
+        # the remote file does not exist yet
+        return False
+    signature = base64.b64decode(encoded)
+    mode = file_path.stat().st_mode & 0o7777
+    channel = open_exec_channel(
+        conn, delta_command("patch", str_remote_path, f"{mode:o}")
+    )
+    stdin = channel.makefile_stdin("wb")
+    try:
+        with open(file_path, "rb") as source:
+            if file_progress is not None:
+                source = file_progress.reader(source)
+            if hasher is not None:
+                source = HashingReader(source, hasher)
+            # above this size, sending the whole file is not worth the effort
+            compute_delta(
+                signature,
+                source,
+                throttled_writer(stdin, conn.original_host),
+                max_literal=size // 2,
+            )
+        stdin.flush()
+    except DeltaTooLarge:
+        logging.debug(f"Delta of {str(file_path)} is too large; sending whole file.")
+        # the truncated delta is rejected by the remote host
+    status, stderr = close_exec_channel(channel)
+    if status != 0:
+        logging.debug(f"Delta transfer of {str(file_path)} failed: {stderr.strip()}")
+    return status == 0
+
+
+def make_remote_directories(conn, remote_dirs, remote_os):
+    """
+    Create remote directories (and their parents) with as few commands as
+    possible, each kept below the command line length limit of the remote OS,
+    or with a single request to the helper of the agent transport.
+    """
+    agent = get_agent(conn)
+    if agent is not None:
+        with metrics.span(
+            "mkdir", destination=conn.original_host, dirs=len(remote_dirs)
+        ):
+            try:
+                errors = agent.make_directories([str(d) for d in remote_dirs])
+            except AgentError as e:
+                errors = [str(e)]
+        if len(errors) > 0:
+            logging.warning(
+                f"Could not create some directories on {conn.original_host}: {'; '.join(errors)}"
+            )
+        return
+    if remote_os == "windows":
+        # cmd.exe, the default shell of the OpenSSH server, limits commands to 8191 characters
+        prefix = (
+            'PowerShell -NoProfile -Command "New-Item -ItemType Directory -Force -Path '
+        )
+        suffix = ' | Out-Null"'
+        separator = ","
+        limit = 8000
+        arguments = ["'" + str(d).replace("'", "''") + "'" for d in remote_dirs]
+    else:
+        prefix = "mkdir -p -- "
+        suffix = ""
+        separator = " "
+        limit = 100000
+        arguments = [shlex.quote(str(d)) for d in remote_dirs]
+    commands = []
+    batch = []
+    length = len(prefix) + len(suffix)
+    for argument in arguments:
+        if batch and length + len(separator) + len(argument) > limit:
+            commands.append(prefix + separator.join(batch) + suffix)
+            batch = []
+            length = len(prefix) + len(suffix)
+        batch.append(argument)
+        length += len(separator) + len(argument)
+    if batch:
+        commands.append(prefix + separator.join(batch) + suffix)
+    with metrics.span("mkdir", destination=conn.original_host, dirs=len(remote_dirs)):
+        for command in commands:
+            logging.debug(f"Creating remote directories with: {command}")
+            result = conn.run(command, hide=True, warn=True)
+            if not result.ok:
+                logging.warning(
+                    f"Could not create some directories on {conn.original_host}: {result.stderr.strip()}"
+                )
+
+
+def remote_path_strings(path, relative_path, remote_os):
+    """
+    Join a remote destination path and a relative path.
+
+    Return the joined path in the flavour of the remote OS, and its string form
+    as accepted by SFTP.
+    """
+    if remote_os == "windows":
+        remote_path = PureWindowsPath(path / str(relative_path).replace("/", "\\"))
+        str_remote_path = "/" + str(remote_path)
+    else:
+        remote_path = PurePosixPath(path / str(relative_path).replace("\\", "/"))
+        str_remote_path = str(remote_path)
+    return remote_path, str_remote_path
@@ -0,0 +1,264 @@
+"""
+Relay pushes, where remote destinations forward data to each other in a tree.
+
+The local machine pushes to a few seed destinations, and each destination
+then forwards the files to up to fanout others, by piping tar into ssh on the
+destination itself, so that the local uplink carries the data only fanout
+times. Destinations reach each other with their own keys, unless they have
+the relay_forward_agent option, which forwards the local SSH agent to them
+while they relay. Control traffic (manifests) still goes from the local
+machine to each destination. A destination that cannot be reached through the
+tree is pushed to directly.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import logging
+import shlex
+from functools import partial
+from pathlib import Path
+
+from redep.compression import (
+    normalize_codec,
+    remote_compress_command,
+    remote_decompress_command,
+    resolve_level,
+)
+from redep.manifest import (
+    MANIFEST_NAME,
+    empty_manifest,
+    read_remote_manifest,
+    record_dirs,
+    record_file,
+    select_changes,
+    write_remote_manifest,
+)
+from redep.orchestrator import Cancelled, check_cancelled, run_all, transfer_slot
+from redep.util import (
+    close_exec_channel,
+    expand_home_path_remote,
+    identify_remote_os,
+    open_connection,
+    open_exec_channel,
+)
+from redep.verify import hash_file, verify_remote
+
+
+def relay_children(count, fanout):
+    """
+    Arrange count destinations in a tree where each node has fanout children.
+    Return the list of children indices of the local machine (the seeds) and
+    of each destination.
+    """
+    seeds = list(range(min(fanout, count)))
+    children = [
+        [c for c in range(fanout * (i + 1), fanout * (i + 2)) if c < count]
+        for i in range(count)
+    ]
+    return seeds, children
+
+
+def is_relayable(destination):
+    """
+    Tell whether a destination can take part in a relay tree. Destinations
+    with snapshots, or with a bandwidth limit (which cannot be applied to
+    transfers between remotes), are pushed to directly.
+    """
+    return (
+        destination.get("host", "") != ""
+        and destination.get("path", None) is not None
+        and not destination.get("snapshots", False)
+        and destination.get("bwlimit", None) is None
+    )
+
+
+def push_relay(
+    files, dirs, root_dir, destinations, fanout, push_direct, options, tasks=()
+):
+    """
+    Push to remote destinations through a relay tree with the given fanout.
+    push_direct(destination) pushes to a destination from the local machine,
+    and returns True on success; options(destination) returns its keyword
+    arguments of push_remote.
+
+    The tree is run one level at a time with run_all, the first level
+    together with the other tasks given, so that destinations share the
+    limits of the orchestrator. Return the results of all tasks, as given by
+    run_all.
+    """
+    seeds, children = relay_children(len(destinations), fanout)
+    logging.info(
+        f"Relaying push to {len(destinations)} destinations through {len(seeds)} seeds."
+    )
+    results = []
+    level = [(i, None) for i in seeds]
+    while len(level) > 0:
+        level_tasks = [
+            (
+                destinations[i]["host"],
+                f"{destinations[i]['host']}:{destinations[i]['path']}",
+                partial(
+                    push_node,
+                    files,
+                    dirs,
+                    root_dir,
+                    destinations[i],
+                    parent,
+                    push_direct,
+                    options(destinations[i]),
+                ),
+            )
+            for i, parent in level
+        ]
+        level_results = run_all(list(tasks) + level_tasks)
+        results.extend(level_results)
+        level_results = level_results[len(tasks) :]
+        tasks = ()
+        if any(isinstance(r["error"], Cancelled) for r in level_results):
+            break
+        next_level = []
+        for (i, _), result in zip(level, level_results):
+            # only complete POSIX destinations can forward data
+            source = None
+            if result["result"] and result["error"] is None:
+                conn = open_connection(destinations[i]["host"])
+                if identify_remote_os(conn) != "windows":
+                    source = destinations[i]
+            next_level.extend((child, source) for child in children[i])
+        level = next_level
+    return results
+
+
+def push_node(files, dirs, root_dir, destination, parent, push_direct, options):
+    """
+    Bring a destination up to date, through its parent if given and possible,
+    or directly otherwise. Return True if all files were transferred.
+    """
+    if parent is not None:
+        check_cancelled()
+        if forward(
+            files,
+            dirs,
+            root_dir,
+            parent,
+            destination,
+            full=options["full"],
+            compression=options["compression"],
+            compression_level=options["compression_level"],
+            verify=options["verify"],
+        ):
+            return True
+        logging.warning(
+            f"Relay from {parent['host']} to {destination['host']} failed; pushing directly."
+        )
+    return push_direct(destination)
+
+
+def ssh_command(conn, relay_host=None):
+    """Build the ssh command that reaches a connected host from another host."""
+    if relay_host is not None:
+        return f"ssh -o BatchMode=yes {shlex.quote(relay_host)}"
+    target = f"{conn.user}@{conn.host}" if conn.user else conn.host
+    return f"ssh -o BatchMode=yes -p {conn.port} {shlex.quote(target)}"
+
+
+def forward(
+    files,
+    dirs,
+    root_dir,
+    parent,
+    destination,
+    full=False,
+    compression=None,
+    compression_level=None,
+    verify=False,
+):
+    """
+    Forward the files that changed on a destination from its parent, which
+    holds the same files, with tar piped into ssh on the parent.
+    If compression is "gzip" or "zstd", the stream is compressed on the
+    parent and decompressed on the destination.
+    If verify is True, the files are then hashed on the destination, and
+    compared with the local ones; those that differ are left out of the
+    manifest, to be pushed directly.
+    The local SSH agent is forwarded to the parent only if it has the
+    relay_forward_agent option, as any process on it could then use the agent.
+    Return True on success.
+    """
+    parent_conn = open_connection(parent["host"])
+    parent_path = expand_home_path_remote(
+        parent_conn, Path(parent["path"]), identify_remote_os(parent_conn)
+    )
+    conn = open_connection(destination["host"])
+    remote_os = identify_remote_os(conn)
+    if remote_os == "windows":
+        return False
+    path = expand_home_path_remote(conn, Path(destination["path"]), remote_os)
+    str_manifest_path = str(path / MANIFEST_NAME)
+    if full:
+        manifest = empty_manifest()
+    else:
+        manifest = read_remote_manifest(conn, str_manifest_path)
+    files, new_dirs, manifest = select_changes(files, dirs, root_dir, manifest)
+    if len(files) == 0 and len(new_dirs) == 0:
+        logging.info(
+            f"Remote destination {conn.original_host}:{path} is up to date; nothing relayed."
+        )
+        return True
+    logging.info(
+        f"Relaying {len(files)} new or changed files from {parent_conn.original_host} to {conn.original_host}:{path}."
+    )
+    names = sorted(
+        d.relative_to(root_dir).as_posix() for d in new_dirs if d != root_dir
+    ) + sorted(f.relative_to(root_dir).as_posix() for f in files)
+    archive = (
+        f"tar -c -f - -C {shlex.quote(str(parent_path))} --null --no-recursion -T -"
+    )
+    extract = f"tar -x -f - --no-same-owner -C {shlex.quote(str(path))}"
+    compression = normalize_codec(compression)
+    if compression is not None:
+        compression_level = resolve_level(compression, compression_level)
+        archive += f" | {remote_compress_command(compression, compression_level)}"
+        extract = f"{remote_decompress_command(compression)} | {extract}"
+    extract = f"mkdir -p {shlex.quote(str(path))} && {extract}"
+    command = (
+        f"{archive} | "
+        f"{ssh_command(conn, destination.get('relay_host', None))} {shlex.quote(extract)}"
+    )
+    with transfer_slot(conn.original_host):
+        channel = open_exec_channel(
+            parent_conn,
+            command,
+            forward_agent=parent.get("relay_forward_agent", False),
+        )
+        channel.sendall(b"".join(name.encode() + b"\0" for name in names))
+        status, stderr = close_exec_channel(channel)
+    if status != 0:
+        logging.error(
+            f"Relay from {parent_conn.original_host} to {conn.original_host} failed: {stderr.strip()}"
+        )
+        return False
+    differing = []
+    if verify:
+        hashes = {file_path: hash_file(file_path) for file_path in files}
+        str_paths = {
+            file_path: str(path / file_path.relative_to(root_dir).as_posix())
+            for file_path in files
+        }
+        differing = verify_remote(conn, hashes, str_paths, remote_os)
+        if len(differing) > 0:
+            logging.warning(
+                f"{len(differing)} files relayed to {conn.original_host}:{path} differ; pushing them directly."
+            )
+    record_dirs(manifest, root_dir, new_dirs)
+    for file_path, signature in files.items():
+        if file_path not in differing:
+            record_file(manifest, root_dir, file_path, signature)
+    try:
+        write_remote_manifest(conn, str_manifest_path, manifest)
+    except OSError as e:
+        logging.warning(
+            f"Could not write push manifest to {conn.original_host}:{path}: {e}"
+        )
+    return len(differing) == 0
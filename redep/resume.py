@@ -0,0 +1,315 @@
+"""
+Resumable transfers of large files.
+
+A large file is written to a partial file next to its destination, and the
+hash of every chunk written is recorded in a sums file beside it, along with
+the size and modification time of the source. If the transfer is interrupted,
+the next one checks the chunks of the partial file (and of the source, for
+uploads) against the recorded sums and continues from the last verified
+chunk, as long as the source did not change. Once complete, the partial file
+is renamed into place and the sums file is removed.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shlex
+
+from redep.orchestrator import check_cancelled
+from redep.util import HashingReader, hash_stream, parse_size
+
+RESUME_THRESHOLD = 64 * 1024**2
+RESUME_CHUNK_SIZE = 8 * 1024**2
+BLOCK_SIZE = 1024 * 1024
+PARTIAL_SUFFIX = ".redep-partial"
+SUMS_SUFFIX = ".redep-sums"
+# round trips of a resumable upload or download besides those of SFTP and
+# those of each chunk: reading the sums, stat of the partial file, rename
+# and removal of the sums
+RESUME_ROUND_TRIPS = 4
+
+
+def parse_threshold(value):
+    """Parse the resume_threshold option, where false disables resuming."""
+    if value is False:
+        return None
+    return parse_size(value)
+
+
+def remote_resume_threshold(remote):
+    """
+    Return the resume threshold of a remote entry. Resumable transfers are not
+    compressed, so with compression it only applies if it is given.
+    """
+    compression = str(remote.get("compression", None)).lower()
+    default = RESUME_THRESHOLD if compression in ("", "none") else None
+    return parse_threshold(remote.get("resume_threshold", default))
+
+
+def chunk_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def sums_header(signature):
+    """Return the first line of a sums file, for a source with this signature."""
+    header = {"size": signature[0], "mtime": signature[1], "chunk": RESUME_CHUNK_SIZE}
+    return json.dumps(header, sort_keys=True) + "\n"
+
+
+def read_sums(stream):
+    """
+    Read a sums file from a binary stream, and return its header line and the
+    recorded chunk hashes. A last line that was not completely written is
+    ignored.
+    """
+    lines = stream.read().decode("utf-8", "replace").split("\n")
+    if len(lines) < 2:
+        return None, []
+    # the last element follows the final newline, or is an incomplete line
+    return lines[0] + "\n", lines[1:-1]
+
+
+def leading_matches(expected, actual):
+    """Count the leading items of two iterables that are equal, reading no further."""
+    count = 0
+    for first, second in zip(expected, actual):
+        if first != second:
+            break
+        count += 1
+    return count
+
+
+def verified_offset(header, digests, signature, partial_size, data):
+    """
+    Return the offset up to which a partial file can be kept: the end of the
+    leading chunks whose hash matches the one recorded for them.
+
+    The chunks are read from the binary stream data, which holds either the
+    partial file itself or the source it was copied from. Nothing is kept if
+    the sums were recorded for a source with another signature.
+    """
+    if header != sums_header(signature):
+        return 0
+    count = min(len(digests), partial_size // RESUME_CHUNK_SIZE)
+    hashes = (chunk_hash(data.read(RESUME_CHUNK_SIZE)) for _ in range(count))
+    return leading_matches(digests[:count], hashes) * RESUME_CHUNK_SIZE
+
+
+def partial_sums_command(str_path, count):
+    """
+    Return a POSIX shell command that prints the hash of each of the first
+    count chunks of a file, one per line.
+    """
+    quoted_path = shlex.quote(str_path)
+    return (
+        f"i=0; while [ $i -lt {count} ]; do "
+        f"dd if={quoted_path} bs={RESUME_CHUNK_SIZE} skip=$i count=1 2>/dev/null "
+        f"| sha256sum || exit 1; i=$((i + 1)); done"
+    )
+
+
+def remote_partial_sums(conn, str_path, count):
+    """
+    Return the hashes of the first count chunks of a file on a POSIX remote
+    host, computed there, or None if they could not be computed.
+    """
+    result = conn.run(partial_sums_command(str_path, count), hide=True, warn=True)
+    digests = [line.split()[0] for line in result.stdout.splitlines() if line]
+    if not result.ok or len(digests) != count:
+        return None
+    return digests
+
+
+def verified_remote_offset(sftp, str_partial_path, digests, offset, partial_sums=None):
+    """
+    Return the offset, up to offset, up to which a remote partial file holds
+    the chunks recorded in digests. Their hashes are computed on the remote
+    host with partial_sums(path, count), if given and if it succeeds, or else
+    from the partial file read through SFTP.
+    """
+    count = offset // RESUME_CHUNK_SIZE
+    hashes = partial_sums(str_partial_path, count) if partial_sums else None
+    if hashes is not None:
+        return leading_matches(digests[:count], hashes) * RESUME_CHUNK_SIZE
+    with sftp.open(str_partial_path, "rb") as data:
+        data.prefetch(offset)
+        hashes = (chunk_hash(data.read(RESUME_CHUNK_SIZE)) for _ in range(count))
+        return leading_matches(digests[:count], hashes) * RESUME_CHUNK_SIZE
+
+
+def copy_chunks(source, target, sums, offset, size, callback=None, sync=None):
+    """
+    Copy a source stream, positioned at offset, to a target stream, and
+    record the hash of each chunk written in the sums stream.
+
+    sync(), if given, is called before recording a chunk, to make sure it is
+    stored; callback(bytes transferred, total bytes) is called after each
+    block. Cancelled is raised between chunks if the run is interrupted.
+    Return the number of chunks recorded.
+    """
+    position = offset
+    chunks = 0
+    hasher = hashlib.sha256()
+    while position < size:
+        block = source.read(min(BLOCK_SIZE, size - position))
+        if not block:
+            raise OSError(f"Source ended at {position} of {size} bytes")
+        target.write(block)
+        hasher.update(block)
+        position += len(block)
+        if callback is not None:
+            callback(position - offset, size - offset)
+        if position % RESUME_CHUNK_SIZE == 0 or position == size:
+            target.flush()
+            if sync is not None:
+                sync()
+            sums.write(f"{hasher.hexdigest()}\n".encode())
+            sums.flush()
+            hasher = hashlib.sha256()
+            chunks += 1
+            check_cancelled()
+    return chunks
+
+
+def upload_resumable(
+    sftp,
+    local_path,
+    str_remote_path,
+    signature,
+    callback=None,
+    hasher=None,
+    partial_sums=None,
+):
+    """
+    Upload a large file with SFTP through a partial file, resuming a previous
+    upload of the same file if possible, and preserve its mode.
+    callback(bytes transferred, total bytes) is called after each block, and
+    hasher, if given, is fed with the whole file. The chunks kept from the
+    partial file are checked against the source and against the partial file
+    itself, whose hashes are computed with partial_sums(path, count), if
+    given, or read through SFTP.
+    Return the number of chunks uploaded.
+    """
+    str_partial_path = str_remote_path + PARTIAL_SUFFIX
+    str_sums_path = str_remote_path + SUMS_SUFFIX
+    size = signature[0]
+    header, digests = None, []
+    partial_size = 0
+    try:
+        with sftp.open(str_sums_path, "rb") as stream:
+            header, digests = read_sums(stream)
+        partial_size = sftp.stat(str_partial_path).st_size
+    except OSError:
+        pass
+    with open(local_path, "rb") as source:
+        offset = verified_offset(header, digests, signature, partial_size, source)
+        if offset > 0:
+            offset = verified_remote_offset(
+                sftp, str_partial_path, digests, offset, partial_sums
+            )
+        if hasher is not None:
+            # the kept chunks are read again, only when resuming
+            source.seek(0)
+            hash_stream(source, hasher, offset)
+        source.seek(offset)
+        if offset > 0:
+            logging.info(
+                f"Resuming upload of {local_path} at {offset} of {size} bytes."
+            )
+        with (
+            sftp.open(str_partial_path, "r+b" if offset > 0 else "wb") as target,
+            sftp.open(str_sums_path, "wb") as sums,
+        ):
+            kept = digests[: offset // RESUME_CHUNK_SIZE]
+            sums.write(
+                "".join([sums_header(signature)] + [f"{d}\n" for d in kept]).encode()
+            )
+            target.seek(offset)
+            # writes are acknowledged when the file is closed, and the server
+            # handles them before the write of their sums
+            target.set_pipelined(True)
+            if hasher is not None:
+                source = HashingReader(source, hasher)
+            chunks = copy_chunks(source, target, sums, offset, size, callback)
+    if partial_size > size:
+        sftp.truncate(str_partial_path, size)
+    sftp.chmod(str_partial_path, os.stat(local_path).st_mode & 0o7777)
+    try:
+        sftp.posix_rename(str_partial_path, str_remote_path)
+    except OSError:
+        # servers without the POSIX rename extension do not replace files
+        try:
+            sftp.remove(str_remote_path)
+        except OSError:
+            pass
+        sftp.rename(str_partial_path, str_remote_path)
+    sftp.remove(str_sums_path)
+    return chunks
+
+
+def download_resumable(
+    sftp,
+    str_remote_path,
+    local_path,
+    signature,
+    callback=None,
+    prefetch=None,
+    hasher=None,
+):
+    """
+    Download a large file with SFTP through a partial file, resuming a
+    previous download of the same file if possible, and preserve its mode.
+    callback(bytes transferred, total bytes) is called after each block, and
+    prefetch limits the reads requested ahead; hasher, if given, is fed with
+    the whole file.
+    Return the number of chunks downloaded.
+    """
+    partial_path = local_path.with_name(local_path.name + PARTIAL_SUFFIX)
+    sums_path = local_path.with_name(local_path.name + SUMS_SUFFIX)
+    size = signature[0]
+    offset = 0
+    digests = []
+    if partial_path.is_file() and sums_path.is_file():
+        with open(sums_path, "rb") as stream:
+            header, digests = read_sums(stream)
+        with open(partial_path, "rb") as data:
+            offset = verified_offset(
+                header, digests, signature, partial_path.stat().st_size, data
+            )
+    if offset > 0:
+        logging.info(
+            f"Resuming download of {str_remote_path} at {offset} of {size} bytes."
+        )
+    with (
+        sftp.open(str_remote_path, "rb") as source,
+        open(partial_path, "r+b" if offset > 0 else "wb") as target,
+        open(sums_path, "wb") as sums,
+    ):
+        kept = digests[: offset // RESUME_CHUNK_SIZE]
+        sums.write(
+            "".join([sums_header(signature)] + [f"{d}\n" for d in kept]).encode()
+        )
+        if hasher is not None and offset > 0:
+            # the kept chunks are read again, only when resuming
+            target.seek(0)
+            hash_stream(target, hasher, offset)
+        target.seek(offset)
+        target.truncate()
+        source.seek(offset)
+        source.prefetch(size, prefetch)
+
+        def sync():
+            os.fsync(target.fileno())
+            sums.flush()
+            os.fsync(sums.fileno())
+
+        reader = source if hasher is None else HashingReader(source, hasher)
+        chunks = copy_chunks(reader, target, sums, offset, size, callback, sync)
+    os.chmod(partial_path, sftp.stat(str_remote_path).st_mode & 0o7777)
+    os.replace(partial_path, local_path)
+    sums_path.unlink()
+    return chunks
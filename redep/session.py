@@ -0,0 +1,139 @@
+"""
+Cache of connections and of facts about remote hosts (operating system and
+home directory), so that each host is opened and probed once per run.
+
+Facts are also stored on disk, and reused by later runs until they are older
+than REDEP_CACHE_TTL seconds (one day by default, 0 disables the disk cache).
+They expire in memory too, so that a long-lived process such as the daemon
+probes hosts again.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from threading import Lock
+
+CACHE_NAME = "hosts.json"
+DEFAULT_TTL = 24 * 60 * 60
+
+lock = Lock()
+connections = {}
+host_locks = {}
+facts = None
+
+
+def cache_path():
+    """Return the path of the file where facts about hosts are stored."""
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA", Path.home() / "AppData" / "Local")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+    return Path(base) / "redep" / CACHE_NAME
+
+
+def cache_ttl():
+    try:
+        return float(os.environ.get("REDEP_CACHE_TTL", DEFAULT_TTL))
+    except ValueError:
+        logging.warning("Invalid REDEP_CACHE_TTL; using the default.")
+        return DEFAULT_TTL
+
+
+def load_facts():
+    """Read the facts stored on disk that are not expired; call with lock held."""
+    global facts
+    if facts is not None:
+        return facts
+    facts = {}
+    ttl = cache_ttl()
+    if ttl <= 0:
+        return facts
+    try:
+        stored = json.loads(cache_path().read_text())
+    except (OSError, ValueError):
+        return facts
+    if not isinstance(stored, dict):
+        return facts
+    now = time.time()
+    for host, host_facts in stored.items():
+        if isinstance(host_facts, dict) and now - host_facts.get("time", 0) < ttl:
+            facts[host] = host_facts
+    return facts
+
+
+def save_facts():
+    """Write the facts to disk, atomically; call with lock held."""
+    if cache_ttl() <= 0:
+        return
+    path = cache_path()
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path.write_text(json.dumps(facts, indent=2))
+        os.replace(temp_path, path)
+    except OSError as e:
+        logging.debug(f"Could not write host cache {path}: {e}")
+
+
+def fresh_facts(host):
+    """
+    Return the facts about a host, forgetting them if they are older than
+    the TTL; call with lock held.
+    """
+    host_facts = load_facts().get(host)
+    if host_facts is None:
+        return {}
+    ttl = cache_ttl()
+    if ttl > 0 and time.time() - host_facts.get("time", 0) >= ttl:
+        del facts[host]
+        return {}
+    return host_facts
+
+
+def get_fact(host, name):
+    """Return a cached fact about a host, or None."""
+    with lock:
+        return fresh_facts(host).get(name)
+
+
+def set_fact(host, name, value):
+    with lock:
+        host_facts = fresh_facts(host)
+        facts[host] = host_facts
+        host_facts[name] = value
+        # facts expire together, counting from the first one
+        host_facts.setdefault("time", time.time())
+        save_facts()
+
+
+def get_connection(host, opener):
+    """
+    Return the connection to host opened earlier in this run, if it is still
+    usable, or a new one created by calling opener(host).
+    """
+    with lock:
+        host_lock = host_locks.setdefault(host, Lock())
+    # one lock per host, so that slow hosts do not delay the others
+    with host_lock:
+        conn = connections.get(host)
+        if conn is None or not conn.is_connected:
+            conn = opener(host)
+            connections[host] = conn
+        return conn
+
+
+def close_connections():
+    """Close the connections opened in this run."""
+    with lock:
+        opened = list(connections.values())
+        connections.clear()
+    for conn in opened:
+        try:
+            conn.close()
+        except Exception as e:
+            logging.debug(f"Could not close connection to {conn.original_host}: {e}")
@@ -0,0 +1,149 @@
+"""
+Snapshot destinations, where each push creates a new release directory.
+
+A destination in snapshot mode contains a releases directory, with one
+subdirectory per push, and a current symbolic link to the last complete
+release. Files that did not change since the current release are hard-linked
+from it, so that a release only costs the size of what changed.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import logging
+import os
+import shlex
+import uuid
+from datetime import datetime, timezone
+from pathlib import PurePosixPath
+
+from redep.util import close_exec_channel, open_exec_channel
+
+RELEASES_DIR = "releases"
+CURRENT_LINK = "current"
+RENAME_SCRIPT = "import os, sys; os.replace(sys.argv[1], sys.argv[2])"
+
+
+def release_name():
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def current_release_local(path):
+    """Return the release that current points to, or None."""
+    link = path / CURRENT_LINK
+    if not link.is_dir():
+        return None
+    return link.resolve()
+
+
+def new_release_local(path):
+    """Return the path of a new, not yet existing release directory."""
+    name = release_name()
+    release = path / RELEASES_DIR / name
+    count = 1
+    while release.exists():
+        count += 1
+        release = path / RELEASES_DIR / f"{name}-{count}"
+    return release
+
+
+def link_files_local(reference, release, keys):
+    """
+    Hard-link files from the reference release into the new one.
+    Return the keys of the files that could not be linked.
+    """
+    failed = []
+    for key in keys:
+        try:
+            os.link(reference / key, release / key)
+        except OSError as e:
+            logging.debug(f"Could not link {reference / key}: {e}")
+            failed.append(key)
+    return failed
+
+
+def switch_current_local(path, release):
+    """Point current to a release, atomically replacing the previous link."""
+    temp_link = path / f".{CURRENT_LINK}.{os.getpid()}.tmp"
+    try:
+        os.symlink(release.relative_to(path), temp_link, target_is_directory=True)
+        os.replace(temp_link, path / CURRENT_LINK)
+    except OSError as e:
+        logging.error(f"Could not switch {path / CURRENT_LINK} to {release}: {e}")
+        if temp_link.is_symlink():
+            temp_link.unlink()
+        return False
+    logging.info(f"Switched {path / CURRENT_LINK} to {release.name}.")
+    return True
+
+
+def current_release_remote(conn, path):
+    """Return the release that current points to on a POSIX host, or None."""
+    link = shlex.quote(str(path / CURRENT_LINK))
+    result = conn.run(f"cd {link} 2>/dev/null && pwd -P", hide=True, warn=True)
+    if not result.ok or result.stdout.strip() == "":
+        return None
+    return PurePosixPath(result.stdout.strip())
+
+
+def new_release_remote(conn, path):
+    """Return the path of a new, not yet existing release directory on a POSIX host."""
+    name = release_name()
+    release = path / RELEASES_DIR / name
+    count = 1
+    while conn.run(f"test -e {shlex.quote(str(release))}", hide=True, warn=True).ok:
+        count += 1
+        release = path / RELEASES_DIR / f"{name}-{count}"
+    return release
+
+
+def link_files_remote(conn, reference, release, keys):
+    """
+    Hard-link files from the reference release into the new one on a POSIX
+    host, with a single command reading their names from standard input.
+    Return the keys of the files that could not be linked.
+    """
+    keys = list(keys)
+    if len(keys) == 0:
+        return []
+    script = 'for f; do ln -- "$f" "$0/$f" 2>/dev/null || printf "%s\\0" "$f"; done'
+    command = (
+        f"cd {shlex.quote(str(reference))} && "
+        f"xargs -0 sh -c {shlex.quote(script)} {shlex.quote(str(release))}"
+    )
+    channel = open_exec_channel(conn, command)
+    channel.sendall(b"".join(key.encode() + b"\0" for key in keys))
+    channel.shutdown_write()
+    output = channel.makefile("rb").read()
+    status, stderr = close_exec_channel(channel)
+    if status != 0 and output == b"":
+        logging.debug(f"Linking files on {conn.original_host} failed: {stderr.strip()}")
+        return keys
+    return [name.decode() for name in output.split(b"\0") if name]
+
+
+def switch_current_remote(conn, path, release):
+    """Point current to a release on a POSIX host, atomically replacing the previous link."""
+    # a name of its own, so that concurrent pushes do not replace each other's link
+    temp_link = f".{CURRENT_LINK}.{uuid.uuid4().hex}.tmp"
+    target = shlex.quote(str(release.relative_to(path)))
+    # rename(2) replaces the link itself, while mv would move into its target
+    # without -T (GNU) or -h (BSD)
+    rename = (
+        f"{{ python3 -c {shlex.quote(RENAME_SCRIPT)} {temp_link} {CURRENT_LINK} || "
+        f"mv -fT {temp_link} {CURRENT_LINK} || mv -fh {temp_link} {CURRENT_LINK}; }}"
+    )
+    command = (
+        f"cd {shlex.quote(str(path))} && ln -s {target} {temp_link} && "
+        f"{{ {rename} || {{ rm -f {temp_link}; false; }}; }}"
+    )
+    result = conn.run(command, hide=True, warn=True)
+    if not result.ok:
+        logging.error(
+            f"Could not switch {conn.original_host}:{path / CURRENT_LINK} to {release}: {result.stderr.strip()}"
+        )
+        return False
+    logging.info(
+        f"Switched {conn.original_host}:{path / CURRENT_LINK} to {release.name}."
+    )
+    return True
@@ -7,11 +7,27 @@ License: See project-level license file.
 
 import glob
 import logging
+import os
+import re
+import shlex
 import sys
 import tomllib
 from pathlib import Path, PurePosixPath, PureWindowsPath
+from threading import Lock, Thread
 
 import fabric
+from paramiko.agent import AgentRequestHandler
+
+from redep import metrics
+from redep.orchestrator import check_cancelled, is_cancelled, transfer_slot
+from redep.session import get_connection, get_fact, set_fact
+
+# round trips of an SFTP upload or download: open, close, stat and chmod, as
+# the reads and writes in between are pipelined
+SFTP_ROUND_TRIPS = 4
+# reads of 32 KiB requested ahead by a throttled SFTP download
+THROTTLED_PREFETCH_REQUESTS = 4
+HASH_BLOCK_SIZE = 1024 * 1024
 
 
 def configure_logging():
@@ -73,8 +89,14 @@ def find_path_new_config(starting_path=None):
         return result_path
 
 
-def read_config_file(config_path):
-    config = tomllib.loads(Path(config_path).read_text())
+def load_config(config_path):
+    """Parse a configuration file, and return its options as a dictionary."""
+    return tomllib.loads(Path(config_path).read_text())
+
+
+def read_config_file(config_path, config=None):
+    if config is None:
+        config = load_config(config_path)
     default_root_dir = Path(config_path).parent
     root_dir = Path(config.get("root_dir", default_root_dir))
     if not root_dir.is_absolute():
@@ -90,46 +112,131 @@ def read_config_file(config_path):
 
 
 def select_local_patterns(root_dir, match_patterns, ignore_patterns):
-    all_patterns = [
-        set(glob.glob(str(root_dir / pattern), recursive=True, include_hidden=True))
-        for pattern in match_patterns
-    ]
-    all_patterns = set().union(*all_patterns)
-    ignored_patterns = [
-        set(glob.glob(str(root_dir / pattern), recursive=True, include_hidden=True))
-        for pattern in ignore_patterns
-    ]
-    ignored_patterns = set().union(*ignored_patterns)
-    # distinguish files and directories
-    all_files = {Path(f) for f in all_patterns if Path(f).is_file()}
-    all_dirs = {Path(f) for f in all_patterns if Path(f).is_dir()}
-    ignored_files = {Path(f) for f in ignored_patterns if Path(f).is_file()}
-    ignored_dirs = {Path(f) for f in ignored_patterns if Path(f).is_dir()}
-    selected_files = all_files - ignored_files
-    selected_dirs = all_dirs - ignored_dirs
-    selected_dirs.add(root_dir)  # always include root_dir
-    return selected_files, selected_dirs, ignored_files, ignored_dirs
+    """
+    Select the files and directories below root_dir that match any of the
+    match patterns and none of the ignore patterns.
+
+    Return selected files, selected directories, ignored files and ignored
+    directories. Directories ignored by a pattern ending with '**' are not
+    walked, so their content does not appear among the ignored files.
+    """
+    case_sensitive = os.name != "nt"
+    prune_regex = compile_patterns(prunable_patterns(ignore_patterns), case_sensitive)
+    with metrics.span("select_local_patterns", root=str(root_dir)) as attributes:
+        selection = classify_entries(
+            root_dir,
+            walk_local_tree(root_dir, prune_regex),
+            match_patterns,
+            ignore_patterns,
+            case_sensitive,
+        )
+        attributes["files"] = len(selection[0])
+    return selection
+
+
+def walk_local_tree(root_dir, prune_regex):
+    """
+    Walk a local directory tree with a single pass of os.scandir.
+
+    Yield (relative POSIX path, is directory) pairs for the files and
+    directories below root_dir. Directories matching prune_regex (with a
+    trailing '/') are yielded, but not walked.
+    """
+    stack = [("", str(root_dir))]
+    while stack:
+        prefix, directory = stack.pop()
+        try:
+            iterator = os.scandir(directory)
+        except OSError:
+            continue
+        with iterator:
+            for entry in iterator:
+                relative_path = prefix + entry.name
+                try:
+                    # like glob, follow symbolic links
+                    if entry.is_dir():
+                        yield relative_path, True
+                        if not prune_regex.fullmatch(relative_path + "/"):
+                            stack.append((relative_path + "/", entry.path))
+                    elif entry.is_file():
+                        yield relative_path, False
+                except OSError:
+                    continue
 
 
 def select_leaf_directories(directories):
     """Given a set of directories, return only the leaf directories (i.e., those that are not parents of any other directory in the set)."""
-    leaf_dirs = set(directories)
-    skip = False
-    for dir1 in directories:
-        for dir2 in directories:
-            if dir1 != dir2 and dir2.is_relative_to(dir1):
-                if dir1 in leaf_dirs:
-                    leaf_dirs.remove(dir1)
-                    skip = True
-                    break
-        if skip:
-            skip = False
+    # once sorted by their components, the descendants of a directory follow it
+    # immediately, so it is a leaf if and only if the next one is not inside it
+    ordered = sorted(set(directories), key=directory_key)
+    keys = [directory_key(d) for d in ordered]
+    leaf_dirs = set()
+    for i, directory in enumerate(ordered):
+        if i + 1 < len(keys) and keys[i + 1][: len(keys[i])] == keys[i]:
             continue
+        leaf_dirs.add(directory)
     return leaf_dirs
 
 
+def directory_key(directory):
+    """Key to sort paths by components, case-insensitively for Windows paths."""
+    if isinstance(directory, PureWindowsPath):
+        return tuple(part.lower() for part in directory.parts)
+    return directory.parts
+
+
+def parse_size(value):
+    """
+    Parse a size in bytes given as a number or as a string with an optional
+    binary suffix (e.g., "64M" or "1.5G").
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value
+    units = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    text = str(value).strip().upper().removesuffix("B").removesuffix("I")
+    number = text.rstrip("KMGT")
+    suffix = text[len(number) :]
+    if suffix not in units:
+        raise ValueError(f"Invalid size: {value}")
+    return int(float(number) * units[suffix])
+
+
+def format_size(size):
+    """Format a size in bytes with a binary suffix (e.g., "1.5 GiB")."""
+    for unit in ("B", "KiB", "MiB", "GiB", "TiB"):
+        if abs(size) < 1024 or unit == "TiB":
+            break
+        size /= 1024
+    return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+
+
+def format_duration(seconds):
+    """Format a duration in seconds (e.g., "2 min 5 s")."""
+    if seconds < 60:
+        return f"{seconds:.1f} s"
+    minutes, seconds = divmod(round(seconds), 60)
+    if minutes < 60:
+        return f"{minutes} min {seconds} s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours} h {minutes} min"
+
+
 def open_connection(host):
-    conn = fabric.Connection(host=host)
+    """Return a connection to host, opened only once per run."""
+    with metrics.span("connect", destination=host):
+        return get_connection(host, connect)
+
+
+class Connection(fabric.Connection):
+    """A fabric connection that counts its remote commands as round trips."""
+
+    def run(self, command, **kwargs):
+        metrics.count(self.original_host, "round_trips")
+        return super().run(command, **kwargs)
+
+
+def connect(host):
+    conn = Connection(host=host)
     try:
         conn.open()
         return conn
@@ -138,7 +245,180 @@ def open_connection(host):
         raise e
 
 
+def open_exec_channel(conn, command, forward_agent=False):
+    """
+    Run a command on its own channel, whose standard streams can be used to
+    exchange binary data (unlike those of conn.run).
+    If forward_agent is True, the command can use the local SSH agent.
+    """
+    metrics.count(conn.original_host, "round_trips")
+    channel = conn.client.get_transport().open_session()
+    if forward_agent:
+        AgentRequestHandler(channel)
+    channel.exec_command(command)
+    return channel
+
+
+def close_exec_channel(channel):
+    """Wait for the command of a channel to exit, and return its exit status and standard error."""
+    channel.shutdown_write()
+    stderr = channel.makefile_stderr("rb").read().decode(errors="replace")
+    status = channel.recv_exit_status()
+    channel.close()
+    return status, stderr
+
+
+def run_with_channels(conn, items, transfer, channels=1):
+    """
+    Call transfer(sftp, item) for each item, and return the items that failed.
+
+    With one channel, items are transferred one after another with the SFTP
+    session of the connection, and errors are raised.
+    With more, as many worker threads open their own SFTP session on the SSH
+    transport of the connection, and take items from a shared iterator, so
+    that memory does not grow with the number of items; errors are logged for
+    each item, and do not stop the other transfers.
+    Each item holds a transfer slot of the orchestrator while it is
+    transferred, and Cancelled is raised if the run is interrupted.
+    """
+    if channels <= 1:
+        sftp = conn.sftp()
+        for item in items:
+            check_cancelled()
+            with transfer_slot(conn.original_host):
+                transfer(sftp, item)
+        return []
+    items = iter(items)
+    lock = Lock()
+    failed = []
+
+    def work():
+        try:
+            sftp = conn.client.open_sftp()
+        except Exception as e:
+            logging.error(f"Could not open SFTP channel to {conn.original_host}: {e}")
+            return
+        try:
+            while True:
+                with lock:
+                    item = next(items, None)
+                if item is None or is_cancelled():
+                    break
+                try:
+                    with transfer_slot(conn.original_host):
+                        transfer(sftp, item)
+                except Exception as e:
+                    logging.error(
+                        f"Transfer of {item} with {conn.original_host} failed: {e}"
+                    )
+                    with lock:
+                        failed.append(item)
+        finally:
+            sftp.close()
+
+    workers = [Thread(target=work) for _ in range(channels)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    check_cancelled()
+    # items left if all channels failed to open
+    failed.extend(items)
+    return failed
+
+
+def hash_stream(stream, hasher, size=None):
+    """Feed the hasher with a binary stream, up to size bytes if given."""
+    remaining = size
+    while remaining is None or remaining > 0:
+        block = stream.read(
+            HASH_BLOCK_SIZE if remaining is None else min(HASH_BLOCK_SIZE, remaining)
+        )
+        if not block:
+            break
+        hasher.update(block)
+        if remaining is not None:
+            remaining -= len(block)
+    return hasher
+
+
+class HashingReader:
+    """Hash the data read from a binary stream."""
+
+    def __init__(self, stream, hasher):
+        self.stream = stream
+        self.hasher = hasher
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.hasher.update(data)
+        return data
+
+
+class HashingWriter:
+    """Hash the data written to a binary stream."""
+
+    def __init__(self, stream, hasher):
+        self.stream = stream
+        self.hasher = hasher
+
+    def write(self, data):
+        self.hasher.update(data)
+        return self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def upload_file(sftp, local_path, str_remote_path, callback=None, hasher=None):
+    """
+    Upload a file with SFTP, preserving its mode like Connection.put.
+    callback(bytes transferred, total bytes) is called after each chunk, and
+    hasher, if given, is fed with the data as it is read.
+    """
+    if hasher is None:
+        sftp.put(str(local_path), str_remote_path, callback=callback)
+    else:
+        with open(local_path, "rb") as source:
+            sftp.putfo(
+                HashingReader(source, hasher),
+                str_remote_path,
+                os.fstat(source.fileno()).st_size,
+                callback=callback,
+            )
+    sftp.chmod(str_remote_path, os.stat(local_path).st_mode & 0o7777)
+
+
+def download_file(
+    sftp, str_remote_path, local_path, callback=None, hasher=None, prefetch=None
+):
+    """
+    Download a file with SFTP, preserving its mode like Connection.get.
+    callback(bytes transferred, total bytes) is called after each chunk, and
+    prefetch limits the reads requested ahead (e.g., when callback throttles
+    the download). hasher, if given, is fed with the data as it is written.
+    """
+    options = {"callback": callback}
+    if prefetch is not None:
+        options["max_concurrent_prefetch_requests"] = prefetch
+    if hasher is None:
+        sftp.get(str_remote_path, str(local_path), **options)
+    else:
+        with open(local_path, "wb") as target:
+            sftp.getfo(str_remote_path, HashingWriter(target, hasher), **options)
+    os.chmod(local_path, sftp.stat(str_remote_path).st_mode & 0o7777)
+
+
 def identify_remote_os(connection):
+    remote_os = get_fact(connection.original_host, "os")
+    if remote_os is None:
+        with metrics.span("identify_remote_os", destination=connection.original_host):
+            remote_os = probe_remote_os(connection)
+        set_fact(connection.original_host, "os", remote_os)
+    return remote_os
+
+
+def probe_remote_os(connection):
     result = connection.run("uname -s", hide=True, warn=True)
     remote_os = None
     if result.ok:
@@ -158,111 +438,308 @@ def expand_home_path_remote(connection, path, remote_os):
     if remote_os == "windows":
         if str(path).startswith("~"):
             path = (
-                PureWindowsPath(
-                    connection.run("echo %USERPROFILE%", hide=True).stdout.strip()
-                )
+                PureWindowsPath(remote_home(connection, "echo %USERPROFILE%"))
                 / str(path)[2:]
             )
         path = PureWindowsPath(str(path).replace("/", "\\"))  # TODO find better way
     else:
         if str(path).startswith("~"):
-            path = (
-                PurePosixPath(connection.run("echo $HOME", hide=True).stdout.strip())
-                / str(path)[2:]
-            )
+            path = PurePosixPath(remote_home(connection, "echo $HOME")) / str(path)[2:]
         path = PurePosixPath(str(path).replace("\\", "/"))  # TODO find better way
     return path
 
 
+def remote_home(connection, command):
+    """Return the home directory of the remote user, printed by command."""
+    home = get_fact(connection.original_host, "home")
+    if home is None:
+        home = connection.run(command, hide=True).stdout.strip()
+        set_fact(connection.original_host, "home", home)
+    return home
+
+
 def expand_home_path_local(path):
     if str(path).startswith("~"):
         path = Path.home() / str(path)[2:]
     return path
 
 
-def select_remote_patterns(conn, root_dir, match_patterns, ignore_patterns):
-    if type(conn) is str:
-        # allow passing host instead of connection object
-        conn = open_connection(conn)
-    remote_os = identify_remote_os(conn)
+def pattern_components(pattern):
+    """Split a pattern into its components, dropping empty and '.' components."""
+    text = str(pattern).replace("\\", "/")
+    return [part for part in text.split("/") if part not in ("", ".")]
 
-    # expand ~ if needed
-    root_dir = expand_home_path_remote(conn, root_dir, remote_os)
 
-    all_files = set()
-    for pattern in match_patterns:
-        if remote_os == "windows":
-            result = conn.run(
-                f"PowerShell -Command \"Get-ChildItem -Path {root_dir} -File -Recurse | Where-Object {{ $_.FullName -like \'{str(root_dir / pattern).replace("/", "\\")}\' }} | Select-Object -ExpandProperty FullName\"",
-                hide=True,
-                warn=True,
-            )
-            result = result.stdout.strip().split()
-            all_files.update([PureWindowsPath(f) for f in result])
-        else:
-            result = conn.run(
-                f"find {root_dir} -type f -wholename '{str(root_dir) + "/" + str(pattern).replace("\\", "/")}'",
-                hide=True,
-                warn=True,
-            )
-            result = result.stdout.strip().split()
-            all_files.update([PurePosixPath(f) for f in result])
-    all_dirs = set()
-    for pattern in match_patterns:
-        if remote_os == "windows":
-            result = conn.run(
-                f"PowerShell -Command \"Get-ChildItem -Path {root_dir} -Directory -Recurse | Where-Object {{ $_.FullName -like \'{str(root_dir / pattern).replace("/", "\\")}\' }} | Select-Object -ExpandProperty FullName\"",
-                hide=True,
-                warn=True,
-            )
-            result = result.stdout.strip().split()
-            all_dirs.update([PureWindowsPath(f) for f in result])
+def translate_component(component):
+    """Translate a glob pattern component into a regular expression."""
+    if component.strip("*") == "":
+        # names are never empty
+        return "[^/]+"
+    result = []
+    i = 0
+    n = len(component)
+    while i < n:
+        c = component[i]
+        i += 1
+        if c == "*":
+            while i < n and component[i] == "*":
+                i += 1
+            result.append("[^/]*")
+        elif c == "?":
+            result.append("[^/]")
+        elif c == "[":
+            j = i
+            if j < n and component[j] == "!":
+                j += 1
+            if j < n and component[j] == "]":
+                j += 1
+            while j < n and component[j] != "]":
+                j += 1
+            if j >= n:
+                result.append("\\[")
+            else:
+                content = component[i:j].replace("\\", "\\\\")
+                i = j + 1
+                if content.startswith("!"):
+                    content = "^" + content[1:]
+                elif content.startswith("^"):
+                    content = "\\" + content
+                result.append(f"(?!/)[{content}]")
         else:
-            result = conn.run(
-                f"find {root_dir} -type d -wholename '{str(root_dir) + "/" + str(pattern).replace("\\", "/")}'",
-                hide=True,
-                warn=True,
-            )
-            result = result.stdout.strip().split()
-            all_dirs.update([PurePosixPath(f) for f in result])
-    ignored_files = set()
-    for pattern in ignore_patterns:
-        if remote_os == "windows":
-            result = conn.run(
-                f"PowerShell -Command \"Get-ChildItem -Path {root_dir} -File -Recurse | Where-Object {{ $_.FullName -like \'{str(root_dir / pattern).replace("/", "\\")}\' }} | Select-Object -ExpandProperty FullName\"",
-                hide=True,
-                warn=True,
-            )
-            result = result.stdout.strip().split()
+            result.append(re.escape(c))
+    return "".join(result)
+
+
+def translate_pattern(pattern):
+    """
+    Translate a glob pattern into a regular expression matching relative POSIX
+    paths, with the semantics of glob.glob(recursive=True, include_hidden=True).
 
-            ignored_files.update([PureWindowsPath(f) for f in result])
+    Directories must be matched with a trailing '/', because a pattern such as
+    'a/**' matches the directory 'a', but not a file with the same name.
+    """
+    components = pattern_components(pattern)
+    if len(components) == 0:
+        return ""
+    result = ""
+    for i, component in enumerate(components):
+        last = i == len(components) - 1
+        if component == "**":
+            # matches any number of directories, and anything if last
+            result += ".*" if last else "(?:[^/]+/)*"
         else:
-            result = conn.run(
-                f"find {root_dir} -type f -wholename '{str(root_dir) + "/" + str(pattern).replace("\\", "/")}'",
-                hide=True,
-                warn=True,
-            )
-            result = result.stdout.strip().split()
-            ignored_files.update([PurePosixPath(f) for f in result])
+            result += translate_component(component) + ("/?" if last else "/")
+    return result
+
+
+def compile_patterns(patterns, case_sensitive=True):
+    """Compile glob patterns into a single regular expression for relative POSIX paths."""
+    regex = "|".join(f"(?:{translate_pattern(p)})" for p in patterns)
+    if len(patterns) == 0:
+        regex = "(?!)"  # matches nothing
+    flags = re.DOTALL if case_sensitive else re.DOTALL | re.IGNORECASE
+    return re.compile(regex, flags)
+
+
+def prunable_patterns(ignore_patterns):
+    """
+    Return the ignore patterns ending with '**'.
+
+    A directory matching one of these patterns is ignored together with all
+    its content, so it does not need to be walked.
+    """
+    return [p for p in ignore_patterns if pattern_components(p)[-1:] == ["**"]]
+
+
+def classify_entries(
+    root_dir, entries, match_patterns, ignore_patterns, case_sensitive=True
+):
+    """
+    Select files and directories among the entries of a tree walk.
+
+    entries yields (relative POSIX path, is directory) pairs, relative to
+    root_dir. Return selected files, selected directories, ignored files and
+    ignored directories, as paths of the same flavour as root_dir.
+    """
+    match_regex = compile_patterns(match_patterns, case_sensitive)
+    ignore_regex = compile_patterns(ignore_patterns, case_sensitive)
+    selected_files = set()
+    selected_dirs = set()
+    ignored_files = set()
     ignored_dirs = set()
-    for pattern in ignore_patterns:
-        if remote_os == "windows":
-            result = conn.run(
-                f"PowerShell -Command \"Get-ChildItem -Path {root_dir} -Directory -Recurse | Where-Object {{ $_.FullName -like \'{str(root_dir / pattern).replace("/", "\\")}\' }} | Select-Object -ExpandProperty FullName\"",
-                hide=True,
-                warn=True,
-            )
-            result = result.stdout.strip().split()
-            ignored_dirs.update([PureWindowsPath(f) for f in result])
-        else:
-            result = conn.run(
-                f"find {root_dir} -type d -wholename '{str(root_dir) + "/" + str(pattern).replace("\\", "/")}'",
-                hide=True,
-                warn=True,
-            )
-            result = result.stdout.strip().split()
-            ignored_dirs.update([PurePosixPath(f) for f in result])
-    selected_files = all_files - ignored_files
-    selected_dirs = all_dirs - ignored_dirs
+    for relative_path, is_dir in entries:
+        key = relative_path + "/" if is_dir else relative_path
+        if ignore_regex.fullmatch(key):
+            (ignored_dirs if is_dir else ignored_files).add(root_dir / relative_path)
+        elif match_regex.fullmatch(key):
+            (selected_dirs if is_dir else selected_files).add(root_dir / relative_path)
     selected_dirs.add(root_dir)  # always include root_dir
     return selected_files, selected_dirs, ignored_files, ignored_dirs
+
+
+def prune_tests(root_dir, patterns):
+    """
+    Translate prunable ignore patterns into the directories to prune, where
+    possible.
+
+    Return the paths of literal directories, and the names of directories
+    from patterns of the form '**/name/**'; other patterns are not pruned
+    during the walk.
+    """
+    paths = []
+    names = []
+    for pattern in patterns:
+        components = pattern_components(pattern)[:-1]
+        if len(components) == 0:
+            continue
+        if not any(glob.has_magic(c) for c in components):
+            paths.append(str(root_dir) + "/" + "/".join(components))
+        elif (
+            len(components) == 2
+            and components[0] == "**"
+            and not any(c in components[1] for c in "[]")
+        ):
+            names.append(components[1])
+    return paths, names
+
+
+def find_prune_expression(root_dir, patterns):
+    """
+    Translate prunable ignore patterns into a find expression, where possible.
+    The expression is always true, so that pruned directories are listed too.
+    """
+    paths, names = prune_tests(root_dir, patterns)
+    tests = [f"-path {shlex.quote(path)}" for path in paths] + [
+        f"-name {shlex.quote(name)}" for name in names
+    ]
+    if len(tests) == 0:
+        return ""
+    return f"\\( -type d \\( {' -o '.join(tests)} \\) -prune -o -true \\)"
+
+
+def has_gnu_find(connection):
+    """Tell whether a POSIX host has GNU find, whose -printf lists entries at once."""
+    gnu_find = get_fact(connection.original_host, "gnu_find")
+    if gnu_find is None:
+        gnu_find = connection.run("find --version", hide=True, warn=True).ok
+        set_fact(connection.original_host, "gnu_find", gnu_find)
+    return gnu_find
+
+
+def find_list_command(root_dir, prune_patterns, gnu_find=True):
+    """
+    Return a command listing everything below root_dir, one entry per record
+    with its type, size, modification time and path, separated by tabs.
+    GNU find prints records ending with a null character, holding relative
+    paths. Elsewhere (e.g., BSD and macOS), stat prints lines with the
+    type in words and full paths.
+    """
+    prune = find_prune_expression(root_dir, prune_patterns)
+    command = f"find {shlex.quote(str(root_dir))} -mindepth 1 {prune}"
+    if gnu_find:
+        return f"{command} -printf '%Y\\t%s\\t%T@\\t%P\\0'"
+    return f"{command} -exec stat -f '%HT%t%z%t%m%t%N' {{}} +"
+
+
+def list_remote_tree(conn, root_dir, remote_os, prune_patterns=(), agent=None):
+    """
+    List everything below a remote directory with a single remote command, or
+    a single request to agent, if given (see redep.agent).
+
+    Return a list of (relative POSIX path, type, size, modification time)
+    tuples, where type is 'd' for directories and 'f' otherwise.
+    On POSIX hosts, directories matching the ignore patterns in
+    prune_patterns are listed, but not walked.
+    """
+    entries = []
+    if agent is not None:
+        try:
+            records = agent.list_tree(
+                str(root_dir), *prune_tests(root_dir, prune_patterns)
+            ).split("\0")
+        except Exception as e:
+            logging.warning(f"Listing {conn.original_host}:{root_dir} failed: {e}")
+            records = []
+    elif remote_os == "windows":
+        root = str(root_dir).replace("'", "''")
+        script = (
+            f"$r = (Get-Item -LiteralPath '{root}' -Force).FullName.TrimEnd('\\\\'); "
+            f"Get-ChildItem -LiteralPath $r -Recurse -Force | ForEach-Object {{ "
+            f"$t = if ($_.PSIsContainer) {{ 'd' }} else {{ 'f' }}; "
+            f"$s = if ($_.PSIsContainer) {{ 0 }} else {{ $_.Length }}; "
+            f"$m = [DateTimeOffset]::new($_.LastWriteTimeUtc).ToUnixTimeMilliseconds() / 1000; "
+            f"($t, $s, $m, $_.FullName.Substring($r.Length + 1)) -join [char]9 }}"
+        )
+        result = conn.run(
+            f'PowerShell -NoProfile -Command "{script}"', hide=True, warn=True
+        )
+        records = result.stdout.splitlines()
+    else:
+        gnu_find = has_gnu_find(conn)
+        result = conn.run(
+            find_list_command(root_dir, prune_patterns, gnu_find), hide=True, warn=True
+        )
+        if gnu_find:
+            records = result.stdout.split("\0")
+        else:
+            prefix = str(root_dir).rstrip("/") + "/"
+            records = [
+                record.replace(f"\t{prefix}", "\t", 1)
+                for record in result.stdout.split("\n")
+            ]
+    if agent is None and not result.ok:
+        logging.warning(
+            f"Listing {conn.original_host}:{root_dir} failed: {result.stderr.strip()}"
+        )
+    for record in records:
+        fields = record.split("\t", 3)
+        if len(fields) != 4:
+            continue
+        entry_type, size, mtime, relative_path = fields
+        if remote_os == "windows":
+            relative_path = relative_path.replace("\\", "/")
+        entry_type = "d" if entry_type in ("d", "Directory") else "f"
+        entries.append((relative_path, entry_type, int(size), float(mtime)))
+    return entries
+
+
+def select_remote_patterns(
+    conn, root_dir, match_patterns, ignore_patterns, stats=None, agent=None
+):
+    """
+    Select the files and directories below root_dir on a remote host, like
+    select_local_patterns. If stats is a dictionary, it is filled with the
+    size and modification time of the listed files, keyed by their path.
+    The listing goes through agent, if given.
+    """
+    if type(conn) is str:
+        # allow passing host instead of connection object
+        conn = open_connection(conn)
+    remote_os = identify_remote_os(conn)
+
+    # expand ~ if needed
+    root_dir = expand_home_path_remote(conn, root_dir, remote_os)
+
+    with metrics.span(
+        "select_remote_patterns", destination=conn.original_host, root=str(root_dir)
+    ) as attributes:
+        # list the whole tree at once, and match the patterns locally
+        entries = list_remote_tree(
+            conn, root_dir, remote_os, prunable_patterns(ignore_patterns), agent
+        )
+        if stats is not None:
+            for relative_path, entry_type, size, mtime in entries:
+                if entry_type == "f":
+                    stats[root_dir / relative_path] = (size, mtime)
+        selection = classify_entries(
+            root_dir,
+            (
+                (relative_path, entry_type == "d")
+                for relative_path, entry_type, _, _ in entries
+            ),
+            match_patterns,
+            ignore_patterns,
+            case_sensitive=remote_os != "windows",
+        )
+        attributes["files"] = len(selection[0])
+    return selection
@@ -0,0 +1,161 @@
+"""
+Verification of transferred files, with hashes computed while streaming.
+
+The transfer loops feed the data they read or write through a SHA-256 hasher,
+so that the local side of each file is hashed without reading it again. Once
+the files are transferred, the other side hashes them all in a single batched
+command (sha256sum on POSIX hosts, Get-FileHash on Windows, or a request to
+the helper of the agent transport), and the files whose hashes differ are
+transferred again.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import hashlib
+import logging
+from threading import Thread
+
+from redep import metrics
+from redep.agent import get_agent
+from redep.localcopy import copy_file
+from redep.util import close_exec_channel, hash_stream, open_exec_channel
+
+# cmd.exe, the default shell of the OpenSSH server, limits commands to 8191 characters
+WINDOWS_COMMAND_LIMIT = 8000
+
+
+def new_hasher():
+    return hashlib.sha256()
+
+
+def hash_file(path):
+    """Return the SHA-256 of a local file, as a hexadecimal string."""
+    with open(path, "rb") as stream:
+        return hash_stream(stream, new_hasher()).hexdigest()
+
+
+def remote_hashes(conn, str_paths, remote_os):
+    """
+    Hash remote files with as few commands as possible, and return their
+    SHA-256 keyed by path. Files that could not be hashed are left out.
+    """
+    hashes = {}
+    if len(str_paths) == 0:
+        return hashes
+    agent = get_agent(conn)
+    with metrics.span("verify", destination=conn.original_host, files=len(str_paths)):
+        if agent is not None:
+            try:
+                hashes = agent.hash_files(str_paths)
+            except Exception as e:
+                logging.warning(f"Could not hash files on {conn.original_host}: {e}")
+        elif remote_os == "windows":
+            for batch in windows_batches(str_paths):
+                hashes.update(windows_hashes(conn, batch))
+        else:
+            hashes = posix_hashes(conn, str_paths)
+    return hashes
+
+
+def posix_hashes(conn, str_paths):
+    """Hash files with sha256sum, reading their names from standard input."""
+    channel = open_exec_channel(conn, "xargs -0 -r sha256sum -z --")
+    names = b"".join(path.encode() + b"\0" for path in str_paths)
+
+    def send_names():
+        try:
+            channel.sendall(names)
+        finally:
+            channel.shutdown_write()
+
+    # send the list while receiving the hashes, so that neither side blocks
+    sender = Thread(target=send_names)
+    sender.start()
+    output = channel.makefile("rb").read()
+    sender.join()
+    status, stderr = close_exec_channel(channel)
+    if status != 0:
+        logging.warning(
+            f"Could not hash some files on {conn.original_host}: {stderr.strip()}"
+        )
+    hashes = {}
+    # with -z, records end with NUL and names are not escaped
+    for record in output.split(b"\0"):
+        digest, _, name = record.partition(b"  ")
+        if name:
+            hashes[name.decode(errors="surrogateescape")] = digest.decode()
+    return hashes
+
+
+def windows_batches(str_paths):
+    """Split paths into batches whose Get-FileHash command fits the length limit."""
+    batch = []
+    length = 0
+    for str_path in str_paths:
+        argument = windows_argument(str_path)
+        if batch and length + len(argument) + 1 > WINDOWS_COMMAND_LIMIT - 200:
+            yield batch
+            batch = []
+            length = 0
+        batch.append(str_path)
+        length += len(argument) + 1
+    if batch:
+        yield batch
+
+
+def windows_argument(str_path):
+    # SFTP paths of Windows hosts start with a slash before the drive
+    return "'" + str_path.lstrip("/").replace("'", "''") + "'"
+
+
+def windows_hashes(conn, str_paths):
+    """Hash files with Get-FileHash, printing one hash per line, in order."""
+    arguments = ",".join(windows_argument(p) for p in str_paths)
+    script = (
+        f"{arguments} | ForEach-Object {{ "
+        f"$h = Get-FileHash -Algorithm SHA256 -LiteralPath $_ -ErrorAction SilentlyContinue; "
+        f"if ($h) {{ $h.Hash.ToLower() }} else {{ '-' }} }}"
+    )
+    result = conn.run(
+        f'PowerShell -NoProfile -Command "{script}"', hide=True, warn=True
+    )
+    if not result.ok:
+        logging.warning(
+            f"Could not hash some files on {conn.original_host}: {result.stderr.strip()}"
+        )
+    lines = result.stdout.split()
+    return {
+        str_path: digest for str_path, digest in zip(str_paths, lines) if digest != "-"
+    }
+
+
+def verify_remote(conn, hashes, str_paths, remote_os):
+    """
+    Compare local hashes, keyed by file, with those of the remote files at
+    str_paths[file], and return the files that differ.
+    """
+    remote = remote_hashes(conn, [str_paths[f] for f in hashes], remote_os)
+    return [f for f, digest in hashes.items() if remote.get(str_paths[f]) != digest]
+
+
+def verify_copies(pairs, label):
+    """
+    Compare local (source, destination) pairs, copy again those that differ,
+    and return the sources whose copy still differs.
+
+    As local copies may not read the data (e.g., with reflinks), both sides
+    are hashed here.
+    """
+    differing = []
+    with metrics.span("verify", destination=label, files=len(pairs)):
+        for source, destination in pairs:
+            digest = hash_file(source)
+            if hash_file(destination) == digest:
+                continue
+            logging.warning(f"{destination} differs from {source}; copying it again.")
+            copy_file(source, destination)
+            if hash_file(destination) != digest:
+                logging.error(f"{destination} still differs from {source}.")
+                differing.append(source)
+    return differing
@@ -0,0 +1,242 @@
+"""
+Watch mode, which pushes files to all destinations as soon as they change.
+
+Changes are detected with inotify on Linux, and by polling the tree
+elsewhere. Bursts of changes are grouped, and only the changed paths are
+pushed, over the connections kept open by the session cache.
+
+Authors: Giulio Foletto.
+License: See project-level license file.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+from pathlib import Path, PurePosixPath
+
+from redep.manifest import MANIFEST_NAME
+from redep.push import push_selection
+from redep.util import (
+    classify_entries,
+    compile_patterns,
+    prunable_patterns,
+    walk_local_tree,
+)
+
+DEBOUNCE = 0.2
+POLL_INTERVAL = 1.0
+# longest time to wait for a burst of changes to stop
+MAX_DELAY = 2.0
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """Report the paths that change below a directory, with inotify."""
+
+    def __init__(self, root_dir, prune_regex):
+        libc_name = ctypes.util.find_library("c")
+        if os.name != "posix" or libc_name is None:
+            raise OSError("inotify is not available")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.root_dir = root_dir
+        self.prune_regex = prune_regex
+        self.watches = {}
+        self.add_tree("")
+
+    def add_watch(self, relative_path):
+        path = os.path.join(self.root_dir, relative_path)
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == 28:  # ENOSPC
+                raise OSError(error, "too many inotify watches")
+            return
+        self.watches[wd] = relative_path
+
+    def add_tree(self, relative_path):
+        """
+        Watch a directory and its subdirectories, and return the paths that
+        they already contain, which may have been created before the watches.
+        """
+        self.add_watch(relative_path)
+        prefix = relative_path + "/" if relative_path else ""
+        found = []
+        for child, is_dir in walk_local_tree(
+            os.path.join(self.root_dir, relative_path), self.prune_regex
+        ):
+            child = prefix + child
+            found.append(child)
+            if is_dir and not self.prune_regex.fullmatch(child + "/"):
+                self.add_watch(child)
+        return found
+
+    def wait(self, timeout):
+        """Return the set of relative paths that changed, waiting at most timeout seconds."""
+        changed = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return changed
+        try:
+            data = os.read(self.fd, 1024 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = (
+                data[offset : offset + length]
+                .rstrip(b"\0")
+                .decode(errors="surrogateescape")
+            )
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, look at everything
+                changed.update(self.add_tree(""))
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None or name == "":
+                continue
+            relative_path = f"{directory}/{name}" if directory else name
+            changed.add(relative_path)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                if not self.prune_regex.fullmatch(relative_path + "/"):
+                    changed.update(self.add_tree(relative_path))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Report the paths that change below a directory, by walking it periodically."""
+
+    def __init__(self, root_dir, prune_regex, interval=POLL_INTERVAL):
+        self.root_dir = root_dir
+        self.prune_regex = prune_regex
+        self.interval = interval
+        self.state = self.scan()
+
+    def scan(self):
+        state = {}
+        for relative_path, is_dir in walk_local_tree(self.root_dir, self.prune_regex):
+            if is_dir:
+                state[relative_path] = None
+                continue
+            try:
+                stat = os.stat(os.path.join(self.root_dir, relative_path))
+            except OSError:
+                continue
+            state[relative_path] = (stat.st_size, stat.st_mtime_ns, stat.st_mode)
+        return state
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        state = self.scan()
+        changed = {
+            path
+            for path, signature in state.items()
+            if self.state.get(path, False) != signature
+        }
+        self.state = state
+        return changed
+
+    def close(self):
+        pass
+
+
+def open_watcher(root_dir, prune_regex):
+    try:
+        return InotifyWatcher(root_dir, prune_regex)
+    except OSError as e:
+        logging.info(f"Watching by polling, because inotify is unavailable: {e}")
+        return PollingWatcher(root_dir, prune_regex)
+
+
+def collect_changes(watcher, debounce=DEBOUNCE, max_delay=MAX_DELAY):
+    """
+    Wait for changes, then keep collecting them until none happens for
+    debounce seconds (or for at most max_delay seconds), and return them.
+    """
+    changed = set()
+    while not changed:
+        changed = watcher.wait(3600)
+    start = time.monotonic()
+    while time.monotonic() - start < max_delay:
+        more = watcher.wait(debounce)
+        if not more:
+            break
+        changed.update(more)
+    return changed
+
+
+def select_changed(root_dir, changed, matches, ignores, case_sensitive):
+    """
+    Select the changed paths that still exist and match the patterns, together
+    with the directories that contain them.
+    """
+    entries = []
+    for relative_path in changed:
+        path = root_dir / relative_path
+        if path.is_dir():
+            entries.append((relative_path, True))
+        elif path.is_file():
+            entries.append((relative_path, False))
+    files, dirs, _, _ = classify_entries(
+        root_dir, entries, matches, ignores, case_sensitive
+    )
+    # the destination may not have the directories of the changed files yet
+    for file_path in files:
+        for parent in PurePosixPath(file_path.relative_to(root_dir).as_posix()).parents:
+            dirs.add(root_dir / parent)
+    return files, dirs
+
+
+def watch(root_dir, matches, ignores, destinations, debounce=DEBOUNCE):
+    """Push changed files to all destinations until interrupted."""
+    # never push a manifest that may exist in the source directory
+    ignores = ignores + [Path(MANIFEST_NAME)]
+    case_sensitive = os.name != "nt"
+    prune_regex = compile_patterns(prunable_patterns(ignores), case_sensitive)
+    watcher = open_watcher(root_dir, prune_regex)
+    logging.info(f"Watching {root_dir} for changes; press Ctrl+C to stop.")
+    try:
+        while True:
+            changed = collect_changes(watcher, debounce)
+            start = time.monotonic()
+            files, dirs = select_changed(
+                root_dir, changed, matches, ignores, case_sensitive
+            )
+            if len(files) == 0:
+                continue
+            logging.info(f"Pushing {len(files)} changed files.")
+            push_selection(files, dirs, root_dir, destinations, partial=True)
+            logging.info(f"Pushed changes in {time.monotonic() - start:.2f} s.")
+    except KeyboardInterrupt:
+        logging.info("Stopped watching.")
+    finally:
+        watcher.close()
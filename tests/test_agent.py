@@ -0,0 +1,118 @@
+import hashlib
+import os
+import shutil
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+from redep.agent import Agent, AgentError
+from redep.util import list_remote_tree
+
+pytestmark = pytest.mark.skipif(
+    os.name == "nt" or shutil.which("python3") is None,
+    reason="requires a POSIX shell and python3",
+)
+
+
+class LocalChannel:
+    """Run the command of an exec channel in a local shell."""
+
+    def exec_command(self, command):
+        self.process = subprocess.Popen(
+            command,
+            shell=True,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+    def makefile(self, mode="rb"):
+        return self.process.stdout
+
+    def makefile_stdin(self, mode="wb"):
+        return self.process.stdin
+
+    def makefile_stderr(self, mode="rb"):
+        return self.process.stderr
+
+    def shutdown_write(self):
+        self.process.stdin.close()
+
+    def recv_exit_status(self):
+        return self.process.wait()
+
+    def close(self):
+        self.process.kill()
+        self.process.wait()
+
+
+class LocalConnection:
+    original_host = "local"
+
+    def __init__(self):
+        transport = SimpleNamespace(open_session=LocalChannel)
+        self.client = SimpleNamespace(get_transport=lambda: transport)
+
+
+@pytest.fixture
+def agent():
+    agent = Agent(LocalConnection())
+    yield agent
+    agent.close()
+
+
+def test_list_and_make_directories(tmp_path, agent):
+    assert (
+        agent.make_directories([str(tmp_path / "a" / "b"), str(tmp_path / "c")]) == []
+    )
+    (tmp_path / "a" / "b" / "file.txt").write_text("content")
+    (tmp_path / "c" / "skipped.txt").write_text("")
+    (tmp_path / "a" / "cache-1").mkdir()
+    (tmp_path / "a" / "cache-1" / "skipped.txt").write_text("")
+    entries = list_remote_tree(
+        LocalConnection(), tmp_path, "linux", ["c/**", "**/cache-*/**"], agent
+    )
+    assert sorted((path, kind, size) for path, kind, size, _ in entries) == [
+        ("a", "d", (tmp_path / "a").stat().st_size),
+        ("a/b", "d", (tmp_path / "a" / "b").stat().st_size),
+        ("a/b/file.txt", "f", 7),
+        # like find -name, names are patterns
+        ("a/cache-1", "d", (tmp_path / "a" / "cache-1").stat().st_size),
+        # pruned directories are listed, but not walked
+        ("c", "d", (tmp_path / "c").stat().st_size),
+    ]
+
+
+def test_put_and_get_files(tmp_path, agent):
+    source = tmp_path / "source"
+    source.mkdir()
+    data = os.urandom(600_000)
+    (source / "big.bin").write_bytes(data)
+    (source / "script.sh").write_text("exit 0\n")
+    (source / "script.sh").chmod(0o755)
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    items = [
+        (source / name, str(remote / name), hashlib.sha256())
+        for name in ("big.bin", "script.sh")
+    ]
+    results = list(agent.put_files(items))
+    assert [error for _, error in results] == [None, None]
+    assert (remote / "big.bin").read_bytes() == data
+    assert (remote / "script.sh").stat().st_mode & 0o777 == 0o755
+    digests = agent.hash_files([str(remote / "big.bin"), str(remote / "missing")])
+    assert digests == {str(remote / "big.bin"): items[0][2].hexdigest()}
+
+    local = tmp_path / "local"
+    local.mkdir()
+    items = [
+        (str(remote / name), local / name, None)
+        for name in ("big.bin", "missing", "script.sh")
+    ]
+    results = list(agent.get_files(items))
+    assert results[0][1] is None and results[2][1] is None
+    assert isinstance(results[1][1], AgentError)
+    assert (local / "big.bin").read_bytes() == data
+    assert (local / "script.sh").stat().st_mode & 0o777 == 0o755
+    assert sorted(p.name for p in local.iterdir()) == ["big.bin", "script.sh"]
@@ -0,0 +1,72 @@
+import io
+import time
+
+import pytest
+
+from redep import bandwidth
+from redep.bandwidth import (
+    TokenBucket,
+    configure_global_limit,
+    configure_remote_limits,
+    parse_limit,
+    throttled_writer,
+    transfer_callback,
+)
+
+
+@pytest.fixture(autouse=True)
+def no_limits():
+    yield
+    configure_global_limit(None)
+    configure_remote_limits([])
+
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(1024 * 1024)
+    start = time.monotonic()
+    for _ in range(8):
+        bucket.consume(64 * 1024)
+    elapsed = time.monotonic() - start
+    # half a second of transfer, minus the initial burst
+    assert 0.35 < elapsed < 0.6
+
+
+@pytest.mark.parametrize(
+    "value, link, expected",
+    [
+        (None, None, None),
+        ("2M", None, 2 * 1024**2),
+        (1000, None, 1000),
+        ("25%", "8M", 2 * 1024**2),
+        ("25%", None, None),
+        (0, None, None),
+    ],
+)
+def test_parse_limit(value, link, expected):
+    assert parse_limit(value, link) == expected
+
+
+def test_remote_limits_take_lowest():
+    configure_remote_limits(
+        [
+            {"host": "a", "path": "/x", "bwlimit": "2M"},
+            {"host": "a", "path": "/y", "bwlimit": "1M"},
+            {"host": "b", "path": "/z"},
+            {"host": "", "path": "/w", "bwlimit": "1M"},
+        ]
+    )
+    assert set(bandwidth.host_buckets) == {"a"}
+    assert bandwidth.host_buckets["a"].rate == 1024**2
+    assert transfer_callback("b") is None
+
+
+def test_throttled_writer():
+    stream = io.BytesIO()
+    assert throttled_writer(stream, "host") is stream
+    configure_global_limit("1M")
+    writer = throttled_writer(stream, "host")
+    start = time.monotonic()
+    for _ in range(8):
+        writer.write(bytes(64 * 1024))
+    assert time.monotonic() - start > 0.35
+    assert len(stream.getvalue()) == 512 * 1024
@@ -0,0 +1,58 @@
+import gzip
+import io
+import random
+from pathlib import Path
+
+import pytest
+
+from redep.compression import (
+    CompressedWriter,
+    DecompressedReader,
+    is_compressible,
+    normalize_codec,
+    resolve_level,
+)
+
+
+@pytest.mark.parametrize("codec", ["gzip", "zstd"])
+def test_compression_roundtrip(codec):
+    codec = normalize_codec(codec)
+    rng = random.Random(0)
+    data = b"".join(rng.choice([b"abc", b"hello ", b"\n"]) for _ in range(100000))
+    stream = io.BytesIO()
+    writer = CompressedWriter(stream, codec, resolve_level(codec, None))
+    for i in range(0, len(data), 1000):
+        writer.write(data[i : i + 1000])
+    writer.close()
+    assert len(stream.getvalue()) < len(data)
+    reader = DecompressedReader(io.BytesIO(stream.getvalue()), codec)
+    chunks = []
+    while chunk := reader.read(777):
+        chunks.append(chunk)
+    assert b"".join(chunks) == data
+
+
+def test_gzip_is_compatible():
+    stream = io.BytesIO()
+    writer = CompressedWriter(stream, "gzip", 6)
+    writer.write(b"data" * 100)
+    writer.close()
+    assert gzip.decompress(stream.getvalue()) == b"data" * 100
+
+
+def test_invalid_compressed_data():
+    reader = DecompressedReader(io.BytesIO(b"not gzip data"), "gzip")
+    with pytest.raises(OSError):
+        reader.read()
+
+
+def test_codec_options():
+    assert normalize_codec(None) is None
+    assert normalize_codec("none") is None
+    assert normalize_codec("GZIP") == "gzip"
+    assert normalize_codec("unknown") is None
+    assert resolve_level("gzip", None) == 6
+    assert resolve_level("zstd", "9") == 9
+    assert is_compressible(Path("a/b.txt"))
+    assert not is_compressible(Path("a/b.tar.GZ"))
+    assert not is_compressible(Path("photo.jpg"))
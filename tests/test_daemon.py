@@ -0,0 +1,73 @@
+import os
+import socket
+from threading import Thread
+
+import click
+import pytest
+
+from redep import daemon
+from redep.daemon import run_in_daemon, serve, should_delegate, stop_daemon
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(socket, "AF_UNIX") or os.name == "nt", reason="requires Unix sockets"
+)
+
+
+@click.group()
+def fake_cli():
+    pass
+
+
+@fake_cli.command(name="push")
+@click.option("--fail", is_flag=True)
+def fake_push(fail):
+    click.echo(f"pushing from {os.getcwd()}, serving={daemon.serving}")
+    click.echo("progress", err=True)
+    if fail:
+        raise click.ClickException("failed")
+
+
+@pytest.fixture
+def running_daemon(tmp_path, monkeypatch):
+    path = tmp_path / "run" / "daemon.sock"
+    monkeypatch.setenv("REDEP_DAEMON_SOCKET", str(path))
+    monkeypatch.delenv("REDEP_NO_DAEMON", raising=False)
+    server = Thread(target=serve, args=(fake_cli,))
+    server.start()
+    while not (path.exists() and daemon.serving):
+        server.join(0.01)
+    yield path
+    assert stop_daemon()
+    server.join()
+    assert not path.exists()
+
+
+def test_commands_run_in_daemon(tmp_path, monkeypatch, running_daemon, capfd):
+    assert running_daemon.stat().st_mode & 0o777 == 0o600
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    monkeypatch.chdir(work_dir)
+    assert run_in_daemon(["push"]) == 0
+    assert run_in_daemon(["push", "--fail"]) == 1
+    output = capfd.readouterr()
+    assert output.out.count(f"pushing from {work_dir}, serving=True\n") == 2
+    assert output.err.count("progress\n") == 2
+    assert "Error: failed" in output.err
+    # watching never ends, and would hold the daemon
+    assert run_in_daemon(["push", "--watch"]) is None
+
+
+def test_direct_mode_without_daemon(tmp_path, monkeypatch):
+    monkeypatch.setenv("REDEP_DAEMON_SOCKET", str(tmp_path / "missing.sock"))
+    monkeypatch.delenv("REDEP_NO_DAEMON", raising=False)
+    assert run_in_daemon(["push"]) is None
+    assert not stop_daemon()
+
+
+def test_should_delegate(monkeypatch):
+    monkeypatch.delenv("REDEP_NO_DAEMON", raising=False)
+    assert should_delegate(["pull", "--verify"])
+    assert not should_delegate(["init"])
+    assert not should_delegate([])
+    monkeypatch.setenv("REDEP_NO_DAEMON", "1")
+    assert not should_delegate(["push"])
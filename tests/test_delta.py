@@ -0,0 +1,194 @@
+import base64
+import io
+import random
+import shutil
+import subprocess
+import zlib
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from redep import bandwidth
+from redep.delta import (
+    DeltaTooLarge,
+    apply_delta,
+    block_size_for,
+    compute_delta,
+    compute_signature,
+    delta_command,
+)
+from redep.pull import pull_file_delta
+from redep.push import push_file_delta
+
+
+def roundtrip(basis, new, block_size=None, max_literal=None):
+    block_size = block_size or block_size_for(len(basis))
+    signature = compute_signature(io.BytesIO(basis), block_size)
+    delta = io.BytesIO()
+    compute_delta(signature, io.BytesIO(new), delta, max_literal)
+    result = io.BytesIO()
+    assert apply_delta(io.BytesIO(basis), io.BytesIO(delta.getvalue()), result)
+    assert result.getvalue() == new
+    return len(delta.getvalue())
+
+
+def test_delta_roundtrip():
+    rng = random.Random(0)
+    for size in [0, 1, 4095, 4096, 4097, 100_000, 1_000_000]:
+        basis = rng.randbytes(size)
+        middle = size // 2
+        variants = [
+            basis,
+            basis[:middle] + b"inserted" + basis[middle:],
+            basis[:middle] + basis[middle + 100 :],
+            basis[:middle] + b"x" * 10 + basis[middle + 10 :],
+            b"prefix" + basis,
+            basis + b"suffix",
+            basis[:-1],
+            rng.randbytes(size),
+        ]
+        for new in variants:
+            roundtrip(basis, new)
+
+
+def test_delta_is_small_for_small_changes():
+    rng = random.Random(1)
+    basis = rng.randbytes(5_000_000)
+    new = basis[:1000] + b"inserted" + basis[1000:3_000_000] + basis[3_000_100:]
+    assert roundtrip(basis, new) < 3 * block_size_for(len(basis))
+
+
+def test_delta_weak_collision_in_last_window():
+    rng = random.Random(5)
+    basis = bytearray(rng.randbytes(8192))
+    basis[100:103] = b"\x10\x10\x10"
+    # +1, -2, +1 keeps the weak checksum of the block, but not its strong hash
+    block = bytearray(basis[:4096])
+    block[100:103] = b"\x11\x0e\x11"
+    assert zlib.adler32(block) == zlib.adler32(basis[:4096])
+    roundtrip(bytes(basis), rng.randbytes(1000) + bytes(block), block_size=4096)
+
+
+def test_delta_too_large():
+    rng = random.Random(2)
+    basis = rng.randbytes(100_000)
+    with pytest.raises(DeltaTooLarge):
+        roundtrip(basis, rng.randbytes(100_000), max_literal=50_000)
+
+
+def test_apply_delta_detects_wrong_basis():
+    rng = random.Random(3)
+    basis = rng.randbytes(100_000)
+    block_size = block_size_for(len(basis))
+    signature = compute_signature(io.BytesIO(basis), block_size)
+    delta = io.BytesIO()
+    compute_delta(signature, io.BytesIO(basis), delta)
+    other = bytearray(basis)
+    other[50_000] ^= 0xFF
+    delta.seek(0)
+    assert not apply_delta(io.BytesIO(bytes(other)), delta, io.BytesIO())
+
+
+@pytest.mark.skipif(shutil.which("python3") is None, reason="python3 not available")
+def test_delta_command(tmp_path):
+    """
+    Test the command line interface used on remote hosts, through a local shell.
+    """
+    rng = random.Random(4)
+    basis = rng.randbytes(200_000)
+    new = basis[:100_000] + b"inserted" + basis[100_000:]
+    path = tmp_path / "file.bin"
+    path.write_bytes(basis)
+    block_size = block_size_for(len(basis))
+    result = subprocess.run(
+        delta_command("signature", path, block_size),
+        shell=True,
+        capture_output=True,
+        check=True,
+    )
+    signature = base64.b64decode(result.stdout)
+    assert signature == compute_signature(io.BytesIO(basis), block_size)
+    delta = io.BytesIO()
+    compute_delta(signature, io.BytesIO(new), delta)
+    subprocess.run(
+        delta_command("patch", path, "644"),
+        shell=True,
+        input=delta.getvalue(),
+        check=True,
+    )
+    assert path.read_bytes() == new
+    # and in the other direction
+    path.write_bytes(new)
+    result = subprocess.run(
+        delta_command("delta", path, len(basis)),
+        shell=True,
+        input=compute_signature(io.BytesIO(basis), block_size),
+        capture_output=True,
+        check=True,
+    )
+    output = io.BytesIO()
+    assert apply_delta(io.BytesIO(basis), io.BytesIO(result.stdout), output)
+    assert output.getvalue() == new
+
+
+class ShellChannel:
+    """Run the command of an exec channel in a local shell."""
+
+    def exec_command(self, command):
+        self.process = subprocess.Popen(
+            command,
+            shell=True,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+    def makefile(self, mode="rb"):
+        return self.process.stdout
+
+    def makefile_stdin(self, mode="wb"):
+        return self.process.stdin
+
+    def makefile_stderr(self, mode="rb"):
+        return self.process.stderr
+
+    def shutdown_write(self):
+        self.process.stdin.close()
+
+    def recv_exit_status(self):
+        return self.process.wait()
+
+    def close(self):
+        self.process.wait()
+
+
+@pytest.mark.skipif(shutil.which("python3") is None, reason="requires python3")
+def test_delta_transfers_are_throttled(tmp_path, monkeypatch):
+    transport = SimpleNamespace(open_session=ShellChannel)
+    conn = SimpleNamespace(
+        original_host="host",
+        client=SimpleNamespace(get_transport=lambda: transport),
+    )
+    throttled = []
+    monkeypatch.setattr(bandwidth, "throttle", lambda host, n: throttled.append(n))
+    bandwidth.configure_global_limit("1G")
+    try:
+        rng = random.Random(5)
+        basis = rng.randbytes(200_000)
+        new = basis[:100_000] + b"inserted" + basis[100_000:]
+        local = tmp_path / "local.bin"
+        remote = tmp_path / "remote.bin"
+        local.write_bytes(new)
+        remote.write_bytes(basis)
+        assert push_file_delta(conn, local, str(remote))
+        assert remote.read_bytes() == new
+        # the signature and the delta
+        assert sum(throttled) > len(b"inserted")
+        throttled.clear()
+        local.write_bytes(basis)
+        assert pull_file_delta(conn, str(remote), local)
+        assert local.read_bytes() == new
+        assert sum(throttled) > len(b"inserted")
+    finally:
+        bandwidth.configure_global_limit(None)
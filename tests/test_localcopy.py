@@ -0,0 +1,52 @@
+import errno
+import os
+
+import pytest
+
+from redep import localcopy
+from redep.localcopy import copy_file, copy_files
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "source.bin"
+    path.write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+    return path
+
+
+@pytest.mark.parametrize("method", [m for m, _ in localcopy.METHODS] + ["fallback"])
+def test_copy_file(tmp_path, source, monkeypatch, method):
+    monkeypatch.setattr(localcopy, "unsupported", set())
+    monkeypatch.setattr(
+        localcopy, "METHODS", [m for m in localcopy.METHODS if m[0] == method]
+    )
+    destination = tmp_path / "destination.bin"
+    destination.write_bytes(b"old content that is replaced")
+    copy_file(source, destination)
+    assert destination.read_bytes() == source.read_bytes()
+
+
+def test_copy_file_falls_back(tmp_path, source, monkeypatch):
+    def unsupported_method(source_fd, dest_fd, size):
+        os.write(dest_fd, b"partial")
+        raise OSError(errno.EXDEV, "not supported")
+
+    monkeypatch.setattr(localcopy, "unsupported", set())
+    monkeypatch.setattr(localcopy, "METHODS", [("broken", unsupported_method)])
+    destination = tmp_path / "destination.bin"
+    copy_file(source, destination)
+    assert destination.read_bytes() == source.read_bytes()
+    assert len(localcopy.unsupported) == 1
+
+
+def test_copy_files(tmp_path, source):
+    pairs = [(source, tmp_path / f"copy_{i}.bin") for i in range(20)]
+    assert list(copy_files(pairs, workers=4)) == pairs
+    for _, destination in pairs:
+        assert destination.read_bytes() == source.read_bytes()
+
+
+def test_copy_files_raises(tmp_path, source):
+    pairs = [(source, tmp_path / "copy.bin"), (tmp_path / "missing", tmp_path / "x")]
+    with pytest.raises(FileNotFoundError):
+        list(copy_files(pairs, workers=4))
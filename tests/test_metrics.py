@@ -0,0 +1,66 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from redep import metrics
+from redep.push import push
+
+
+@pytest.fixture
+def recording():
+    metrics.start_recording()
+    yield
+    metrics.stop_recording()
+
+
+def test_push_metrics(tmp_path, recording):
+    src_dir = tmp_path / "src"
+    (src_dir / "sub").mkdir(parents=True)
+    (src_dir / "one.txt").write_text("12345")
+    (src_dir / "sub" / "two.txt").write_text("123")
+    destination = tmp_path / "dst"
+    push(src_dir, [Path("**/*")], [], [{"host": "", "path": destination}])
+    report = metrics.summary()
+    for phase in ("push", "select_local_patterns", "mkdir", "transfer"):
+        assert report["phases"][phase]["count"] == 1
+    counts = report["destinations"][str(destination)]
+    assert counts["files"] == 2
+    assert counts["bytes"] == 8
+    assert counts["seconds"] == report["phases"]["transfer"]["seconds"]
+
+
+def test_write_metrics_trace(tmp_path, recording):
+    with metrics.span("outer", destination="host"):
+        with metrics.span("inner") as attributes:
+            attributes["files"] = 3
+    metrics.count("host", "round_trips", 2)
+    path = tmp_path / "trace.json"
+    metrics.write_metrics(path, trace_format=True)
+    report = json.loads(path.read_text())
+    spans = [event for event in report["traceEvents"] if event["ph"] == "X"]
+    assert [event["name"] for event in spans] == ["inner", "outer"]
+    assert spans[0]["args"] == {"files": 3}
+    assert spans[0]["ts"] >= spans[1]["ts"]
+    assert report["otherData"]["destinations"]["host"]["round_trips"] == 2
+
+
+def test_not_recording():
+    metrics.start_recording()
+    metrics.stop_recording()
+    with metrics.span("ignored"):
+        metrics.count("host", "files")
+    assert metrics.summary()["phases"] == {}
+    assert metrics.summary()["destinations"] == {}
+
+
+def test_recording_to_writes_on_failure(tmp_path):
+    path = tmp_path / "metrics.json"
+    with pytest.raises(RuntimeError):
+        with metrics.recording_to(path):
+            with metrics.span("failing"):
+                raise RuntimeError("failed")
+    assert json.loads(path.read_text())["phases"]["failing"]["count"] == 1
+    # recording stops, so that later commands of the daemon do not pay for it
+    assert not metrics.recording
+    assert metrics.spans == []
@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+from redep import orchestrator
+from redep.orchestrator import (
+    Cancelled,
+    check_cancelled,
+    configure_limits,
+    new_run,
+    run_all,
+    transfer_slot,
+)
+
+
+@pytest.fixture(autouse=True)
+def default_limits():
+    yield
+    configure_limits()
+
+
+def concurrency_probe():
+    """Return a function that records the largest number of concurrent calls."""
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+
+    def work():
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.02)
+        with lock:
+            state["running"] -= 1
+
+    return work, state
+
+
+@pytest.mark.parametrize(
+    "limits, peak",
+    [
+        ({"max_destinations": 3}, 3),
+        ({"max_destinations": 8, "max_destinations_per_host": 2}, 2),
+    ],
+)
+def test_run_all_limits_destinations(limits, peak):
+    configure_limits(**limits)
+    work, state = concurrency_probe()
+    results = run_all([("host", f"host:{i}", work) for i in range(8)])
+    assert state["peak"] == peak
+    assert all(result["error"] is None for result in results)
+
+
+def test_run_all_collects_results_and_errors():
+    def fail():
+        raise OSError("unreachable")
+
+    results = run_all([("a", "a:/x", lambda: 42), ("b", "b:/y", fail)])
+    assert results[0] == {"destination": "a:/x", "result": 42, "error": None}
+    assert results[1]["destination"] == "b:/y"
+    assert isinstance(results[1]["error"], OSError)
+
+
+def test_transfer_slots():
+    configure_limits(max_transfers=4, max_transfers_per_host=1)
+    work, state = concurrency_probe()
+
+    def transfer():
+        with transfer_slot("host"):
+            work()
+
+    threads = [threading.Thread(target=transfer) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert state["peak"] == 1
+
+
+def test_invalid_limit_keeps_default():
+    configure_limits(max_destinations=0)
+    assert orchestrator.limits["max_destinations"] == orchestrator.MAX_DESTINATIONS
+
+
+def test_check_cancelled():
+    cancelled = new_run()
+    cancelled.set()
+    try:
+        with pytest.raises(Cancelled):
+            check_cancelled()
+        # a cancellation before the tasks is not forgotten
+        results = run_all([("host", "label", lambda: True)])
+        assert isinstance(results[0]["error"], Cancelled)
+    finally:
+        new_run()
+    check_cancelled()
+    assert cancelled.is_set()
@@ -0,0 +1,90 @@
+import logging
+from pathlib import Path
+
+from redep.bandwidth import configure_global_limit
+from redep.plan import (
+    estimate_total,
+    format_duration,
+    plan_pull,
+    plan_push,
+    push_stages,
+)
+from redep.push import push
+from redep.util import format_size
+
+
+def test_format():
+    assert format_size(512) == "512 B"
+    assert format_size(1536) == "1.5 KiB"
+    assert format_size(3 * 1024**3) == "3.0 GiB"
+    assert format_duration(12.34) == "12.3 s"
+    assert format_duration(200) == "3 min 20 s"
+    assert format_duration(7500) == "2 h 5 min"
+
+
+def test_plan_push(tmp_path, caplog):
+    src_dir = tmp_path / "src"
+    src_dir.mkdir()
+    (src_dir / "big.bin").write_bytes(bytes(1024 * 1024))
+    (src_dir / "small.txt").write_text("small")
+    dst_dir = tmp_path / "dst"
+    destinations = [{"host": "", "path": dst_dir, "bandwidth": "1M"}]
+    with caplog.at_level(logging.INFO):
+        plan_push(src_dir, [Path("*")], [], destinations)
+    assert not dst_dir.exists()
+    assert "2 files (1.0 MiB)" in caplog.text
+    assert caplog.text.index("big.bin") < caplog.text.index("small.txt")
+    assert "Estimated time: 1.0 s" in caplog.text
+
+    push(src_dir, [Path("*")], [], destinations)
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        plan_push(src_dir, [Path("*")], [], destinations)
+    assert "0 files (0 B)" in caplog.text
+
+
+def test_plan_pull(tmp_path, caplog):
+    src_dir = tmp_path / "src"
+    src_dir.mkdir()
+    (src_dir / "file.txt").write_text("content")
+    dst_dir = tmp_path / "dst"
+    dst_dir.mkdir()
+    with caplog.at_level(logging.INFO):
+        plan_pull(dst_dir, [Path("*")], [], [{"host": "", "path": src_dir}])
+    assert not (dst_dir / "file.txt").exists()
+    assert "1 files (7 B)" in caplog.text
+    assert "unknown" in caplog.text
+
+
+def test_plan_push_snapshots_and_limits(tmp_path, caplog):
+    src_dir = tmp_path / "src"
+    src_dir.mkdir()
+    (src_dir / "file.bin").write_bytes(bytes(1024 * 1024))
+    dst_dir = tmp_path / "dst"
+    destinations = [{"host": "", "path": dst_dir, "snapshots": True}]
+    push(src_dir, [Path("*")], [], destinations)
+    with caplog.at_level(logging.INFO):
+        plan_push(src_dir, [Path("*")], [], destinations)
+    # the manifest is read from the current release
+    assert "0 files (0 B)" in caplog.text
+
+    plans = [
+        {"seconds": 1.0, "bytes": 4 * 1024**2, "remote": True},
+        {"seconds": 2.0, "bytes": 4 * 1024**2, "remote": True},
+        {"seconds": 3.0, "bytes": 1024**2, "remote": True},
+    ]
+    assert estimate_total(plans, [[0, 1, 2]]) == 3.0
+    assert estimate_total(plans, [[0, 1], [2]]) == 5.0
+    configure_global_limit("1M")
+    try:
+        # the first stage shares the global limit
+        assert estimate_total(plans, [[0, 1], [2]]) == 11.0
+    finally:
+        configure_global_limit(None)
+
+
+def test_push_stages():
+    destinations = [{"host": f"h{i}", "path": "/app"} for i in range(5)]
+    destinations.append({"host": "", "path": "local"})
+    assert push_stages(destinations) == [[0, 1, 2, 3, 4, 5]]
+    assert push_stages(destinations, fanout=2) == [[5, 0, 1], [2, 3, 4]]
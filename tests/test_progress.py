@@ -0,0 +1,76 @@
+import io
+import logging
+import time
+
+from redep import progress
+
+
+class TerminalStream(io.StringIO):
+    def isatty(self):
+        return True
+
+
+def test_describe():
+    transfer = {
+        "files": 1,
+        "bytes": 1024,
+        "total_files": 4,
+        "total_bytes": 4096,
+        "rate": 512,
+    }
+    assert progress.describe("host", transfer) == (
+        "host 1.0 KiB of 4.0 KiB, 512 B/s, 6.0 s left"
+    )
+    transfer["total_bytes"] = None
+    assert progress.describe("host", transfer) == (
+        "host 1 of 4 files, 512 B/s, 6.0 s left"
+    )
+
+
+def test_status_line(monkeypatch):
+    monkeypatch.setattr(progress, "REFRESH_INTERVAL", 0.01)
+    stream = TerminalStream()
+    with progress.show_progress(stream):
+        progress.begin("host", 2, 200)
+        progress.advance("host", 100)
+        time.sleep(0.1)
+        assert progress.transfers["host"]["bytes"] == 100
+        progress.advance("host", 100)
+    output = stream.getvalue()
+    assert "host 100 B of 200 B" in output
+    # the status line is erased at the end
+    assert output.endswith("\r\033[K")
+
+
+def test_summary_lines(monkeypatch, caplog):
+    monkeypatch.setattr(progress, "REFRESH_INTERVAL", 0.01)
+    monkeypatch.setattr(progress, "SUMMARY_INTERVAL", 0.02)
+    caplog.set_level(logging.INFO)
+    with progress.show_progress(io.StringIO()):
+        progress.begin("host", 2)
+        progress.advance("host", 10)
+        time.sleep(0.1)
+    assert "Progress: host 1 of 2 files" in caplog.text
+
+
+def test_inactive():
+    progress.begin("other", 1, 1)
+    progress.advance("other", 1)
+    assert "other" not in progress.transfers
+
+
+def test_file_progress():
+    with progress.show_progress(io.StringIO()):
+        progress.begin("host", 1, 10)
+        file_progress = progress.FileProgress("host")
+        file_progress.callback()(4, 10)
+        assert progress.transfers["host"]["bytes"] == 4
+        assert progress.transfers["host"]["files"] == 0
+        # a failed attempt does not count
+        file_progress.restart()
+        reader = file_progress.reader(io.BytesIO(b"0123456789"))
+        reader.read(6)
+        assert progress.transfers["host"]["bytes"] == 6
+        file_progress.complete(10)
+        assert progress.transfers["host"]["bytes"] == 10
+        assert progress.transfers["host"]["files"] == 1
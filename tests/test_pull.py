@@ -1,4 +1,5 @@
 import glob
+import os
 import shutil
 from pathlib import Path
 
@@ -91,3 +92,56 @@ def test_pull_with_local_source():
     existing_files = {Path(f) for f in existing_files if Path(f).is_file()}
     assert existing_files == expected_files
     clean()
+
+
+def prepare_sources(tmp_path):
+    for name in ("a", "b"):
+        (tmp_path / name / "sub").mkdir(parents=True)
+        (tmp_path / name / "common.txt").write_text(name)
+        (tmp_path / name / "sub" / f"only_{name}.txt").write_text(name)
+    # make the copy of the second source newer
+    os.utime(tmp_path / "a" / "common.txt", (1000000000, 1000000000))
+    (tmp_path / "dst").mkdir()
+    return [
+        {"host": "", "path": tmp_path / "a"},
+        {"host": "", "path": tmp_path / "b"},
+    ]
+
+
+@pytest.mark.parametrize("conflict,winner", [("first", "a"), ("newest", "b")])
+def test_pull_multiple_sources(tmp_path, conflict, winner):
+    sources = prepare_sources(tmp_path)
+    dst_dir = tmp_path / "dst"
+    pull(dst_dir, [Path("**/*")], [], sources, conflict=conflict)
+    assert (dst_dir / "common.txt").read_text() == winner
+    assert (dst_dir / "sub" / "only_a.txt").read_text() == "a"
+    assert (dst_dir / "sub" / "only_b.txt").read_text() == "b"
+
+
+def test_pull_multiple_sources_to_subdirectories(tmp_path):
+    sources = prepare_sources(tmp_path)
+    dst_dir = tmp_path / "dst"
+    pull(dst_dir, [Path("**/*")], [], sources, conflict="subdir")
+    assert (dst_dir / "local" / "common.txt").read_text() == "a"
+    assert (dst_dir / "local_2" / "common.txt").read_text() == "b"
+    assert (dst_dir / "local_2" / "sub" / "only_b.txt").exists()
+    assert not (dst_dir / "common.txt").exists()
+
+
+def test_pull_reports_failed_sources(tmp_path, monkeypatch):
+    sources = prepare_sources(tmp_path)
+    dst_dir = tmp_path / "dst"
+
+    def select_or_fail(path, matches, ignores):
+        if path == tmp_path / "a":
+            raise OSError("cannot list")
+        return select_local_patterns(path, matches, ignores)
+
+    def copy_files(pairs):
+        raise OSError("disk full")
+        yield
+
+    monkeypatch.setattr("redep.pull.select_local_patterns", select_or_fail)
+    monkeypatch.setattr("redep.pull.copy_files", copy_files)
+    results = pull(dst_dir, [Path("**/*")], [], sources)
+    assert [str(result["error"]) for result in results] == ["cannot list", "disk full"]
@@ -1,10 +1,18 @@
 import glob
+import os
+import shlex
 import shutil
-from pathlib import Path
+import subprocess
+from pathlib import Path, PurePosixPath, PureWindowsPath
+from types import SimpleNamespace
 
 import pytest
+from click.testing import CliRunner
 
-from redep.push import push, push_local
+from redep.cli import cli
+from redep.manifest import MANIFEST_NAME, empty_manifest
+from redep.push import make_remote_directories, push, push_local, push_sftp
+from redep.snapshot import switch_current_remote
 from redep.util import read_config_file, select_local_patterns
 
 
@@ -69,3 +77,166 @@ def test_push_with_local_destination():
     existing_files = {Path(f) for f in existing_files if Path(f).is_file()}
     assert existing_files == expected_files
     clean()
+
+
+def test_push_local_incremental():
+    """
+    Test that a second push only copies files changed since the first one.
+    """
+    clean()
+    config_path = Path(__file__).parent / "src_dir" / "redep.toml"
+    root_dir, matches, ignores, destinations = read_config_file(config_path)
+    selected_files, selected_dirs, _, _ = select_local_patterns(
+        root_dir, matches, ignores
+    )
+    dst_dir = Path(__file__).parent / "dst_dir"
+    push_local(selected_files, selected_dirs, root_dir, dst_dir)
+    assert (dst_dir / MANIFEST_NAME).exists()
+    # remove the copies, so that we can see which files are copied again
+    (dst_dir / "to_push.txt").unlink()
+    (dst_dir / "to_push" / "to_push.txt").unlink()
+    push_local(selected_files, selected_dirs, root_dir, dst_dir)
+    assert not (dst_dir / "to_push.txt").exists()
+    assert not (dst_dir / "to_push" / "to_push.txt").exists()
+    # a changed modification time makes the file be copied again
+    changed_file = root_dir / "to_push.txt"
+    stat = changed_file.stat()
+    os.utime(changed_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    try:
+        push_local(selected_files, selected_dirs, root_dir, dst_dir)
+    finally:
+        os.utime(changed_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert (dst_dir / "to_push.txt").exists()
+    assert not (dst_dir / "to_push" / "to_push.txt").exists()
+    # a full push copies everything
+    push_local(selected_files, selected_dirs, root_dir, dst_dir, full=True)
+    assert (dst_dir / "to_push.txt").exists()
+    assert (dst_dir / "to_push" / "to_push.txt").exists()
+    clean()
+
+
+class CommandRecorder:
+    original_host = "fake"
+
+    def __init__(self):
+        self.commands = []
+
+    def run(self, command, hide=True, warn=False):
+        self.commands.append(command)
+        return SimpleNamespace(ok=True, stderr="")
+
+    def sftp(self):
+        return None
+
+
+@pytest.mark.skipif(os.name == "nt", reason="requires a POSIX shell")
+def test_make_remote_directories(tmp_path):
+    conn = CommandRecorder()
+    remote_dirs = [PurePosixPath(tmp_path) / f"dir {i}" / "it's" for i in range(5000)]
+    make_remote_directories(conn, remote_dirs, "linux")
+    assert 1 < len(conn.commands) < 10
+    assert all(len(command) <= 100000 for command in conn.commands)
+    for command in conn.commands:
+        subprocess.run(command, shell=True, check=True)
+    assert all(Path(d).is_dir() for d in remote_dirs)
+    created = [
+        argument for command in conn.commands for argument in shlex.split(command)[3:]
+    ]
+    assert created == [str(d) for d in remote_dirs]
+
+
+def test_push_sftp_skips_created_directories(tmp_path):
+    # snapshot pushes create the directories of the release beforehand
+    conn = CommandRecorder()
+    manifest = empty_manifest()
+    dirs = {tmp_path, tmp_path / "a"}
+    assert push_sftp(
+        conn,
+        {},
+        dirs,
+        tmp_path,
+        PurePosixPath("/dst"),
+        "linux",
+        manifest,
+        dirs_created=True,
+    )
+    assert conn.commands == []
+    assert manifest["dirs"] != []
+    assert push_sftp(
+        conn,
+        {},
+        dirs,
+        tmp_path,
+        PurePosixPath("/dst"),
+        "linux",
+        {"files": {}, "dirs": []},
+    )
+    assert len(conn.commands) == 1
+
+
+def test_make_remote_directories_windows():
+    conn = CommandRecorder()
+    remote_dirs = [PureWindowsPath(f"C:\\deploy\\dir {i}\\it's") for i in range(1000)]
+    make_remote_directories(conn, remote_dirs, "windows")
+    assert 1 < len(conn.commands) < 10
+    assert all(len(command) <= 8191 for command in conn.commands)
+    assert "'C:\\deploy\\dir 0\\it''s'" in conn.commands[0]
+
+
+def test_push_local_snapshots(tmp_path):
+    src_dir = tmp_path / "src"
+    (src_dir / "sub").mkdir(parents=True)
+    (src_dir / "same.txt").write_text("same")
+    (src_dir / "sub" / "changed.txt").write_text("old")
+    dst_dir = tmp_path / "dst"
+    selection = select_local_patterns(src_dir, [Path("**/*")], [])
+    push_local(selection[0], selection[1], src_dir, dst_dir, snapshots=True)
+    first = (dst_dir / "current").resolve()
+    assert first.parent == dst_dir / "releases"
+    assert (dst_dir / "current" / "sub" / "changed.txt").read_text() == "old"
+
+    (src_dir / "sub" / "changed.txt").write_text("new")
+    selection = select_local_patterns(src_dir, [Path("**/*")], [])
+    push_local(selection[0], selection[1], src_dir, dst_dir, snapshots=True)
+    second = (dst_dir / "current").resolve()
+    assert second != first
+    assert (first / "sub" / "changed.txt").read_text() == "old"
+    assert (second / "sub" / "changed.txt").read_text() == "new"
+    assert os.path.samefile(first / "same.txt", second / "same.txt")
+    assert not os.path.samefile(
+        first / "sub" / "changed.txt", second / "sub" / "changed.txt"
+    )
+
+
+class ShellConnection:
+    original_host = "local"
+
+    def run(self, command, hide=True, warn=False):
+        result = subprocess.run(command, shell=True, capture_output=True, text=True)
+        return SimpleNamespace(
+            ok=result.returncode == 0, stdout=result.stdout, stderr=result.stderr
+        )
+
+
+@pytest.mark.skipif(os.name == "nt", reason="requires a POSIX shell")
+def test_switch_current_remote(tmp_path):
+    path = PurePosixPath(tmp_path)
+    for name in ("one", "two"):
+        (tmp_path / "releases" / name).mkdir(parents=True)
+        assert switch_current_remote(ShellConnection(), path, path / "releases" / name)
+        assert os.readlink(tmp_path / "current") == f"releases/{name}"
+    # the link was replaced, not moved into the previous release
+    assert sorted(os.listdir(tmp_path)) == ["current", "releases"]
+    assert os.listdir(tmp_path / "releases" / "one") == []
+
+
+def test_push_command_fails_with_destinations(tmp_path):
+    (tmp_path / "file.txt").write_text("content")
+    # a file where the destination directory should be
+    (tmp_path / "blocked").write_text("")
+    config_path = tmp_path / "redep.toml"
+    config_path.write_text(
+        'match = ["*.txt"]\n[[remotes]]\nhost = ""\npath = "blocked/dst"\n'
+    )
+    result = CliRunner().invoke(cli, ["push", "--config", str(config_path)])
+    assert result.exit_code == 1
@@ -0,0 +1,105 @@
+from types import SimpleNamespace
+
+import pytest
+
+from redep.relay import forward, is_relayable, push_relay, relay_children
+
+
+def test_relay_children():
+    seeds, children = relay_children(10, 3)
+    assert seeds == [0, 1, 2]
+    assert children[0] == [3, 4, 5]
+    assert children[1] == [6, 7, 8]
+    assert children[2] == [9]
+    assert all(c == [] for c in children[3:])
+    # every destination is reached exactly once
+    reached = seeds + [c for node in children for c in node]
+    assert sorted(reached) == list(range(10))
+
+
+def test_relay_children_few_destinations():
+    seeds, children = relay_children(2, 4)
+    assert seeds == [0, 1]
+    assert children == [[], []]
+
+
+def test_is_relayable():
+    assert is_relayable({"host": "server", "path": "~/app"})
+    assert not is_relayable({"host": "", "path": "../app"})
+    assert not is_relayable({"host": "server", "path": "~/app", "snapshots": True})
+    assert not is_relayable({"host": "server", "path": "~/app", "bwlimit": "1M"})
+
+
+def test_push_relay(monkeypatch):
+    destinations = [{"host": f"h{i}", "path": "/app"} for i in range(5)]
+    direct = []
+    forwarded = []
+
+    def forward(files, dirs, root_dir, parent, destination, **options):
+        forwarded.append((parent["host"], destination["host"], options["compression"]))
+        # the relay to h3 fails, and h3 is pushed to directly
+        return destination["host"] != "h3"
+
+    monkeypatch.setattr("redep.relay.forward", forward)
+    monkeypatch.setattr("redep.relay.open_connection", lambda host: host)
+    monkeypatch.setattr("redep.relay.identify_remote_os", lambda conn: "linux")
+    other = [("local", "other", lambda: "other done")]
+    results = push_relay(
+        [],
+        [],
+        "/src",
+        destinations,
+        2,
+        lambda destination: direct.append(destination["host"]) or True,
+        lambda destination: {
+            "full": False,
+            "compression": "gzip",
+            "compression_level": None,
+            "verify": False,
+        },
+        other,
+    )
+    assert sorted(direct) == ["h0", "h1", "h3"]
+    assert sorted(forwarded) == [
+        ("h0", "h2", "gzip"),
+        ("h0", "h3", "gzip"),
+        ("h1", "h4", "gzip"),
+    ]
+    assert results[0]["result"] == "other done"
+    assert len(results) == 6
+    assert all(r["error"] is None and r["result"] for r in results)
+
+
+@pytest.mark.parametrize("forward_agent", [False, True])
+def test_forward_agent_opt_in(monkeypatch, tmp_path, forward_agent):
+    (tmp_path / "file.txt").write_text("content")
+    channels = []
+
+    def open_exec_channel(conn, command, forward_agent=False):
+        channels.append(forward_agent)
+        return SimpleNamespace(sendall=lambda data: None)
+
+    monkeypatch.setattr(
+        "redep.relay.open_connection",
+        lambda host: SimpleNamespace(original_host=host, host=host, user=None, port=22),
+    )
+    monkeypatch.setattr("redep.relay.identify_remote_os", lambda conn: "linux")
+    monkeypatch.setattr(
+        "redep.relay.expand_home_path_remote", lambda conn, path, remote_os: path
+    )
+    monkeypatch.setattr("redep.relay.open_exec_channel", open_exec_channel)
+    monkeypatch.setattr("redep.relay.close_exec_channel", lambda channel: (0, ""))
+    monkeypatch.setattr("redep.relay.write_remote_manifest", lambda *args: None)
+    parent = {"host": "h0", "path": "/app"}
+    if forward_agent:
+        parent["relay_forward_agent"] = True
+    assert forward(
+        {tmp_path / "file.txt"},
+        {tmp_path},
+        tmp_path,
+        parent,
+        {"host": "h1", "path": "/app"},
+        full=True,
+    )
+    # the local agent is only forwarded to relays that ask for it
+    assert channels == [forward_agent]
@@ -0,0 +1,181 @@
+import io
+import os
+import random
+import shutil
+import subprocess
+
+import pytest
+
+from redep import resume
+from redep.resume import (
+    copy_chunks,
+    download_resumable,
+    parse_threshold,
+    partial_sums_command,
+    read_sums,
+    remote_resume_threshold,
+    sums_header,
+    upload_resumable,
+    verified_offset,
+)
+
+CHUNK = 1024
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(resume, "RESUME_CHUNK_SIZE", CHUNK)
+    monkeypatch.setattr(resume, "BLOCK_SIZE", 256)
+
+
+class LocalFile(io.FileIO):
+    def prefetch(self, file_size=None, max_concurrent_requests=None):
+        pass
+
+    def set_pipelined(self, pipelined=True):
+        pass
+
+
+class LocalSftp:
+    """Serve local files like an SFTP client."""
+
+    def open(self, path, mode="rb"):
+        return LocalFile(path, mode.replace("b", ""))
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def truncate(self, path, size):
+        os.truncate(path, size)
+
+    def chmod(self, path, mode):
+        os.chmod(path, mode)
+
+    def posix_rename(self, old_path, new_path):
+        os.replace(old_path, new_path)
+
+    def remove(self, path):
+        os.remove(path)
+
+
+def record(data, signature):
+    """Return the sums of copying data, and the copy."""
+    target = io.BytesIO()
+    sums = io.BytesIO(sums_header(signature).encode())
+    sums.seek(0, io.SEEK_END)
+    copy_chunks(io.BytesIO(data), target, sums, 0, len(data))
+    sums.seek(0)
+    return sums, target.getvalue()
+
+
+def test_copy_and_verify():
+    data = random.Random(0).randbytes(5 * CHUNK + 100)
+    signature = (len(data), 1.5)
+    sums, copy = record(data, signature)
+    assert copy == data
+    header, digests = read_sums(sums)
+    assert len(digests) == 6
+    # only complete chunks of the partial file are kept
+    assert (
+        verified_offset(header, digests, signature, 3 * CHUNK + 10, io.BytesIO(copy))
+        == 3 * CHUNK
+    )
+    # a corrupted chunk and those after it are transferred again
+    corrupted = copy[:CHUNK] + b"x" + copy[CHUNK + 1 :]
+    assert (
+        verified_offset(header, digests, signature, len(copy), io.BytesIO(corrupted))
+        == CHUNK
+    )
+    # nothing is kept if the source changed
+    assert (
+        verified_offset(header, digests, (len(data), 2.0), len(copy), io.BytesIO(copy))
+        == 0
+    )
+
+
+def test_read_sums_ignores_incomplete_line():
+    header, digests = read_sums(io.BytesIO(b'{"size": 1}\nabc\nde'))
+    assert header == '{"size": 1}\n'
+    assert digests == ["abc"]
+    assert read_sums(io.BytesIO(b'{"size"')) == (None, [])
+
+
+def test_download_resumes(tmp_path):
+    data = random.Random(1).randbytes(4 * CHUNK + 7)
+    source = tmp_path / "source.bin"
+    source.write_bytes(data)
+    signature = (len(data), 1.0)
+    local_path = tmp_path / "local.bin"
+    # an interrupted download left two chunks, the second one corrupted
+    sums, _ = record(data[: 2 * CHUNK], signature)
+    (tmp_path / "local.bin.redep-sums").write_bytes(sums.getvalue())
+    (tmp_path / "local.bin.redep-partial").write_bytes(data[:CHUNK] + bytes(CHUNK))
+    transferred = []
+    download_resumable(
+        LocalSftp(),
+        str(source),
+        local_path,
+        signature,
+        lambda done, total: transferred.append(total),
+    )
+    assert local_path.read_bytes() == data
+    assert transferred[-1] == len(data) - CHUNK
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["local.bin", "source.bin"]
+
+
+def shell_partial_sums(str_path, count):
+    result = subprocess.run(
+        partial_sums_command(str_path, count), shell=True, capture_output=True
+    )
+    return [line.split()[0] for line in result.stdout.decode().splitlines()]
+
+
+@pytest.mark.parametrize(
+    "partial_sums",
+    [
+        None,
+        pytest.param(
+            shell_partial_sums,
+            marks=pytest.mark.skipif(
+                shutil.which("sha256sum") is None, reason="requires sha256sum"
+            ),
+        ),
+    ],
+)
+def test_upload_checks_partial_file(tmp_path, partial_sums):
+    data = random.Random(2).randbytes(4 * CHUNK + 7)
+    local_path = tmp_path / "local.bin"
+    local_path.write_bytes(data)
+    signature = (len(data), 1.0)
+    remote_path = tmp_path / "remote.bin"
+    # the sums record two chunks, but the second one of the partial file differs
+    sums, _ = record(data[: 2 * CHUNK], signature)
+    (tmp_path / "remote.bin.redep-sums").write_bytes(sums.getvalue())
+    (tmp_path / "remote.bin.redep-partial").write_bytes(data[:CHUNK] + bytes(CHUNK))
+    transferred = []
+    upload_resumable(
+        LocalSftp(),
+        local_path,
+        str(remote_path),
+        signature,
+        lambda done, total: transferred.append(total),
+        partial_sums=partial_sums,
+    )
+    assert remote_path.read_bytes() == data
+    assert transferred[-1] == len(data) - CHUNK
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["local.bin", "remote.bin"]
+
+
+def test_remote_resume_threshold():
+    assert remote_resume_threshold({}) == resume.RESUME_THRESHOLD
+    assert remote_resume_threshold({"compression": "none"}) == resume.RESUME_THRESHOLD
+    # resumable transfers are not compressed, so compression wins by default
+    assert remote_resume_threshold({"compression": "zstd"}) is None
+    assert remote_resume_threshold(
+        {"compression": "zstd", "resume_threshold": "1M"}
+    ) == (1024**2)
+
+
+def test_parse_threshold():
+    assert parse_threshold("1M") == 1024**2
+    assert parse_threshold(False) is None
@@ -0,0 +1,96 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from redep import session
+from redep.util import expand_home_path_remote, identify_remote_os
+
+
+class FakeConnection:
+    def __init__(self, host):
+        self.original_host = host
+        self.is_connected = True
+        self.commands = []
+
+    def run(self, command, hide=True, warn=False):
+        self.commands.append(command)
+        if command == "uname -s":
+            return SimpleNamespace(ok=True, stdout="Linux\n")
+        return SimpleNamespace(ok=True, stdout="/home/user\n")
+
+    def close(self):
+        self.is_connected = False
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setenv("LOCALAPPDATA", str(tmp_path))
+    monkeypatch.setattr(session, "facts", None)
+    monkeypatch.setattr(session, "connections", {})
+    return tmp_path
+
+
+def test_connection_is_opened_once(cache):
+    opened = []
+
+    def opener(host):
+        opened.append(host)
+        return FakeConnection(host)
+
+    first = session.get_connection("host", opener)
+    assert session.get_connection("host", opener) is first
+    first.close()
+    assert session.get_connection("host", opener) is not first
+    assert opened == ["host", "host"]
+    session.close_connections()
+    assert session.connections == {}
+
+
+def test_remote_facts_are_cached(cache, monkeypatch):
+    conn = FakeConnection("host")
+    assert identify_remote_os(conn) == "linux"
+    assert str(expand_home_path_remote(conn, "~/a", "linux")) == "/home/user/a"
+    assert identify_remote_os(conn) == "linux"
+    assert str(expand_home_path_remote(conn, "~/b", "linux")) == "/home/user/b"
+    assert conn.commands == ["uname -s", "echo $HOME"]
+    # a later run reads the facts from disk
+    monkeypatch.setattr(session, "facts", None)
+    conn = FakeConnection("host")
+    assert identify_remote_os(conn) == "linux"
+    assert conn.commands == []
+    assert session.cache_path().is_file()
+
+
+def test_remote_facts_expire(cache, monkeypatch):
+    session.set_fact("host", "os", "linux")
+    monkeypatch.setattr(session, "facts", None)
+    monkeypatch.setenv("REDEP_CACHE_TTL", "0.001")
+    time.sleep(0.01)
+    assert session.get_fact("host", "os") is None
+
+
+def test_disk_cache_can_be_disabled(cache, monkeypatch):
+    monkeypatch.setenv("REDEP_CACHE_TTL", "0")
+    session.set_fact("host", "os", "linux")
+    assert session.get_fact("host", "os") == "linux"
+    assert not session.cache_path().exists()
+
+
+def test_remote_facts_expire_in_long_runs(cache, monkeypatch):
+    # like the daemon, which keeps the facts in memory between commands
+    now = [1000.0]
+    monkeypatch.setattr(session.time, "time", lambda: now[0])
+    monkeypatch.setenv("REDEP_CACHE_TTL", "60")
+    conn = FakeConnection("host")
+    assert identify_remote_os(conn) == "linux"
+    now[0] += 30
+    assert identify_remote_os(conn) == "linux"
+    assert conn.commands == ["uname -s"]
+    now[0] += 31
+    assert identify_remote_os(conn) == "linux"
+    assert conn.commands == ["uname -s", "uname -s"]
+    # the new facts are fresh again
+    now[0] += 30
+    assert session.get_fact("host", "os") == "linux"
@@ -1,8 +1,23 @@
-from pathlib import Path
+import glob
+import random
+import shutil
+import subprocess
+import threading
+from pathlib import Path, PurePosixPath, PureWindowsPath
+from types import SimpleNamespace
 
 import pytest
 
-from redep.util import read_config_file, select_leaf_directories, select_local_patterns
+from redep import session
+from redep.util import (
+    classify_entries,
+    compile_patterns,
+    list_remote_tree,
+    read_config_file,
+    run_with_channels,
+    select_leaf_directories,
+    select_local_patterns,
+)
 
 
 def test_read_config_file():
@@ -37,10 +52,10 @@ def test_select_local_patterns():
         root_dir,
         root_dir / "to_push",
     }
+    # to_ignore/** prunes the directory, so its content is not listed
     expected_ignored_files = {
         root_dir / "redep.toml",
         root_dir / "to_ignore.txt",
-        root_dir / "to_ignore" / "to_ignore.txt",
     }
     expected_ignored_dirs = {
         root_dir / "to_ignore",
@@ -53,6 +68,57 @@ def test_select_local_patterns():
         assert f.parent in selected_dirs
 
 
+def select_local_patterns_with_glob(root_dir, match_patterns, ignore_patterns):
+    """Reference implementation, with one glob per pattern."""
+    matched = set()
+    for pattern in match_patterns:
+        matched.update(
+            glob.glob(str(root_dir / pattern), recursive=True, include_hidden=True)
+        )
+    ignored = set()
+    for pattern in ignore_patterns:
+        ignored.update(
+            glob.glob(str(root_dir / pattern), recursive=True, include_hidden=True)
+        )
+    selected = {Path(f) for f in matched} - {Path(f) for f in ignored}
+    files = {f for f in selected if f.is_file()}
+    dirs = {d for d in selected if d.is_dir()}
+    dirs.add(root_dir)
+    return files, dirs
+
+
+def test_select_local_patterns_matches_glob(tmp_path):
+    for relative_path in [
+        "a.txt",
+        ".hidden",
+        "src/main.py",
+        "src/.cache/x.pyc",
+        "src/deep/er/file with spaces.py",
+        "node_modules/pkg/index.js",
+        "lib/node_modules/pkg/index.js",
+        "build/out.o",
+        "docs/readme.md",
+    ]:
+        (tmp_path / relative_path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / relative_path).write_text("x")
+    (tmp_path / "empty").mkdir()
+    cases = [
+        (["*", "**/*"], ["**/node_modules/**", "./build/**"]),
+        (["**/*.py", "docs/*"], ["**/.cache/**"]),
+        (["**"], ["*.txt", "src/deep/**"]),
+        (["src/**"], []),
+    ]
+    for matches, ignores in cases:
+        matches = [Path(p) for p in matches]
+        ignores = [Path(p) for p in ignores]
+        selected_files, selected_dirs, _, _ = select_local_patterns(
+            tmp_path, matches, ignores
+        )
+        assert (selected_files, selected_dirs) == select_local_patterns_with_glob(
+            tmp_path, matches, ignores
+        )
+
+
 def test_select_leaf_directories():
     dirs = {
         Path("a"),
@@ -70,3 +136,199 @@ def test_select_leaf_directories():
         Path("f"),
     }
     assert select_leaf_directories(dirs) == expected_leaf_dirs
+
+
+def test_compile_patterns_matches_glob():
+    root_dir = Path(__file__).parent / "src_dir"
+    entries = {}
+    for path in root_dir.rglob("*"):
+        entries[path.relative_to(root_dir).as_posix()] = path.is_dir()
+    patterns = ["*", "**/*", "**", "./to_ignore/**", "**/*.txt", "to_*/*", "[t]o_push*"]
+    for pattern in patterns:
+        expected = {
+            Path(p)
+            for p in glob.glob(
+                str(root_dir / pattern), recursive=True, include_hidden=True
+            )
+        }
+        expected.discard(root_dir)
+        regex = compile_patterns([Path(pattern)])
+        matched = {
+            root_dir / p
+            for p, is_dir in entries.items()
+            if regex.fullmatch(p + "/" if is_dir else p)
+        }
+        assert matched == expected, pattern
+
+
+def test_classify_entries():
+    root_dir = PurePosixPath("/remote/root")
+    entries = [
+        ("file with spaces.txt", False),
+        ("dir", True),
+        ("dir/nested.txt", False),
+        ("ignored", True),
+        ("ignored/inner.txt", False),
+        ("skip.log", False),
+    ]
+    selected_files, selected_dirs, ignored_files, ignored_dirs = classify_entries(
+        root_dir, entries, [Path("**/*")], [Path("ignored/**"), Path("*.log")]
+    )
+    assert selected_files == {
+        root_dir / "file with spaces.txt",
+        root_dir / "dir" / "nested.txt",
+    }
+    assert selected_dirs == {root_dir, root_dir / "dir"}
+    assert ignored_files == {root_dir / "ignored" / "inner.txt", root_dir / "skip.log"}
+    assert ignored_dirs == {root_dir / "ignored"}
+
+
+def select_leaf_directories_pairwise(directories):
+    """Reference implementation, comparing every pair of directories."""
+    return {
+        d1
+        for d1 in directories
+        if not any(d1 != d2 and d2.is_relative_to(d1) for d2 in directories)
+    }
+
+
+def test_select_leaf_directories_matches_pairwise():
+    rng = random.Random(0)
+    names = ["a", "b", "a b", "a.b", "a-", "ab", "B"]
+    for path_type, root in [
+        (PurePosixPath, "/root"),
+        (PurePosixPath, "relative"),
+        (PureWindowsPath, "C:\\root"),
+    ]:
+        for _ in range(50):
+            dirs = {path_type(root)}
+            for _ in range(rng.randint(0, 40)):
+                parts = rng.choices(names, k=rng.randint(1, 4))
+                dirs.add(path_type(root, *parts))
+            assert select_leaf_directories(dirs) == select_leaf_directories_pairwise(
+                dirs
+            )
+
+
+def test_select_leaf_directories_windows_case():
+    dirs = {PureWindowsPath("C:/Root"), PureWindowsPath("c:/root/Sub")}
+    assert select_leaf_directories(dirs) == {PureWindowsPath("c:/root/Sub")}
+
+
+class FakeSFTP:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    original_host = "fake"
+
+    def __init__(self):
+        self.sessions = []
+        self.client = self
+
+    def sftp(self):
+        return self.open_sftp()
+
+    def open_sftp(self):
+        session = FakeSFTP()
+        self.sessions.append(session)
+        return session
+
+
+@pytest.mark.parametrize("channels", [1, 4])
+def test_run_with_channels(channels):
+    conn = FakeConnection()
+    done = []
+    threads = set()
+
+    def transfer(sftp, item):
+        assert not sftp.closed
+        threads.add(threading.get_ident())
+        done.append(item)
+
+    assert run_with_channels(conn, range(100), transfer, channels) == []
+    assert sorted(done) == list(range(100))
+    assert len(conn.sessions) == channels
+    if channels == 1:
+        assert threads == {threading.get_ident()}
+    else:
+        assert all(session.closed for session in conn.sessions)
+
+
+def test_run_with_channels_reports_failures():
+    def transfer(sftp, item):
+        if item % 10 == 0:
+            raise OSError("failed")
+
+    failed = run_with_channels(FakeConnection(), range(100), transfer, 3)
+    assert sorted(failed) == list(range(0, 100, 10))
+    with pytest.raises(OSError):
+        run_with_channels(FakeConnection(), range(100), transfer, 1)
+
+
+class ShellConnection:
+    """Run commands in a local shell, pretending find is BSD find if asked."""
+
+    original_host = "host"
+
+    def __init__(self, gnu_find=True):
+        self.gnu_find = gnu_find
+        self.commands = []
+
+    def run(self, command, hide=True, warn=False):
+        self.commands.append(command)
+        if command == "find --version" and not self.gnu_find:
+            return SimpleNamespace(ok=False, stdout="", stderr="")
+        if "-exec stat -f" in command:
+            # the output of BSD stat
+            return SimpleNamespace(
+                ok=True,
+                stdout="Directory\t64\t1700000000\t/root/a\n"
+                "Regular File\t5\t1700000001\t/root/a/file.txt\n",
+                stderr="",
+            )
+        result = subprocess.run(command, shell=True, capture_output=True, text=True)
+        return SimpleNamespace(
+            ok=result.returncode == 0, stdout=result.stdout, stderr=result.stderr
+        )
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(session, "facts", None)
+
+
+@pytest.mark.skipif(shutil.which("find") is None, reason="requires find")
+def test_list_remote_tree_with_gnu_find(tmp_path, cache):
+    conn = ShellConnection()
+    if not conn.run("find --version").ok:
+        pytest.skip("requires GNU find")
+    root_dir = tmp_path / "root"
+    (root_dir / "a").mkdir(parents=True)
+    (root_dir / "a" / "file.txt").write_text("12345")
+    (root_dir / "cache-1").mkdir()
+    (root_dir / "cache-1" / "skipped.txt").write_text("")
+    entries = list_remote_tree(conn, root_dir, "linux", ["**/cache-*/**"])
+    assert sorted((path, kind) for path, kind, _, _ in entries) == [
+        ("a", "d"),
+        ("a/file.txt", "f"),
+        ("cache-1", "d"),
+    ]
+
+
+def test_list_remote_tree_without_gnu_find(cache):
+    conn = ShellConnection(gnu_find=False)
+    entries = list_remote_tree(conn, PurePosixPath("/root"), "darwin")
+    assert entries == [
+        ("a", "d", 64, 1700000000.0),
+        ("a/file.txt", "f", 5, 1700000001.0),
+    ]
+    assert "-printf" not in conn.commands[-1]
+    # the kind of find is probed once
+    list_remote_tree(conn, PurePosixPath("/root"), "darwin")
+    assert conn.commands.count("find --version") == 1
@@ -0,0 +1,45 @@
+import hashlib
+import io
+
+from redep import verify
+from redep.util import HashingReader, HashingWriter
+from redep.verify import hash_file, verify_copies, windows_batches
+
+
+def test_hashing_streams():
+    data = bytes(range(256)) * 100
+    hasher = hashlib.sha256()
+    reader = HashingReader(io.BytesIO(data), hasher)
+    while reader.read(1000):
+        pass
+    assert hasher.hexdigest() == hashlib.sha256(data).hexdigest()
+    hasher = hashlib.sha256()
+    output = io.BytesIO()
+    HashingWriter(output, hasher).write(data)
+    assert output.getvalue() == data
+    assert hasher.hexdigest() == hashlib.sha256(data).hexdigest()
+
+
+def test_verify_copies(tmp_path, monkeypatch):
+    source = tmp_path / "source.txt"
+    source.write_text("content")
+    good = tmp_path / "good.txt"
+    good.write_text("content")
+    bad = tmp_path / "bad.txt"
+    bad.write_text("corrupted")
+    assert verify_copies([(source, good), (source, bad)], "local") == []
+    assert hash_file(bad) == hash_file(source)
+    # a copy that keeps failing is reported
+    monkeypatch.setattr(verify, "copy_file", lambda source, destination: None)
+    bad.write_text("corrupted")
+    assert verify_copies([(source, bad)], "local") == [source]
+
+
+def test_windows_batches(monkeypatch):
+    monkeypatch.setattr(verify, "WINDOWS_COMMAND_LIMIT", 300)
+    paths = [f"/C:\\data\\file{i:03}.txt" for i in range(20)]
+    batches = list(windows_batches(paths))
+    assert len(batches) > 1
+    assert [p for batch in batches for p in batch] == paths
+    for batch in batches:
+        assert sum(len(p) + 3 for p in batch) <= 100
@@ -0,0 +1,93 @@
+import re
+import sys
+from pathlib import Path
+
+import pytest
+
+from redep.manifest import read_local_manifest
+from redep.push import push_selection
+from redep.util import select_local_patterns
+from redep.watch import (
+    InotifyWatcher,
+    PollingWatcher,
+    collect_changes,
+    select_changed,
+)
+
+NOTHING = re.compile("(?!)")
+
+
+@pytest.mark.parametrize(
+    "watcher_class",
+    [
+        pytest.param(
+            InotifyWatcher,
+            marks=pytest.mark.skipif(
+                not sys.platform.startswith("linux"), reason="requires inotify"
+            ),
+        ),
+        PollingWatcher,
+    ],
+)
+def test_watcher(tmp_path, watcher_class):
+    (tmp_path / "existing.txt").write_text("a")
+    watcher = watcher_class(tmp_path, NOTHING)
+    if watcher_class is PollingWatcher:
+        watcher.interval = 0.01
+    try:
+        (tmp_path / "existing.txt").write_text("b")
+        (tmp_path / "new" / "deep").mkdir(parents=True)
+        (tmp_path / "new" / "deep" / "file.txt").write_text("c")
+        changed = collect_changes(watcher, debounce=0.1)
+    finally:
+        watcher.close()
+    assert {"existing.txt", "new", "new/deep", "new/deep/file.txt"} <= changed
+
+
+def test_select_changed(tmp_path):
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    (tmp_path / "a" / "b" / "keep.txt").write_text("x")
+    (tmp_path / "a" / "skip.log").write_text("x")
+    changed = {"a/b/keep.txt", "a/skip.log", "deleted.txt"}
+    files, dirs = select_changed(
+        tmp_path, changed, [Path("**/*")], [Path("**/*.log")], True
+    )
+    assert files == {tmp_path / "a" / "b" / "keep.txt"}
+    assert dirs == {tmp_path, tmp_path / "a", tmp_path / "a" / "b"}
+
+
+def test_partial_push_keeps_manifest(tmp_path):
+    src_dir = tmp_path / "src"
+    src_dir.mkdir()
+    (src_dir / "one.txt").write_text("1")
+    (src_dir / "two.txt").write_text("2")
+    destinations = [{"host": "", "path": tmp_path / "dst"}]
+    files, dirs, _, _ = select_local_patterns(src_dir, [Path("*")], [])
+    push_selection(files, dirs, src_dir, destinations)
+    (src_dir / "two.txt").write_text("changed")
+    push_selection(
+        {src_dir / "two.txt"}, {src_dir}, src_dir, destinations, partial=True
+    )
+    assert (tmp_path / "dst" / "two.txt").read_text() == "changed"
+    manifest = read_local_manifest(tmp_path / "dst")
+    assert set(manifest["files"]) == {"one.txt", "two.txt"}
+
+
+def test_partial_push_to_snapshots(tmp_path):
+    src_dir = tmp_path / "src"
+    (src_dir / "a").mkdir(parents=True)
+    (src_dir / "b").mkdir()
+    (src_dir / "a" / "x.txt").write_text("x")
+    (src_dir / "b" / "y.txt").write_text("y")
+    destinations = [{"host": "", "path": tmp_path / "dst", "snapshots": True}]
+    files, dirs, _, _ = select_local_patterns(src_dir, [Path("**/*")], [])
+    push_selection(files, dirs, src_dir, destinations)
+    (src_dir / "a" / "x.txt").write_text("changed")
+    files, dirs = select_changed(src_dir, {"a/x.txt"}, [Path("**/*")], [], True)
+    push_selection(files, dirs, src_dir, destinations, partial=True)
+    current = tmp_path / "dst" / "current"
+    assert (current / "a" / "x.txt").read_text() == "changed"
+    assert (current / "b" / "y.txt").read_text() == "y"
+    manifest = read_local_manifest(current)
+    assert {"a/x.txt", "b/y.txt"} <= set(manifest["files"])
+    assert {"a", "b"} <= set(manifest["dirs"])